@@ -48,7 +48,16 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "drive.authentication.CachedTokenAuthentication",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "drive.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "drive.parsers.MultiPartParser",
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
@@ -62,6 +71,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    "drive.middleware.RequestMetricsMiddleware",
+    "drive.middleware.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -113,6 +124,28 @@ DATABASES = {
     }
 }
 
+# Read replicas are further entries mirroring "default", listed in
+# DRIVE_READ_REPLICAS, e.g.
+# DATABASES["replica1"] = {
+#     **DATABASES["default"],
+#     "HOST": "<replica_hostname_or_ip>",
+#     "TEST": {"MIRROR": "default"},
+# }
+
+DATABASE_ROUTERS = ["drive.routers.ReplicaRouter"]
+
+# Caches: "default" is local to each process, "shared" is seen by every
+# worker and backs the change feed wakeups and read-your-writes pinning
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://<redis_hostname_or_ip>:6379/0",
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -150,7 +183,214 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+STORAGES = {
+    "default": {"BACKEND": "drive.storage.CompressedFileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Drive
+# Chunked uploads: default and maximum chunk size a client may request
+
+DRIVE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+DRIVE_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Downloads: stream from Python in blocks of this size, or hand the transfer
+# off to the front proxy with "nginx" (X-Accel-Redirect) or "xsendfile"
+
+DRIVE_DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+DRIVE_SENDFILE_BACKEND = None
+
+DRIVE_SENDFILE_URL_PREFIX = "/protected/"
+
+# Uploads are written to the storage volume, hashed and sniffed in one pass
+
+FILE_UPLOAD_HANDLERS = ["drive.uploadhandlers.DigestUploadHandler"]
+
+# Access checks: resolved levels are cached for DRIVE_ACL_CACHE_TTL seconds,
+# per process, or in the cache aliased by DRIVE_ACL_CACHE, which replaces the
+# per-process cache so revocations reach every worker at once
+
+DRIVE_ACL_CACHE = None
+
+DRIVE_ACL_CACHE_SIZE = 10000
+
+DRIVE_ACL_CACHE_TTL = 30
+
+# Listings: page size when a client asks for cursor pagination, and whether
+# file, group and shared listings are rendered from values() rows instead of
+# through the serializers
+
+DRIVE_PAGE_SIZE = 100
+
+DRIVE_MAX_PAGE_SIZE = 1000
+
+DRIVE_FAST_SERIALIZATION = True
+
+# Batch uploads: files accepted per request, as form fields or archive members,
+# and the bytes the members of an archive may expand to
+
+DRIVE_BATCH_MAX_FILES = 1000
+
+DRIVE_BATCH_MAX_EXTRACTED_SIZE = 4 * 1024 * 1024 * 1024
+
+DATA_UPLOAD_MAX_NUMBER_FILES = DRIVE_BATCH_MAX_FILES
+
+# Bulk permissions: file/user pairs granted or revoked per request
+
+DRIVE_BULK_MAX_PAIRS = 10000
+
+# Authentication: valid tokens are cached per process for DRIVE_AUTH_CACHE_TTL
+# seconds, set DRIVE_AUTH_CACHE to a cache alias to share them between workers
+
+DRIVE_AUTH_CACHE = None
+
+DRIVE_AUTH_CACHE_SIZE = 10000
+
+DRIVE_AUTH_CACHE_TTL = 60
+
+# Change feed: longest a client may wait for changes, and how often a waiting
+# request checks DRIVE_CHANGES_CACHE, which must be shared by all workers
+# (Redis, Memcached); "check --deploy" refuses a local-memory one. A waiting
+# request holds its worker for up to DRIVE_CHANGES_MAX_WAIT seconds, a whole
+# process with sync workers, so serve the feed from threaded workers; at most
+# DRIVE_CHANGES_MAX_POLLERS requests wait at once in each process
+
+DRIVE_CHANGES_MAX_WAIT = 30
+
+DRIVE_CHANGES_POLL_INTERVAL = 0.5
+
+DRIVE_CHANGES_CACHE = "shared"
+
+DRIVE_CHANGES_MAX_POLLERS = 16
+
+# Feed entries are deleted by collect_garbage after DRIVE_CHANGES_RETENTION
+# seconds, clients whose cursor is older are told to list everything again
+
+DRIVE_CHANGES_RETENTION = 30 * 24 * 60 * 60
+
+# Delta updates: default block size of the signatures served to clients, and
+# the cache holding them, keyed by content digest; manifests are refused when
+# they hold more instructions or build more bytes than the limits below
+
+DRIVE_DELTA_BLOCK_SIZE = 64 * 1024
+
+DRIVE_DELTA_CACHE = "default"
+
+DRIVE_DELTA_MAX_INSTRUCTIONS = 100000
+
+DRIVE_DELTA_MAX_SIZE = 16 * 1024 * 1024 * 1024
+
+# Quotas: bytes each user may store unless StorageUsage.quota says otherwise,
+# None for no limit
+
+DRIVE_DEFAULT_QUOTA = None
+
+# Garbage collection: blobs and files unused for DRIVE_GC_GRACE_PERIOD seconds
+# are deleted, upload sessions expire after DRIVE_UPLOAD_SESSION_TTL seconds
+
+DRIVE_GC_GRACE_PERIOD = 60 * 60
+
+DRIVE_GC_BATCH_SIZE = 500
+
+DRIVE_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Background jobs: dotted paths of callables run by the run_jobs workers on
+# every new blob, e.g. a virus scanner, how failed jobs are retried, and how
+# long collect_garbage keeps finished and failed ones
+
+DRIVE_BLOB_PROCESSORS = ["drive.previews.generate"]
+
+DRIVE_JOB_MAX_ATTEMPTS = 5
+
+DRIVE_JOB_BACKOFF_BASE = 10
+
+DRIVE_JOB_BACKOFF_MAX = 60 * 60
+
+DRIVE_JOB_TIMEOUT = 30 * 60
+
+DRIVE_JOB_RETENTION = 7 * 24 * 60 * 60
+
+# Previews: sizes (longest edge, in pixels) rendered for images, and for PDFs
+# when poppler's pdftoppm is installed; Pillow is required for both
+
+DRIVE_PREVIEW_SIZES = (128, 256, 512)
+
+DRIVE_PREVIEW_QUALITY = 80
+
+# Storage: compressible content is gzipped at this level (None disables it),
+# when it is at least DRIVE_COMPRESSION_MIN_SIZE bytes and shrinks below
+# DRIVE_COMPRESSION_MAX_RATIO of its size
+
+DRIVE_COMPRESSION_LEVEL = 6
+
+DRIVE_COMPRESSION_MIN_SIZE = 1024
+
+DRIVE_COMPRESSION_MAX_RATIO = 0.9
+
+# Signed links: lifetime of download links, by default and at most; their
+# versions are cached per process for DRIVE_LINK_CACHE_TTL seconds, set
+# DRIVE_LINK_CACHE to a cache alias to share them between workers
+
+DRIVE_LINK_TTL = 60 * 60
+
+DRIVE_LINK_MAX_TTL = 7 * 24 * 60 * 60
+
+DRIVE_LINK_CACHE = None
+
+DRIVE_LINK_CACHE_SIZE = 10000
+
+DRIVE_LINK_CACHE_TTL = 30
+
+# Metrics: per-request timings are served in the Prometheus text format at
+# /api/v1/metrics/ to staff users and to scrapers sending "Authorization:
+# Bearer <DRIVE_METRICS_TOKEN>"; requests slower than DRIVE_SLOW_REQUEST_SECONDS
+# are logged to "drive.metrics" with their queries (None logs none)
+
+DRIVE_METRICS = True
+
+DRIVE_METRICS_TOKEN = None
+
+DRIVE_SLOW_REQUEST_SECONDS = 1.0
+
+DRIVE_SLOW_REQUEST_QUERIES = 10
+
+# Read replicas: aliases in DATABASES the reads of GET requests are spread
+# over. Replicas more than DRIVE_REPLICA_MAX_LAG seconds behind (measured
+# every DRIVE_REPLICA_LAG_CHECK_INTERVAL seconds) or unreachable are skipped,
+# and users read from the primary until a replica has their last write; the
+# time of that write is kept in DRIVE_REPLICA_PIN_CACHE, which must be a cache
+# shared by all workers (Redis, Memcached), the drive.E001 check refuses a
+# local-memory one. The database role reading the replicas needs
+# pg_read_all_stats to see whether their WAL receiver is connected
+
+DRIVE_READ_REPLICAS = []
+
+DRIVE_REPLICA_MAX_LAG = 5
+
+DRIVE_REPLICA_LAG_CHECK_INTERVAL = 2
+
+DRIVE_REPLICA_PIN_CACHE = "shared"
+
+# Search: file and group names are matched with pg_trgm indexes on PostgreSQL
+# (the migration creates the extension, which needs the privilege to), and
+# through a table of their words elsewhere, or with DRIVE_SEARCH_BACKEND =
+# "tokens"; rebuild that table with the rebuild_search_index command. There,
+# a word prefixing fewer than DRIVE_SEARCH_CANDIDATES words of names is looked
+# up first, otherwise the names of the files the user can see are checked
+DRIVE_SEARCH_BACKEND = None
+
+DRIVE_SEARCH_LIMIT = 50
+
+DRIVE_SEARCH_MAX_LIMIT = 200
+
+DRIVE_SEARCH_SUGGESTIONS = 10
+
+DRIVE_SEARCH_CANDIDATES = 1000
@@ -0,0 +1,170 @@
+import operator
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import acl, changes, links
+from .models import Change, File, FileAccess, Permission, Sharing
+
+DELETE_BATCH_SIZE = 500
+
+_deferred = threading.local()
+
+
+def resolve_pairs(pairs):
+    """
+    Compute the effective ``(level, source)`` of each ``(file_id, user_id)``
+    pair from ownership, ``Permission`` and ``Sharing`` rows. Pairs without
+    any access map to None.
+    """
+    file_ids = {file_id for file_id, _ in pairs}
+    user_ids = {user_id for _, user_id in pairs}
+    owners = dict(File.objects.filter(pk__in=file_ids).values_list("pk", "owner_id"))
+    permissions = {
+        (file_id, user_id): permission
+        for file_id, user_id, permission in Permission.objects.filter(
+            file_id__in=file_ids, user_id__in=user_ids
+        ).values_list("file_id", "user_id", "permission")
+    }
+    shared = set(
+        Sharing.objects.filter(
+            shared_file_id__in=file_ids, shared_with_id__in=user_ids
+        ).values_list("shared_file_id", "shared_with_id")
+    )
+    resolved = {}
+    for file_id, user_id in pairs:
+        if owners.get(file_id) == user_id:
+            resolved[file_id, user_id] = (FileAccess.OWNER, FileAccess.OWNER)
+        elif (file_id, user_id) in permissions:
+            resolved[file_id, user_id] = (
+                permissions[file_id, user_id],
+                FileAccess.PERMISSION,
+            )
+        elif (file_id, user_id) in shared:
+            resolved[file_id, user_id] = (Permission.READ, FileAccess.SHARING)
+        else:
+            resolved[file_id, user_id] = None
+    return resolved
+
+
+def sync(pairs):
+    """
+    Bring the access rows of the given ``(file_id, user_id)`` pairs in line
+    with their sources. Call it after writes that bypass model signals.
+    """
+    pending = getattr(_deferred, "pairs", None)
+    if pending is not None:
+        pending.update(pairs)
+        return
+    pairs = set(pairs)
+    if not pairs:
+        return
+    upserts = []
+    revoked = defaultdict(list)
+    for (file_id, user_id), grant in resolve_pairs(pairs).items():
+        if grant is None:
+            revoked[file_id].append(user_id)
+        else:
+            level, source = grant
+            upserts.append(
+                FileAccess(file_id=file_id, user_id=user_id, level=level, source=source)
+            )
+    with transaction.atomic():
+        # Gaining, changing or losing access is a change for that user
+        changes.record(
+            [(row.user_id, Change.FILE, row.file_id, Change.UPDATED) for row in upserts]
+            + [
+                (user_id, Change.FILE, file_id, Change.DELETED)
+                for file_id, user_ids in revoked.items()
+                for user_id in user_ids
+            ]
+        )
+        if upserts:
+            FileAccess.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=["user", "file"],
+                update_fields=["level", "source", "updated_at"],
+            )
+        revoked = list(revoked.items())
+        # One delete per batch of files, small enough for SQLite's depth limit
+        for start in range(0, len(revoked), DELETE_BATCH_SIZE):
+            FileAccess.objects.filter(
+                reduce(
+                    operator.or_,
+                    (
+                        Q(file_id=file_id, user_id__in=user_ids)
+                        for file_id, user_ids in revoked[
+                            start : start + DELETE_BATCH_SIZE
+                        ]
+                    ),
+                )
+            ).delete()
+        # Links issued with the access that is gone must not outlive it
+        links.revoke_lost_access(
+            (file_id, user_id) for file_id, user_ids in revoked for user_id in user_ids
+        )
+    for file_id, user_id in pairs:
+        acl.invalidate(file_id, [user_id])
+
+
+@contextmanager
+def deferred():
+    """
+    Collect the pairs synced inside the block, typically by the signals of a
+    queryset ``delete()``, and sync them all at once when it exits.
+    """
+    if getattr(_deferred, "pairs", None) is not None:
+        yield
+        return
+    _deferred.pairs = set()
+    try:
+        yield
+        pairs = _deferred.pairs
+    finally:
+        _deferred.pairs = None
+    sync(pairs)
+
+
+def sync_owner(file_obj, created=False):
+    if created:
+        sync([(file_obj.pk, file_obj.owner_id)])
+        return
+    # Only an ownership transfer leaves a stale owner row behind
+    stale_user_ids = list(
+        FileAccess.objects.filter(file=file_obj, source=FileAccess.OWNER)
+        .exclude(user_id=file_obj.owner_id)
+        .values_list("user_id", flat=True)
+    )
+    if stale_user_ids:
+        sync(
+            [(file_obj.pk, user_id) for user_id in stale_user_ids]
+            + [(file_obj.pk, file_obj.owner_id)]
+        )
+
+
+def rebuild(file_ids):
+    """
+    Recompute every access row of the given files from scratch.
+    """
+    pairs = set(File.objects.filter(pk__in=file_ids).values_list("pk", "owner_id"))
+    pairs.update(
+        Permission.objects.filter(file_id__in=file_ids).values_list(
+            "file_id", "user_id"
+        )
+    )
+    pairs.update(
+        Sharing.objects.filter(shared_file_id__in=file_ids).values_list(
+            "shared_file_id", "shared_with_id"
+        )
+    )
+    pairs.update(
+        FileAccess.objects.filter(file_id__in=file_ids).values_list(
+            "file_id", "user_id"
+        )
+    )
+    sync(pairs)
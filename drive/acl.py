@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from . import metrics
+from .cache import LRUCache
+from .models import FileAccess
+
+OWNER = FileAccess.OWNER
+NO_ACCESS = ""
+
+CACHE_TTL = getattr(settings, "DRIVE_ACL_CACHE_TTL", 30)
+# Alias of a Django cache shared by all workers, None keeps the cache local.
+# A shared cache replaces the local one: invalidations only reach the local
+# cache of the worker that made them.
+SHARED_CACHE = getattr(settings, "DRIVE_ACL_CACHE", None)
+
+local_cache = LRUCache(
+    maxsize=getattr(settings, "DRIVE_ACL_CACHE_SIZE", 10000), ttl=CACHE_TTL, name="acl"
+)
+
+
+def cache_key(file_id, user_id):
+    return f"drive:acl:{file_id}:{user_id}"
+
+
+def get_cached(keys):
+    if SHARED_CACHE:
+        return caches[SHARED_CACHE].get_many(keys)
+    levels = {key: local_cache.get(key) for key in keys}
+    return {key: level for key, level in levels.items() if level is not None}
+
+
+def set_cached(levels):
+    if SHARED_CACHE:
+        caches[SHARED_CACHE].set_many(levels, CACHE_TTL)
+        return
+    for key, level in levels.items():
+        local_cache.set(key, level)
+
+
+def fetch_access(file_id, user_id):
+    """
+    Read the effective level of a non-owner from the access index, a single
+    lookup on its ``(user, file)`` unique index.
+    """
+    # Levels are cached, one read from a lagging replica would outlive the lag
+    level = (
+        FileAccess.objects.using(DEFAULT_DB_ALIAS)
+        .filter(file_id=file_id, user_id=user_id)
+        .values_list("level", flat=True)
+        .first()
+    )
+    return level or NO_ACCESS
+
+
+def resolve(file_id, user_id):
+    key = cache_key(file_id, user_id)
+    level = get_cached([key]).get(key)
+    if level is None:
+        level = fetch_access(file_id, user_id)
+        set_cached({key: level})
+    return level or None
+
+
+@metrics.phase("permissions")
+def get_access(request, file_obj):
+    """
+    Return ``OWNER``, ``Permission.CHANGE``, ``Permission.READ`` or None for
+    the requesting user, memoized for the lifetime of the request.
+    """
+    user = request.user
+    if file_obj.owner_id == user.pk:
+        return OWNER
+    memo = request_memo(request)
+    if file_obj.pk not in memo:
+        memo[file_obj.pk] = resolve(file_obj.pk, user.pk)
+    return memo[file_obj.pk]
+
+
+@metrics.phase("permissions")
+def prime(request, files):
+    """
+    Resolve the access to many files with at most one query, so checking
+    them one by one afterwards is free.
+    """
+    user_id = request.user.pk
+    memo = request_memo(request)
+    file_ids = {
+        file_obj.pk
+        for file_obj in files
+        if file_obj.owner_id != user_id and file_obj.pk not in memo
+    }
+    cached = get_cached([cache_key(file_id, user_id) for file_id in file_ids])
+    missing = []
+    for file_id in file_ids:
+        level = cached.get(cache_key(file_id, user_id))
+        if level is None:
+            missing.append(file_id)
+        else:
+            memo[file_id] = level or None
+    if not missing:
+        return
+    levels = dict(
+        FileAccess.objects.using(DEFAULT_DB_ALIAS)
+        .filter(user_id=user_id, file_id__in=missing)
+        .values_list("file_id", "level")
+    )
+    fetched = {}
+    for file_id in missing:
+        level = levels.get(file_id, NO_ACCESS)
+        fetched[cache_key(file_id, user_id)] = level
+        memo[file_id] = level or None
+    set_cached(fetched)
+
+
+def request_memo(request):
+    memo = getattr(request, "_acl_memo", None)
+    if memo is None:
+        memo = request._acl_memo = {}
+    return memo
+
+
+def invalidate(file_id, user_ids):
+    keys = [cache_key(file_id, user_id) for user_id in user_ids]
+    for key in keys:
+        local_cache.delete(key)
+    if SHARED_CACHE:
+        caches[SHARED_CACHE].delete_many(keys)
+
+
+def invalidate_file(file_id):
+    # Shared entries of a deleted file go away with its Permission and Sharing
+    # rows, whose delete signals invalidate them one by one
+    prefix = cache_key(file_id, "")
+    local_cache.delete_matching(lambda key: key.startswith(prefix))
+
+
+def clear():
+    local_cache.clear()
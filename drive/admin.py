@@ -1,8 +1,27 @@
 from django.contrib import admin
 
-from .models import File, Group, Permission, Sharing
+from .models import (
+    Blob,
+    Change,
+    File,
+    FileAccess,
+    Group,
+    Job,
+    LinkVersion,
+    PendingDeletion,
+    Permission,
+    Sharing,
+    UploadSession,
+)
 
+admin.site.register(Blob)
+admin.site.register(Change)
 admin.site.register(File)
+admin.site.register(FileAccess)
 admin.site.register(Group)
+admin.site.register(Job)
+admin.site.register(LinkVersion)
+admin.site.register(PendingDeletion)
 admin.site.register(Permission)
 admin.site.register(Sharing)
+admin.site.register(UploadSession)
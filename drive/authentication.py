@@ -0,0 +1,81 @@
+import copy
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import metrics, routers
+from .cache import LRUCache
+
+CACHE_TTL = getattr(settings, "DRIVE_AUTH_CACHE_TTL", 60)
+# Alias of a Django cache shared by all workers, None keeps the cache local.
+# A shared cache replaces the local one: invalidations only reach the local
+# cache of the worker that made them.
+SHARED_CACHE = getattr(settings, "DRIVE_AUTH_CACHE", None)
+
+local_cache = LRUCache(
+    maxsize=getattr(settings, "DRIVE_AUTH_CACHE_SIZE", 10000),
+    ttl=CACHE_TTL,
+    name="auth",
+)
+
+
+def cache_key(key):
+    # Raw token keys are credentials, keep them out of the shared cache
+    return "drive:auth:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cached(key):
+    if SHARED_CACHE:
+        return caches[SHARED_CACHE].get(key)
+    return local_cache.get(key)
+
+
+def set_cached(key, token):
+    if SHARED_CACHE:
+        caches[SHARED_CACHE].set(key, token, CACHE_TTL)
+    else:
+        local_cache.set(key, token)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that remembers valid tokens, with their user, so
+    most requests are authenticated without a query.
+    """
+
+    @metrics.phase("auth")
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            # The user is known, their reads may go to a replica from now on
+            routers.authenticated(result[0].pk)
+        return result
+
+    def authenticate_credentials(self, key):
+        ck = cache_key(key)
+        token = get_cached(ck)
+        if token is None:
+            # Only valid tokens of active users get this far
+            user, token = super().authenticate_credentials(key)
+            set_cached(ck, token)
+        # Views may modify request.user, never hand out the cached instance
+        return copy.copy(token.user), token
+
+
+def invalidate(keys):
+    keys = [cache_key(key) for key in keys]
+    for key in keys:
+        local_cache.delete(key)
+    if SHARED_CACHE:
+        caches[SHARED_CACHE].delete_many(keys)
+
+
+def invalidate_user(user_id):
+    invalidate(Token.objects.filter(user_id=user_id).values_list("key", flat=True))
+
+
+def clear():
+    local_cache.clear()
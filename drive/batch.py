@@ -0,0 +1,158 @@
+import os
+import posixpath
+import tarfile
+import zipfile
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import transaction
+
+from . import access, blobs, quotas, search
+from .models import File, SearchToken
+from .uploadhandlers import SizeLimitExceeded, stage
+
+MAX_FILES = getattr(settings, "DRIVE_BATCH_MAX_FILES", 1000)
+# Bytes the members of one archive may expand to, whatever the quota
+MAX_EXTRACTED_SIZE = getattr(
+    settings, "DRIVE_BATCH_MAX_EXTRACTED_SIZE", 4 * 1024 * 1024 * 1024
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def member_name(path):
+    # Keep the folder structure in the name, without absolute or parent parts
+    parts = [
+        part
+        for part in posixpath.normpath(path).split("/")
+        if part not in ("", ".", "..")
+    ]
+    return "/".join(parts)[-255:]
+
+
+def archive_items(archive):
+    """
+    Yield ``(name, stream)`` for each regular file of a zip or tar archive,
+    reading the members one at a time. Members that can't be read, encrypted
+    or compressed with an unsupported method, come with the exception saying
+    why instead of a stream.
+    """
+    try:
+        yield from archive_members(archive)
+    except (tarfile.TarError, zipfile.BadZipFile) as exc:
+        raise ArchiveError(f"Archive is corrupted: {exc}")
+
+
+def archive_members(archive):
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                try:
+                    stream = zf.open(info)
+                except (RuntimeError, NotImplementedError) as exc:
+                    yield member_name(info.filename), exc
+                    continue
+                with stream:
+                    yield member_name(info.filename), stream
+        return
+    archive.seek(0)
+    try:
+        # Stream mode, the archive is read front to back exactly once
+        tar = tarfile.open(fileobj=archive, mode="r|*")
+    except tarfile.TarError:
+        raise ArchiveError("Archive must be a zip or tar file.")
+    with tar:
+        for info in tar:
+            if not info.isfile():
+                continue
+            yield member_name(info.name), tar.extractfile(info)
+
+
+def upload_items(uploaded_files):
+    for uploaded in uploaded_files:
+        yield uploaded.name, uploaded
+
+
+def ingest(owner, items, group=None):
+    """
+    Store every ``(name, content)`` item and create all the ``File`` rows in
+    a single transaction. Returns one result per item, failed items don't
+    prevent the others from being created. Raises ``QuotaExceeded`` when the
+    items don't fit in the owner's quota and ``ArchiveError`` when archive
+    members expand beyond ``MAX_EXTRACTED_SIZE``, as soon as they do.
+    """
+    results = []
+    staged = []
+    available = quotas.available(owner.pk)
+    received = 0
+    with ExitStack() as stack:
+        for index, (name, content) in enumerate(items):
+            result = {"name": name, "status": "error"}
+            results.append(result)
+            if index >= MAX_FILES:
+                result["error"] = f"Batches are limited to {MAX_FILES} files."
+                continue
+            if not name:
+                result["error"] = "Missing file name."
+                continue
+            if isinstance(content, Exception):
+                result["error"] = str(content)
+                continue
+            if not hasattr(content, "sha256"):
+                # Archive members are copied to disk and hashed one at a time,
+                # compressed ones may expand far beyond the request's size
+                limit = MAX_EXTRACTED_SIZE - received
+                if available is not None:
+                    limit = min(limit, available - received)
+                try:
+                    content = stack.enter_context(
+                        stage(content, os.path.basename(name), limit=limit)
+                    )
+                except SizeLimitExceeded:
+                    if available is not None and available < MAX_EXTRACTED_SIZE:
+                        raise quotas.QuotaExceeded(
+                            f"The archive expands beyond the {available} bytes "
+                            "available."
+                        )
+                    raise ArchiveError(
+                        f"Archives may expand to at most {MAX_EXTRACTED_SIZE} bytes."
+                    )
+                except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as exc:
+                    result["error"] = str(exc)
+                    continue
+            received += content.size
+            result["status"] = "created"
+            staged.append((result, content))
+
+        # The request's Content-Length was only an estimate
+        if available is not None and received > available:
+            raise quotas.QuotaExceeded(
+                f"Storing {received} bytes would exceed the quota, {available} "
+                "bytes are available."
+            )
+        files = []
+        contents = [content for result, content in staged]
+        for (result, content), blob in zip(staged, blobs.store_many(contents)):
+            file_obj = File(name=result["name"], owner=owner)
+            blobs.attach(file_obj, blob, content.detected_content_type)
+            files.append(file_obj)
+
+    with transaction.atomic():
+        # bulk_create() skips the File signals, their work is done below
+        File.objects.bulk_create(files)
+        blobs.retain_many(Counter(file_obj.blob_id for file_obj in files))
+        access.sync([(file_obj.pk, owner.pk) for file_obj in files])
+        quotas.add(owner.pk, sum(file_obj.size for file_obj in files))
+        search.add(SearchToken.FILE, {file_obj.pk: file_obj.name for file_obj in files})
+        if group is not None:
+            group.files.add(*files)
+
+    for (result, content), file_obj in zip(staged, files):
+        result["id"] = file_obj.pk
+    return results
@@ -0,0 +1,890 @@
+import io
+import json
+import math
+import os
+import platform
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import access, blobs, links, quotas, renderers, rows, search, uploads
+from .models import File, FileAccess, Group, Permission, SearchToken
+from .serializers import FileAccessSerializer, FileSerializer, GroupSerializer
+
+PASSWORD = "benchmark-password"
+SEED_BATCH_SIZE = 1000
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+# Upload scenarios of large files run fewer times, this many bytes at most
+UPLOAD_BUDGET = 256 * 1024**2
+# Larger uploads go through chunked upload sessions, as clients would send them
+MULTIPART_LIMIT = 64 * 1024**2
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            return int(float(value[: -len(unit)]) * SIZE_UNITS[unit])
+    return int(value)
+
+
+def format_size(size):
+    for unit in ("GB", "MB", "KB"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def pattern(size, marker=b""):
+    """
+    Return ``size`` bytes starting with ``marker``, so contents are distinct
+    and aren't deduplicated by the blob store.
+    """
+    block = (marker + b"drive benchmark payload\n") * (size // 24 + 1)
+    return block[:size]
+
+
+class Dataset:
+    """
+    What ``seed`` created, for the scenarios to pick from.
+    """
+
+    def __init__(self):
+        self.users = []
+        self.tokens = {}
+        self.files = {}
+        self.groups = {}
+        self.shared = {}
+        self.digests = []
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "users": len(self.users),
+            "files": sum(len(file_ids) for file_ids in self.files.values()),
+            "groups": sum(len(group_ids) for group_ids in self.groups.values()),
+            "shares": sum(len(file_ids) for file_ids in self.shared.values()),
+            "contents": len(self.digests),
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def chunked(items, size=SEED_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def seed(users=20, files=50, groups=5, shares=3, contents=20, file_size=4096, rng=None):
+    """
+    Create ``users`` users owning ``files`` files and ``groups`` groups each,
+    every file shared with ``shares`` other users. The files point to
+    ``contents`` distinct blobs. Rows are inserted in bulk, so the signal
+    handlers' work is done here the way ``batch.ingest`` does it.
+    """
+    rng = rng or random.Random(0)
+    dataset = Dataset()
+    started = time.perf_counter()
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    password = make_password(PASSWORD)
+    created = User.objects.bulk_create(
+        [User(username=f"{prefix}_{i}", password=password) for i in range(users)]
+    )
+    tokens = Token.objects.bulk_create(
+        [Token(key=Token.generate_key(), user=user) for user in created]
+    )
+    dataset.users = [user.pk for user in created]
+    dataset.tokens = {token.user_id: token.key for token in tokens}
+
+    stored = [
+        blobs.store(ContentFile(pattern(file_size, b"%d " % i), name=f"seed_{i}.txt"))
+        for i in range(contents)
+    ]
+    dataset.digests = [(blob.digest, blob.size) for blob in stored]
+    rows = []
+    for user_id in dataset.users:
+        for i in range(files):
+            file_obj = File(name=f"file_{i}.txt", owner_id=user_id)
+            blobs.attach(file_obj, rng.choice(stored), "text/plain")
+            rows.append(file_obj)
+    for batch in chunked(rows):
+        File.objects.bulk_create(batch)
+        blobs.retain_many(Counter(file_obj.blob_id for file_obj in batch))
+        access.sync([(file_obj.pk, file_obj.owner_id) for file_obj in batch])
+        search.add(SearchToken.FILE, {file_obj.pk: file_obj.name for file_obj in batch})
+    for user_id in dataset.users:
+        dataset.files[user_id] = []
+        dataset.shared[user_id] = []
+    for file_obj in rows:
+        dataset.files[file_obj.owner_id].append(file_obj.pk)
+    for user_id in dataset.users:
+        quotas.add(user_id, files * file_size)
+
+    created_groups = Group.objects.bulk_create(
+        [
+            Group(name=f"group_{i}", owner_id=user_id)
+            for user_id in dataset.users
+            for i in range(groups)
+        ]
+    )
+    search.add(SearchToken.GROUP, {group.pk: group.name for group in created_groups})
+    memberships = []
+    for group in created_groups:
+        dataset.groups.setdefault(group.owner_id, []).append(group.pk)
+        owned = dataset.files[group.owner_id]
+        for file_id in rng.sample(owned, min(10, len(owned))):
+            memberships.append(Group.files.through(group_id=group.pk, file_id=file_id))
+    for batch in chunked(memberships):
+        Group.files.through.objects.bulk_create(batch)
+
+    permissions = []
+    for file_obj in rows:
+        others = [user_id for user_id in dataset.users if user_id != file_obj.owner_id]
+        for user_id in rng.sample(others, min(shares, len(others))):
+            level = rng.choice([Permission.READ, Permission.CHANGE])
+            permissions.append(
+                Permission(file_id=file_obj.pk, user_id=user_id, permission=level)
+            )
+            dataset.shared[user_id].append(file_obj.pk)
+    for batch in chunked(permissions):
+        Permission.objects.bulk_create(batch)
+        access.sync([(grant.file_id, grant.user_id) for grant in batch])
+    dataset.seconds = time.perf_counter() - started
+    return dataset
+
+
+class Operation:
+    """
+    One request of a scenario: the user sending it, and what ``prepare``
+    set up for it outside of the measurement.
+    """
+
+    def __init__(self, dataset, user_id, rng):
+        self.dataset = dataset
+        self.user_id = user_id
+        self.rng = rng
+        self.prepared = None
+
+    @property
+    def client(self):
+        client = APIClient(raise_request_exception=False)
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {self.dataset.tokens[self.user_id]}"
+        )
+        return client
+
+    @property
+    def anonymous(self):
+        return APIClient(raise_request_exception=False)
+
+    def own_file(self):
+        return self.rng.choice(self.dataset.files[self.user_id])
+
+    def own_files(self, count):
+        owned = self.dataset.files[self.user_id]
+        return self.rng.sample(owned, min(count, len(owned)))
+
+    def own_group(self):
+        return self.rng.choice(self.dataset.groups[self.user_id])
+
+    def other_users(self, count):
+        others = [user_id for user_id in self.dataset.users if user_id != self.user_id]
+        return self.rng.sample(others, min(count, len(others)))
+
+
+class Scenario:
+    """
+    A request against one endpoint. ``prepare`` runs before the clock starts,
+    ``run`` sends the request(s) and returns the last response and the
+    number of bytes sent.
+    """
+
+    def __init__(self, name, url_name, method, run, prepare=None, size=None, expect=()):
+        self.name = name
+        self.url_name = url_name
+        self.method = method.upper()
+        self.run = run
+        self.prepare = prepare
+        self.size = size
+        # Statuses that aren't failures although >= 400
+        self.expect = expect
+
+    def iterations(self, requested):
+        if self.size is None:
+            return requested
+        return max(1, min(requested, UPLOAD_BUDGET // self.size))
+
+
+def make_file(op, content=None):
+    content = content or pattern(2048, uuid.uuid4().bytes)
+    file_obj = File(name="bench.txt", owner_id=op.user_id)
+    blobs.attach(file_obj, blobs.store(ContentFile(content, name="bench.txt")))
+    file_obj.save()
+    return file_obj
+
+
+def register(op):
+    name = f"bench_new_{uuid.uuid4().hex[:12]}"
+    data = {
+        "username": name,
+        "email": f"{name}@example.com",
+        "password1": PASSWORD,
+        "password2": PASSWORD,
+    }
+    return op.anonymous.post(reverse("user-register"), data, format="json"), 0
+
+
+def prepare_login(op):
+    return User.objects.values_list("username", flat=True).get(pk=op.user_id)
+
+
+def login(op):
+    data = {"username": op.prepared, "password": PASSWORD}
+    return op.anonymous.post(reverse("user-login"), data, format="json"), 0
+
+
+def prepare_logout(op):
+    # A throwaway user, logging out deletes every token of the user
+    user = User.objects.create(username=f"bench_out_{uuid.uuid4().hex[:12]}")
+    return Token.objects.create(user=user).key
+
+
+def logout(op):
+    client = op.anonymous
+    client.credentials(HTTP_AUTHORIZATION=f"Token {op.prepared}")
+    return client.post(reverse("user-logout")), 0
+
+
+def file_list(op):
+    return op.client.get(reverse("file-upload"), {"page_size": 50}), 0
+
+
+def prepare_upload(op):
+    return uuid.uuid4().bytes
+
+
+def upload(size):
+    def run(op):
+        content = pattern(size, op.prepared)
+        data = {"name": "upload.bin", "file": SimpleUploadedFile("upload.bin", content)}
+        return op.client.post(reverse("file-upload"), data, format="multipart"), size
+
+    return run
+
+
+def session_upload(size):
+    def run(op):
+        client = op.client
+        data = {"name": "upload.bin", "size": size}
+        response = client.post(reverse("upload-session-create"), data, format="json")
+        if response.status_code >= 400:
+            return response, 0
+        session_id = response.data["id"]
+        chunk_size = response.data["chunk_size"]
+        # Only the first chunk is distinct, the others are the same bytes
+        first = pattern(min(chunk_size, size), op.prepared)
+        rest = pattern(chunk_size)
+        for index, offset in enumerate(range(0, size, chunk_size)):
+            body = first if index == 0 else rest[: min(chunk_size, size - offset)]
+            url = reverse(
+                "upload-chunk", kwargs={"session_id": session_id, "index": index}
+            )
+            response = client.put(url, body, content_type="application/octet-stream")
+            if response.status_code >= 400:
+                return response, offset
+        url = reverse("upload-session-complete", kwargs={"session_id": session_id})
+        return client.post(url), size
+
+    return run
+
+
+def prepare_digest(op):
+    # Only content the user can read is copied by digest
+    return File.objects.values_list("checksum", "size").get(pk=op.own_file())
+
+
+def upload_digest(op):
+    digest, size = op.prepared
+    data = {"name": "copy.txt", "digest": digest, "size": size}
+    return op.client.post(reverse("file-upload-digest"), data, format="json"), 0
+
+
+def prepare_batch(op):
+    return [pattern(1024, uuid.uuid4().bytes) for i in range(10)]
+
+
+def batch_upload(op):
+    files = [
+        SimpleUploadedFile(f"batch_{i}.txt", content)
+        for i, content in enumerate(op.prepared)
+    ]
+    response = op.client.post(
+        reverse("file-upload-batch"), {"files": files}, format="multipart"
+    )
+    return response, sum(len(content) for content in op.prepared)
+
+
+def session_create(op):
+    data = {"name": "session.bin", "size": 1024**2}
+    return op.client.post(reverse("upload-session-create"), data, format="json"), 0
+
+
+def prepare_session(op):
+    return uploads.create_session(
+        User(pk=op.user_id), "session.bin", 64 * 1024, chunk_size=64 * 1024
+    ).pk
+
+
+def session_status(op):
+    url = reverse("upload-session", kwargs={"session_id": op.prepared})
+    return op.client.get(url), 0
+
+
+def session_chunk(op):
+    url = reverse("upload-chunk", kwargs={"session_id": op.prepared, "index": 0})
+    body = pattern(64 * 1024, uuid.uuid4().bytes)
+    return op.client.put(url, body, content_type="application/octet-stream"), len(body)
+
+
+def prepare_complete(op):
+    session = uploads.create_session(
+        User(pk=op.user_id), "session.bin", 64 * 1024, chunk_size=64 * 1024
+    )
+    uploads.write_chunk(session, 0, io.BytesIO(pattern(64 * 1024, uuid.uuid4().bytes)))
+    return session.pk
+
+
+def session_complete(op):
+    url = reverse("upload-session-complete", kwargs={"session_id": op.prepared})
+    return op.client.post(url), 0
+
+
+def session_abort(op):
+    url = reverse("upload-session", kwargs={"session_id": op.prepared})
+    return op.client.delete(url), 0
+
+
+def file_url(name, file_id):
+    return reverse(name, kwargs={"file_id": file_id})
+
+
+def file_retrieve(op):
+    return op.client.get(file_url("file-delete", op.own_file())), 0
+
+
+def file_retrieve_shared(op):
+    # Checked against the access index instead of the ownership shortcut
+    shared = op.dataset.shared[op.user_id] or op.dataset.files[op.user_id]
+    return op.client.get(file_url("file-delete", op.rng.choice(shared))), 0
+
+
+def file_update(op):
+    data = {"name": f"renamed_{op.rng.randrange(1000)}.txt"}
+    return op.client.put(file_url("file-delete", op.own_file()), data, format="json"), 0
+
+
+def prepare_file(op):
+    return make_file(op).pk
+
+
+def file_delete(op):
+    return op.client.delete(file_url("file-delete", op.prepared)), 0
+
+
+def file_download(op):
+    return op.client.get(file_url("file-download", op.own_file())), 0
+
+
+def file_blocks(op):
+    url = file_url("file-blocks", op.own_file())
+    return op.client.get(url, {"block_size": 1024}), 0
+
+
+def prepare_delta(op):
+    file_obj = make_file(op, pattern(4096, uuid.uuid4().bytes))
+    return file_obj.pk, file_obj.checksum
+
+
+def file_delta(op):
+    file_id, base = op.prepared
+    tail = b"appended by the benchmark"
+    data = {
+        "base": base,
+        "block_size": 1024,
+        "manifest": json.dumps([{"copy": [0, 4]}, {"data": "tail"}]),
+        "tail": SimpleUploadedFile("tail", tail),
+    }
+    url = file_url("file-delta", file_id)
+    return op.client.put(url, data, format="multipart"), len(tail)
+
+
+def file_preview(op):
+    return op.client.get(file_url("file-preview", op.own_file())), 0
+
+
+def link_issue(op):
+    return op.client.post(file_url("file-link", op.own_file())), 0
+
+
+def prepare_link(op):
+    file_obj = File.objects.select_related("blob").get(pk=op.own_file())
+    token, expires_at = links.issue(file_obj, User(pk=op.user_id))
+    return token
+
+
+def link_download(op):
+    url = reverse("link-download", kwargs={"token": op.prepared})
+    return op.anonymous.get(url), 0
+
+
+def link_revoke_file(op):
+    return op.client.delete(file_url("file-link", op.own_file())), 0
+
+
+def link_revoke_user(op):
+    return op.client.delete(reverse("link-revoke")), 0
+
+
+def file_archive(op):
+    ids = ",".join(str(file_id) for file_id in op.own_files(10))
+    return op.client.get(reverse("file-archive"), {"ids": ids}), 0
+
+
+def file_share(op):
+    data = {"user_ids": op.other_users(1)}
+    return op.client.post(file_url("file-share", op.own_file()), data, format="json"), 0
+
+
+def permission_bulk(op):
+    data = {
+        "action": "grant",
+        "permission": Permission.READ,
+        "files": op.own_files(5),
+        "users": op.other_users(2),
+    }
+    return op.client.post(reverse("permission-bulk"), data, format="json"), 0
+
+
+def storage_usage(op):
+    return op.client.get(reverse("storage-usage")), 0
+
+
+def change_feed(op):
+    return op.client.get(reverse("change-feed"), {"cursor": 0}), 0
+
+
+def shared_list(op):
+    return op.client.get(reverse("file-shared-list")), 0
+
+
+def file_search(op):
+    # Seeded names are file_<i>.txt, shared files are found too
+    query = f"file {op.rng.randrange(10)}"
+    return op.client.get(reverse("search"), {"q": query}), 0
+
+
+def search_autocomplete(op):
+    return op.client.get(reverse("search-autocomplete"), {"q": "file_1"}), 0
+
+
+def prepare_metrics(op):
+    # Scrapes are sent by staff users, or with the metrics token
+    admin, created = User.objects.get_or_create(
+        username="benchmark-admin", defaults={"is_staff": True}
+    )
+    return admin
+
+
+def metrics_scrape(op):
+    client = op.anonymous
+    client.force_authenticate(op.prepared)
+    return client.get(reverse("metrics")), 0
+
+
+def group_list(op):
+    return op.client.get(reverse("groups-list-create"), {"files": "summary"}), 0
+
+
+def group_create(op):
+    data = {"name": "benchmark", "files": op.own_files(5)}
+    return op.client.post(reverse("groups-list-create"), data, format="json"), 0
+
+
+def group_url(name, group_id):
+    return reverse(name, kwargs={"group_id": group_id})
+
+
+def group_retrieve(op):
+    return op.client.get(group_url("group-retrieve-update-delete", op.own_group())), 0
+
+
+def group_update(op):
+    url = group_url("group-retrieve-update-delete", op.own_group())
+    data = {"name": f"renamed_{op.rng.randrange(1000)}"}
+    return op.client.put(url, data, format="json"), 0
+
+
+def prepare_group(op):
+    group = Group.objects.create(name="disposable", owner_id=op.user_id)
+    group.files.add(*op.own_files(3))
+    return group.pk
+
+
+def group_delete(op):
+    url = group_url("group-retrieve-update-delete", op.prepared)
+    return op.client.delete(url), 0
+
+
+def group_download(op):
+    return op.client.get(group_url("group-download", op.own_group())), 0
+
+
+def scenarios(upload_sizes=("4KB", "1MB", "16MB"), multipart_limit=MULTIPART_LIMIT):
+    """
+    Return the scenarios, at least one for every endpoint of drive/urls.py.
+    """
+    items = [
+        Scenario("register", "user-register", "post", register),
+        Scenario("login", "user-login", "post", login, prepare_login),
+        Scenario("logout", "user-logout", "post", logout, prepare_logout),
+        Scenario("file-list", "file-upload", "get", file_list),
+    ]
+    for size in map(parse_size, upload_sizes):
+        if size <= multipart_limit:
+            items.append(
+                Scenario(
+                    f"upload-{format_size(size)}",
+                    "file-upload",
+                    "post",
+                    upload(size),
+                    prepare_upload,
+                    size=size,
+                )
+            )
+        else:
+            items.append(
+                Scenario(
+                    f"upload-session-{format_size(size)}",
+                    "upload-chunk",
+                    "put",
+                    session_upload(size),
+                    prepare_upload,
+                    size=size,
+                )
+            )
+    items += [
+        Scenario(
+            "upload-digest", "file-upload-digest", "post", upload_digest, prepare_digest
+        ),
+        Scenario(
+            "upload-batch", "file-upload-batch", "post", batch_upload, prepare_batch
+        ),
+        Scenario("session-create", "upload-session-create", "post", session_create),
+        Scenario(
+            "session-status", "upload-session", "get", session_status, prepare_session
+        ),
+        Scenario(
+            "session-chunk", "upload-chunk", "put", session_chunk, prepare_session
+        ),
+        Scenario(
+            "session-complete",
+            "upload-session-complete",
+            "post",
+            session_complete,
+            prepare_complete,
+        ),
+        Scenario(
+            "session-abort", "upload-session", "delete", session_abort, prepare_session
+        ),
+        Scenario("file-retrieve", "file-delete", "get", file_retrieve),
+        Scenario("file-retrieve-shared", "file-delete", "get", file_retrieve_shared),
+        Scenario("file-update", "file-delete", "put", file_update),
+        Scenario("file-delete", "file-delete", "delete", file_delete, prepare_file),
+        Scenario("file-download", "file-download", "get", file_download),
+        Scenario("file-blocks", "file-blocks", "get", file_blocks),
+        Scenario("file-delta", "file-delta", "put", file_delta, prepare_delta),
+        # Text files have no preview, 404 is the expected answer for them
+        Scenario("file-preview", "file-preview", "get", file_preview, expect=(404,)),
+        Scenario("link-issue", "file-link", "post", link_issue),
+        Scenario("link-download", "link-download", "get", link_download, prepare_link),
+        Scenario("link-revoke-file", "file-link", "delete", link_revoke_file),
+        Scenario("link-revoke-user", "link-revoke", "delete", link_revoke_user),
+        Scenario("file-archive", "file-archive", "get", file_archive),
+        Scenario("file-share", "file-share", "post", file_share),
+        Scenario("permission-bulk", "permission-bulk", "post", permission_bulk),
+        Scenario("storage-usage", "storage-usage", "get", storage_usage),
+        Scenario("change-feed", "change-feed", "get", change_feed),
+        Scenario("shared-list", "file-shared-list", "get", shared_list),
+        Scenario("search", "search", "get", file_search),
+        Scenario(
+            "search-autocomplete", "search-autocomplete", "get", search_autocomplete
+        ),
+        Scenario("metrics", "metrics", "get", metrics_scrape, prepare_metrics),
+        Scenario("group-list", "groups-list-create", "get", group_list),
+        Scenario("group-create", "groups-list-create", "post", group_create),
+        Scenario(
+            "group-retrieve", "group-retrieve-update-delete", "get", group_retrieve
+        ),
+        Scenario("group-update", "group-retrieve-update-delete", "put", group_update),
+        Scenario(
+            "group-delete",
+            "group-retrieve-update-delete",
+            "delete",
+            group_delete,
+            prepare_group,
+        ),
+        Scenario("group-download", "group-download", "get", group_download),
+    ]
+    return items
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Result:
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.latencies = []
+        self.queries = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.exceptions = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def add(self, status_code, latency, queries, bytes_in, bytes_out, exc_info=None):
+        self.statuses[status_code] += 1
+        if status_code >= 400 and status_code not in self.scenario.expect:
+            self.errors += 1
+        if exc_info is not None:
+            self.exceptions[f"{exc_info[0].__name__}: {exc_info[1]}"] += 1
+        self.latencies.append(latency)
+        self.queries.append(queries)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def as_dict(self):
+        count = len(self.latencies)
+        result = {
+            "name": self.scenario.name,
+            "endpoint": self.scenario.url_name,
+            "method": self.scenario.method,
+            "requests": count,
+            "errors": self.errors,
+            "statuses": {str(code): n for code, n in sorted(self.statuses.items())},
+            "seconds": round(self.seconds, 6),
+            "throughput": round(count / self.seconds, 3) if self.seconds else None,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+        if self.exceptions:
+            result["exceptions"] = dict(self.exceptions.most_common())
+        if count:
+            result["latency_ms"] = {
+                "mean": round(1000 * sum(self.latencies) / count, 3),
+                "p50": round(1000 * percentile(self.latencies, 0.5), 3),
+                "p95": round(1000 * percentile(self.latencies, 0.95), 3),
+                "p99": round(1000 * percentile(self.latencies, 0.99), 3),
+                "max": round(1000 * max(self.latencies), 3),
+            }
+            result["queries"] = {
+                "mean": round(sum(self.queries) / count, 2),
+                "max": max(self.queries),
+            }
+        return result
+
+
+def response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def run_scenario(scenario, dataset, iterations=100, concurrency=4, seed=0):
+    """
+    Prepare ``iterations`` operations, then send them from ``concurrency``
+    threads, or one by one in this thread when it is 0, and measure them.
+    """
+    rng = random.Random(f"{seed}:{scenario.name}")
+    operations = queue.SimpleQueue()
+    for i in range(scenario.iterations(iterations)):
+        op = Operation(dataset, rng.choice(dataset.users), random.Random(rng.random()))
+        if scenario.prepare is not None:
+            op.prepared = scenario.prepare(op)
+        operations.put(op)
+    result = Result(scenario)
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            try:
+                op = operations.get_nowait()
+            except queue.Empty:
+                return
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response, bytes_in = scenario.run(op)
+                # Streamed bodies are produced while they are read
+                bytes_out = response_size(response)
+                latency = time.perf_counter() - started
+            with lock:
+                result.add(
+                    response.status_code,
+                    latency,
+                    len(queries),
+                    bytes_in,
+                    bytes_out,
+                    # Set by the test client when the view raised
+                    getattr(response, "exc_info", None),
+                )
+
+    def worker():
+        try:
+            work()
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    if concurrency == 0:
+        work()
+    else:
+        threads = [threading.Thread(target=worker) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+class SerializationResult:
+    def __init__(self, name, rows, size):
+        self.name = name
+        self.rows = rows
+        self.size = size
+        self.serializer = []
+        self.fast = []
+
+    def as_dict(self):
+        serializer = percentile(self.serializer, 0.5)
+        fast = percentile(self.fast, 0.5)
+        return {
+            "name": f"serialize-{self.name}",
+            "rows": self.rows,
+            "bytes": self.size,
+            "serializer_ms": round(1000 * serializer, 3),
+            "fast_ms": round(1000 * fast, 3),
+            "speedup": round(serializer / fast, 2) if fast else None,
+        }
+
+
+def listings(user_id):
+    """
+    Return ``(name, serializer path, fast path)`` of the listings of
+    ``user_id``, each path renders the JSON body the way its view does.
+    """
+    files = File.objects.filter(owner_id=user_id)
+    groups = Group.objects.filter(owner_id=user_id)
+    grants = (
+        FileAccess.objects.filter(user_id=user_id)
+        .exclude(source=FileAccess.OWNER)
+        .order_by("-file_id")
+    )
+    slow, fast = JSONRenderer(), renderers.JSONRenderer()
+    return [
+        (
+            "files",
+            lambda: slow.render(FileSerializer(files, many=True).data),
+            lambda: fast.render(rows.render_files(rows.file_values(files))),
+        ),
+        (
+            "groups",
+            lambda: slow.render(
+                GroupSerializer(groups.prefetch_related("files"), many=True).data
+            ),
+            lambda: fast.render(rows.render_groups(rows.group_values(groups))),
+        ),
+        (
+            "shared",
+            lambda: slow.render(
+                FileAccessSerializer(grants.select_related("file"), many=True).data
+            ),
+            lambda: fast.render(rows.render_access(rows.access_values(grants))),
+        ),
+    ]
+
+
+def compare_serialization(dataset, repeat=100):
+    """
+    Time the listings of the first user through the serializers and from
+    ``values()`` rows, queries included, once both are known to render the
+    same bytes.
+    """
+    results = []
+    for name, serializer_path, fast_path in listings(dataset.users[0]):
+        expected = serializer_path()
+        if fast_path() != expected:
+            raise RuntimeError(f"The fast {name} listing renders differently.")
+        result = SerializationResult(name, len(json.loads(expected)), len(expected))
+        for i in range(repeat):
+            for path, times in (
+                (serializer_path, result.serializer),
+                (fast_path, result.fast),
+            ):
+                started = time.perf_counter()
+                path()
+                times.append(time.perf_counter() - started)
+        results.append(result)
+    return results
+
+
+def report(results, dataset, options):
+    return {
+        "started_at": timezone.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "cpus": os.cpu_count(),
+        },
+        "options": options,
+        "dataset": dataset.as_dict(),
+        "scenarios": [result.as_dict() for result in results],
+    }
+
+
+def compare(current, baseline):
+    """
+    Yield ``(name, throughput change, p95 change)`` for the scenarios found
+    in both reports, as fractions of the baseline.
+    """
+    previous = {item["name"]: item for item in baseline["scenarios"]}
+    for item in current["scenarios"]:
+        before = previous.get(item["name"])
+        if not before or "latency_ms" not in item or "latency_ms" not in before:
+            continue
+        throughput = None
+        if item["throughput"] and before["throughput"]:
+            throughput = item["throughput"] / before["throughput"] - 1
+        p95 = None
+        if before["latency_ms"]["p95"]:
+            p95 = item["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        yield item["name"], throughput, p95
@@ -0,0 +1,146 @@
+import hashlib
+import zlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from . import mime
+from .models import Blob, FileAccess
+
+
+def hash_content(content):
+    """
+    Return the SHA-256 hex digest, size and CRC-32 of ``content``, reading it
+    once.
+    """
+    sha256 = hashlib.sha256()
+    crc32 = 0
+    size = 0
+    content.seek(0)
+    for chunk in content.chunks():
+        sha256.update(chunk)
+        crc32 = zlib.crc32(chunk, crc32)
+        size += len(chunk)
+    content.seek(0)
+    return sha256.hexdigest(), size, crc32
+
+
+def content_digest(content):
+    digest = getattr(content, "sha256", None)
+    if digest is not None:
+        # Already hashed by DigestUploadHandler while the upload streamed in
+        return digest, content.size, content.crc32
+    return hash_content(content)
+
+
+def find_readable(digest, size, user_id):
+    """
+    Return the blob with ``digest`` and ``size`` when ``user_id`` can read a
+    file holding it, otherwise None. Knowing a digest proves nothing, files
+    are served with their checksums; the content of other users is neither
+    handed out nor revealed to exist.
+    """
+    readable = FileAccess.objects.filter(user_id=user_id, file__blob=OuterRef("pk"))
+    return (
+        Blob.objects.filter(digest=digest, size=size).filter(Exists(readable)).first()
+    )
+
+
+def store(content):
+    """
+    Return the blob holding ``content``, writing the bytes only when no blob
+    with the same digest exists yet.
+    """
+    digest, size, crc32 = content_digest(content)
+    blob = Blob.objects.filter(digest=digest).first()
+    if blob is not None and claim([blob.pk]):
+        return blob
+    return create(content, digest, size, crc32)
+
+
+def store_many(contents):
+    """
+    Return the blobs holding each of ``contents``, looking up the digests
+    that are already stored in a single query.
+    """
+    digests = [content_digest(content) for content in contents]
+    existing = Blob.objects.in_bulk(
+        {digest for digest, size, crc32 in digests}, field_name="digest"
+    )
+    if claim([blob.pk for blob in existing.values()]) != len(existing):
+        # Those the garbage collector deleted meanwhile are stored again
+        existing = Blob.objects.in_bulk(existing, field_name="digest")
+    result = []
+    for content, (digest, size, crc32) in zip(contents, digests):
+        if digest not in existing:
+            existing[digest] = create(content, digest, size, crc32)
+        result.append(existing[digest])
+    return result
+
+
+def claim(blob_ids):
+    """
+    Mark blobs about to be referenced again as used, so the garbage collector
+    leaves unreferenced ones alone for its grace period, and return how many
+    still exist: it may have deleted some since they were looked up.
+    """
+    if not blob_ids:
+        return 0
+    return Blob.objects.filter(pk__in=blob_ids).update(updated_at=timezone.now())
+
+
+def create(content, digest, size, crc32):
+    blob = Blob(digest=digest, size=size, crc32=crc32)
+    blob.file.save(content.name or digest, content, save=False)
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        # A concurrent upload stored the same content first
+        blob.file.delete(save=False)
+        blob = Blob.objects.get(digest=digest)
+    return blob
+
+
+def attach(file_obj, blob, content_type=None):
+    """
+    Point ``file_obj`` at ``blob`` and copy its metadata. Reference counts and
+    storage usage are adjusted by the ``File`` signal handlers once the row is
+    saved.
+    """
+    if file_obj.pk is not None and not hasattr(file_obj, "_previous_blob_id"):
+        file_obj._previous_blob_id = file_obj.blob_id
+        file_obj._previous_size = file_obj.size
+        file_obj._previous_file_name = file_obj.file.name
+    file_obj.blob = blob
+    file_obj.file = blob.file.name
+    file_obj.size = blob.size
+    file_obj.checksum = blob.digest
+    file_obj.content_type = content_type or mime.guess(file_obj.name)
+
+
+def retain(blob_id, count=1):
+    Blob.objects.filter(pk=blob_id).update(
+        ref_count=F("ref_count") + count, updated_at=timezone.now()
+    )
+
+
+def release(blob_id, count=1):
+    # updated_at tells the garbage collector how long a blob has been unused
+    Blob.objects.filter(pk=blob_id).update(
+        ref_count=F("ref_count") - count, updated_at=timezone.now()
+    )
+
+
+def retain_many(counts):
+    """
+    Apply a ``{blob_id: count}`` mapping with one update per distinct count.
+    """
+    by_count = {}
+    for blob_id, count in counts.items():
+        by_count.setdefault(count, []).append(blob_id)
+    for count, blob_ids in by_count.items():
+        Blob.objects.filter(pk__in=blob_ids).update(
+            ref_count=F("ref_count") + count, updated_at=timezone.now()
+        )
@@ -0,0 +1,193 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Change
+
+MAX_WAIT = getattr(settings, "DRIVE_CHANGES_MAX_WAIT", 30)
+POLL_INTERVAL = getattr(settings, "DRIVE_CHANGES_POLL_INTERVAL", 0.5)
+# Cache used to wake up long-polls, it must be shared by all workers for
+# them to see each other's writes before the wait times out
+NOTIFY_CACHE = getattr(settings, "DRIVE_CHANGES_CACHE", "default")
+# A waiting request holds its worker thread, at most this many per process
+# wait at once; the others answer straight away and the client polls again
+MAX_POLLERS = getattr(settings, "DRIVE_CHANGES_MAX_POLLERS", 16)
+# Changes are deleted after this long, clients whose cursor is older start
+# over. Cursors within RESET_MARGIN of it do too, a transaction may commit
+# changes that long after recording them.
+RETENTION = getattr(settings, "DRIVE_CHANGES_RETENTION", 30 * 24 * 60 * 60)
+RESET_MARGIN = 60 * 60
+
+# Ids come from a sequence, a transaction committing after another may hold
+# lower ones, which a cursor would already have skipped. On PostgreSQL
+# changes are ordered by the transaction recording them instead, and shown
+# once every older transaction has finished. Other databases order them by
+# id, which follows commit order where writes are serialized (SQLite).
+POSTGRESQL_TRANSACTION_SQL = "SELECT pg_current_xact_id()::text::bigint"
+POSTGRESQL_HORIZON_SQL = "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+pollers = threading.BoundedSemaphore(MAX_POLLERS)
+
+
+def notify_key(user_id):
+    return f"drive:changes:{user_id}"
+
+
+def transaction_id():
+    if connection.vendor != "postgresql":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRESQL_TRANSACTION_SQL)
+        return cursor.fetchone()[0]
+
+
+def record(entries):
+    """
+    Append ``(user_id, kind, object_id, action)`` entries to the change log
+    and wake up the long-polls of their users once the transaction commits.
+    """
+    entries = list(entries)
+    if not entries:
+        return
+    txid = transaction_id()
+    changes = Change.objects.bulk_create(
+        [
+            Change(
+                user_id=user_id,
+                kind=kind,
+                object_id=object_id,
+                action=action,
+                transaction_id=txid,
+            )
+            for user_id, kind, object_id, action in entries
+        ]
+    )
+    latest = {change.user_id: change.id for change in changes}
+    transaction.on_commit(lambda: notify(latest))
+
+
+def record_file(file_id, user_ids, action=Change.UPDATED):
+    record((user_id, Change.FILE, file_id, action) for user_id in user_ids)
+
+
+def notify(latest):
+    caches[NOTIFY_CACHE].set_many(
+        {notify_key(user_id): change_id for user_id, change_id in latest.items()},
+        MAX_WAIT * 2,
+    )
+
+
+def format_cursor(position, issued_at):
+    txid, change_id = position
+    return f"{txid}.{change_id}.{int(issued_at)}"
+
+
+def parse_cursor(cursor):
+    """
+    Return the ``(transaction_id, id)`` position of a cursor, and the time
+    its client was up to date at. Bare ids, the cursors of earlier versions,
+    carry no time. Raises ValueError for anything else.
+    """
+    parts = [int(part) for part in cursor.split(".")]
+    if len(parts) == 1:
+        return (0, parts[0]), None
+    if len(parts) != 3:
+        raise ValueError(f"Invalid cursor {cursor!r}.")
+    return (parts[0], parts[1]), parts[2]
+
+
+def visible(queryset):
+    if connection.vendor == "postgresql":
+        # Transactions still running may commit changes sorting before these
+        queryset = queryset.filter(
+            transaction_id__lt=RawSQL(POSTGRESQL_HORIZON_SQL, [])
+        )
+    return queryset
+
+
+def latest_cursor(user_id):
+    issued_at = time.time()
+    position = (
+        visible(Change.objects.filter(user_id=user_id))
+        .order_by("-transaction_id", "-id")
+        .values_list("transaction_id", "id")
+        .first()
+    )
+    return format_cursor(position or (0, 0), issued_at)
+
+
+def since(user_id, position, limit):
+    txid, change_id = position
+    after = Q(transaction_id__gt=txid) | Q(transaction_id=txid, id__gt=change_id)
+    return list(
+        visible(Change.objects.filter(after, user_id=user_id))
+        .order_by("transaction_id", "id")
+        .values("id", "transaction_id", "kind", "object_id", "action", "created_at")[
+            :limit
+        ]
+    )
+
+
+def wait(user_id, position, limit, timeout):
+    """
+    Return the changes after ``position``, waiting up to ``timeout`` seconds
+    for some to arrive when one of the ``MAX_POLLERS`` slots is free. While
+    waiting only the cache is polled.
+    """
+    cache = caches[NOTIFY_CACHE]
+    notified = cache.get(notify_key(user_id))
+    changes = since(user_id, position, limit)
+    if changes or timeout <= 0 or not pollers.acquire(blocking=False):
+        return changes
+    try:
+        deadline = time.monotonic() + min(timeout, MAX_WAIT)
+        while not changes and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            latest = cache.get(notify_key(user_id))
+            if latest != notified:
+                notified = latest
+                changes = since(user_id, position, limit)
+    finally:
+        pollers.release()
+    if not changes:
+        # Catch writes whose notification went to another cache
+        changes = since(user_id, position, limit)
+    return changes
+
+
+def page(user_id, cursor, limit, timeout=0):
+    """
+    Return the feed response for ``cursor``: up to ``limit`` changes and the
+    cursor following them, or a fresh cursor with ``reset`` when changes the
+    client hasn't seen may have been deleted. Raises ValueError for a cursor
+    the feed didn't issue.
+    """
+    position, issued_at = parse_cursor(cursor)
+    now = time.time()
+    if issued_at is not None and issued_at < now - RETENTION + RESET_MARGIN:
+        return {
+            "cursor": latest_cursor(user_id),
+            "changes": [],
+            "has_more": False,
+            "reset": True,
+        }
+    found = wait(user_id, position, limit + 1, timeout)
+    has_more = len(found) > limit
+    found = found[:limit]
+    if found:
+        position = found[-1]["transaction_id"], found[-1]["id"]
+    # Up to date as of the request, unless more changes are waiting
+    issued_at = found[-1]["created_at"].timestamp() if has_more else now
+    for change in found:
+        del change["transaction_id"]
+    return {
+        "cursor": format_cursor(position, issued_at),
+        "changes": found,
+        "has_more": has_more,
+        "reset": False,
+    }
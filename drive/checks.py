@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries only the process that wrote them can see
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_local_cache(alias):
+    return settings.CACHES.get(alias, {}).get("BACKEND") in LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches)
+def check_replica_pin_cache(app_configs, **kwargs):
+    from . import routers
+
+    if not routers.REPLICAS or not is_local_cache(routers.PIN_CACHE):
+        return []
+    return [
+        Error(
+            f"DRIVE_REPLICA_PIN_CACHE ({routers.PIN_CACHE!r}) is local to each "
+            "process, users would read their own writes from a lagging replica "
+            "as soon as a request reaches another worker.",
+            hint="Point it at a cache shared by all workers, such as Redis or "
+            "Memcached.",
+            id="drive.E001",
+        )
+    ]
+
+
+@register(Tags.caches, deploy=True)
+def check_changes_cache(app_configs, **kwargs):
+    from . import changes
+
+    if changes.MAX_WAIT <= 0 or not is_local_cache(changes.NOTIFY_CACHE):
+        return []
+    return [
+        Error(
+            f"DRIVE_CHANGES_CACHE ({changes.NOTIFY_CACHE!r}) is local to each "
+            "process, long-polls would only be woken up by writes made in "
+            "their own worker.",
+            hint="Point it at a cache shared by all workers, such as Redis or "
+            "Memcached, or set DRIVE_CHANGES_MAX_WAIT to 0.",
+            id="drive.E002",
+        )
+    ]
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import blobs
+from .uploadhandlers import stage_chunks
+
+BLOCK_SIZE = getattr(settings, "DRIVE_DELTA_BLOCK_SIZE", 64 * 1024)
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# Rebuilt content is refused beyond these, whatever the quota
+MAX_INSTRUCTIONS = getattr(settings, "DRIVE_DELTA_MAX_INSTRUCTIONS", 100000)
+MAX_SIZE = getattr(settings, "DRIVE_DELTA_MAX_SIZE", 16 * 1024 * 1024 * 1024)
+# Signatures are keyed by content digest, so cached entries never go stale
+SIGNATURE_CACHE = getattr(settings, "DRIVE_DELTA_CACHE", "default")
+SIGNATURE_CACHE_TTL = 24 * 60 * 60
+
+
+class DeltaError(Exception):
+    pass
+
+
+def current_digest(file_obj):
+    if file_obj.blob_id is not None:
+        return file_obj.blob.digest
+    return blobs.hash_content(file_obj.file)[0]
+
+
+def compute_signatures(field, block_size):
+    signatures = []
+    with field.storage.open(field.name, "rb") as fp:
+        while block := fp.read(block_size):
+            signatures.append([zlib.adler32(block), hashlib.sha256(block).hexdigest()])
+    return signatures
+
+
+def signatures(file_obj, block_size=BLOCK_SIZE):
+    """
+    Return ``[adler32, sha256]`` for each ``block_size`` block of the file,
+    what a client needs to find the blocks it can reuse, rsync style.
+    """
+    if file_obj.blob_id is None:
+        return compute_signatures(file_obj.file, block_size)
+    cache = caches[SIGNATURE_CACHE]
+    key = f"drive:blocks:{file_obj.blob.digest}:{block_size}"
+    result = cache.get(key)
+    if result is None:
+        result = compute_signatures(file_obj.file, block_size)
+        cache.set(key, result, SIGNATURE_CACHE_TTL)
+    return result
+
+
+def is_int(value):
+    # JSON true and false are ints to Python
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_instruction(op):
+    """
+    Return ``((first_block, count), None)`` for a copy instruction and
+    ``(None, part)`` for a data one.
+    """
+    if isinstance(op, dict) and set(op) == {"copy"}:
+        copy = op["copy"]
+        if isinstance(copy, list) and len(copy) == 2 and all(map(is_int, copy)):
+            return tuple(copy), None
+    elif isinstance(op, dict) and set(op) == {"data"}:
+        if isinstance(op["data"], str):
+            return None, op["data"]
+    raise DeltaError(f"Invalid instruction {op!r}.")
+
+
+def validate_manifest(manifest, parts, size, block_size):
+    """
+    Check a list of ``{"copy": [first_block, count]}`` and ``{"data": part}``
+    instructions against the base file and the uploaded parts, and return
+    the size of the content they build.
+    """
+    if not isinstance(manifest, list):
+        raise DeltaError("The manifest must be a list.")
+    if len(manifest) > MAX_INSTRUCTIONS:
+        raise DeltaError(f"Manifests are limited to {MAX_INSTRUCTIONS} instructions.")
+    total_blocks = -(-size // block_size)
+    output_size = 0
+    for op in manifest:
+        copy, data = parse_instruction(op)
+        if copy is not None:
+            first, count = copy
+            if first < 0 or count <= 0 or first + count > total_blocks:
+                raise DeltaError(f"Invalid block range {op['copy']}.")
+            # The last block of the base may be short
+            output_size += min((first + count) * block_size, size) - first * block_size
+        else:
+            if data not in parts:
+                raise DeltaError(f"Missing part {data!r}.")
+            output_size += parts[data].size
+        if output_size > MAX_SIZE:
+            raise DeltaError(f"The rebuilt content would exceed {MAX_SIZE} bytes.")
+    return output_size
+
+
+def apply(file_obj, manifest, parts, block_size):
+    """
+    Build the new content from blocks of the current one and the uploaded
+    ``parts``, and return it staged and hashed, ready for ``blobs.store``.
+    Check the size ``validate_manifest`` returns against the quota first.
+    """
+    field = file_obj.file
+    size = validate_manifest(manifest, parts, field.size, block_size)
+    with field.storage.open(field.name, "rb") as base:
+        return stage_chunks(
+            read_ops(base, manifest, parts, block_size),
+            os.path.basename(file_obj.name),
+            limit=size,
+        )
+
+
+def read_ops(base, manifest, parts, block_size):
+    for op in manifest:
+        copy, data = parse_instruction(op)
+        if copy is not None:
+            first, count = copy
+            base.seek(first * block_size)
+            remaining = count * block_size
+            while remaining > 0 and (chunk := base.read(min(READ_SIZE, remaining))):
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            part = parts[data]
+            part.seek(0)
+            yield from part.chunks(READ_SIZE)
@@ -0,0 +1,273 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import changes, jobs, links, previews, uploads
+from .models import Blob, Change, File, Job, LinkVersion, PendingDeletion, UploadSession
+from .uploadhandlers import STAGING_DIR
+
+# Unused for this long before anything is removed, so uploads that are
+# about to reference a blob, or still being written, are left alone
+GRACE_PERIOD = getattr(settings, "DRIVE_GC_GRACE_PERIOD", 60 * 60)
+UPLOAD_SESSION_TTL = getattr(settings, "DRIVE_UPLOAD_SESSION_TTL", 24 * 60 * 60)
+BATCH_SIZE = getattr(settings, "DRIVE_GC_BATCH_SIZE", 500)
+STORAGE_ROOTS = ("blobs", "uploads")
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.scanned = 0
+        self.deleted = 0
+        self.bytes = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        rate = self.scanned / self.elapsed if self.elapsed else 0
+        return (
+            f"scanned {self.scanned}, deleted {self.deleted} "
+            f"({self.bytes} bytes) in {self.elapsed:.1f}s, {rate:.0f}/s"
+        )
+
+
+def schedule(paths):
+    """
+    Queue stored files for deletion once the current transaction commits,
+    so a rollback never loses bytes a row still points to.
+    """
+    paths = [path for path in paths if path]
+    if paths:
+        transaction.on_commit(
+            lambda: PendingDeletion.objects.bulk_create(
+                [PendingDeletion(path=path) for path in paths]
+            )
+        )
+
+
+def is_referenced(paths):
+    paths = list(paths)
+    return set(
+        Blob.objects.filter(file__in=paths).values_list("file", flat=True)
+    ) | set(File.objects.filter(file__in=paths).values_list("file", flat=True))
+
+
+def delete_stored(storage, path, stats, dry_run):
+    try:
+        # What the file takes on disk, which is less when stored compressed
+        size = getattr(storage, "stored_size", storage.size)(path)
+        if not dry_run:
+            storage.delete(path)
+    except FileNotFoundError:
+        return
+    stats.deleted += 1
+    stats.bytes += size
+
+
+def batches(queryset, batch_size):
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+        rows = list(page.order_by("pk")[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].pk
+
+
+def collect_blobs(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Delete blobs nothing has referenced since ``cutoff``, then their bytes.
+    """
+    stats = Stats()
+    storage = uploads.file_storage()
+    candidates = Blob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff)
+    for rows in batches(candidates.only("pk", "file"), batch_size):
+        stats.scanned += len(rows)
+        if dry_run:
+            paths = [blob.file.name for blob in rows]
+        else:
+            with transaction.atomic():
+                # Locked first, then checked again: the counter is only a hint,
+                # and uploads deduplicated against a blob meanwhile touch it
+                locked = list(
+                    Blob.objects.select_for_update()
+                    .filter(pk__in=[blob.pk for blob in rows])
+                    .values_list("pk", flat=True)
+                )
+                orphans = candidates.filter(pk__in=locked).exclude(
+                    Exists(File.objects.filter(blob=OuterRef("pk")))
+                )
+                orphans = {
+                    pk: (digest, path)
+                    for pk, digest, path in orphans.values_list("pk", "digest", "file")
+                }
+                Blob.objects.filter(pk__in=orphans).delete()
+            for digest, path in orphans.values():
+                previews.delete(digest)
+            paths = [path for digest, path in orphans.values()]
+        for path in paths:
+            delete_stored(storage, path, stats, dry_run)
+    return stats
+
+
+def collect_pending(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    stats = Stats()
+    storage = uploads.file_storage()
+    pending = PendingDeletion.objects.filter(created_at__lt=cutoff)
+    for rows in batches(pending, batch_size):
+        stats.scanned += len(rows)
+        referenced = is_referenced(row.path for row in rows)
+        for row in rows:
+            if row.path not in referenced:
+                delete_stored(storage, row.path, stats, dry_run)
+        if not dry_run:
+            PendingDeletion.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return stats
+
+
+def collect_sessions(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Abort the upload sessions that weren't completed before ``cutoff``.
+    """
+    stats = Stats()
+    expired = UploadSession.objects.filter(file__isnull=True, updated_at__lt=cutoff)
+    for rows in batches(expired, batch_size):
+        stats.scanned += len(rows)
+        stats.deleted += len(rows)
+        stats.bytes += sum(session.size for session in rows)
+        if not dry_run:
+            for session in rows:
+                uploads.abort_session(session)
+    return stats
+
+
+def collect_link_versions(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Delete the link versions of deleted files and users last bumped before
+    ``cutoff``, when every link they revoked has expired.
+    """
+    stats = Stats()
+    orphaned = LinkVersion.objects.filter(updated_at__lt=cutoff).filter(
+        Q(kind=LinkVersion.FILE)
+        & ~Exists(File.objects.filter(pk=OuterRef("object_id")))
+        | Q(kind=LinkVersion.USER)
+        & ~Exists(User.objects.filter(pk=OuterRef("object_id")))
+    )
+    for rows in batches(orphaned, batch_size):
+        stats.scanned += len(rows)
+        stats.deleted += len(rows)
+        if not dry_run:
+            LinkVersion.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return stats
+
+
+def collect_changes(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Delete the change feed entries recorded before ``cutoff``, clients that
+    haven't read them yet are told to start over.
+    """
+    stats = Stats()
+    expired = Change.objects.filter(created_at__lt=cutoff).only("pk")
+    for rows in batches(expired, batch_size):
+        stats.scanned += len(rows)
+        stats.deleted += len(rows)
+        if not dry_run:
+            Change.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return stats
+
+
+def collect_jobs(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Delete the jobs that finished or failed before ``cutoff``.
+    """
+    stats = Stats()
+    ended = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], finished_at__lt=cutoff
+    ).only("pk")
+    for rows in batches(ended, batch_size):
+        stats.scanned += len(rows)
+        stats.deleted += len(rows)
+        if not dry_run:
+            Job.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return stats
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield f"{path}/{name}"
+    for name in directories:
+        yield from walk(storage, f"{path}/{name}")
+
+
+def collect_storage(cutoff, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Walk the stored files and delete those no row references. Partial
+    uploads belong to their sessions and are left to ``collect_sessions``.
+    """
+    stats = Stats()
+    storage = uploads.file_storage()
+    staging_cutoff = timezone.now() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    batch = []
+
+    def flush():
+        referenced = is_referenced(batch)
+        for path in batch:
+            if path.startswith(STAGING_DIR + "/"):
+                # Temporary files of uploads in progress, or of crashed ones
+                if storage.get_modified_time(path) < staging_cutoff:
+                    delete_stored(storage, path, stats, dry_run)
+            elif path not in referenced and storage.get_modified_time(path) < cutoff:
+                delete_stored(storage, path, stats, dry_run)
+        batch.clear()
+
+    for root in STORAGE_ROOTS:
+        if not storage.exists(root):
+            continue
+        for path in walk(storage, root):
+            if path.startswith(uploads.PARTIAL_DIR + "/"):
+                continue
+            stats.scanned += 1
+            batch.append(path)
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    return stats
+
+
+def collect(
+    grace_period=GRACE_PERIOD, batch_size=BATCH_SIZE, dry_run=False, scan_storage=False
+):
+    """
+    Run every collector and return their stats by name.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=grace_period)
+    results = {
+        "blobs": collect_blobs(cutoff, batch_size, dry_run),
+        "pending": collect_pending(cutoff, batch_size, dry_run),
+        "sessions": collect_sessions(
+            now - timedelta(seconds=UPLOAD_SESSION_TTL), batch_size, dry_run
+        ),
+        "links": collect_link_versions(
+            now - timedelta(seconds=links.MAX_TTL), batch_size, dry_run
+        ),
+        "changes": collect_changes(
+            now - timedelta(seconds=changes.RETENTION), batch_size, dry_run
+        ),
+        "jobs": collect_jobs(
+            now - timedelta(seconds=jobs.RETENTION), batch_size, dry_run
+        ),
+    }
+    if scan_storage:
+        results["storage"] = collect_storage(cutoff, batch_size, dry_run)
+    return results
@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.db import transaction
+
+from . import access
+from .models import File, Permission, Sharing
+
+MAX_PAIRS = getattr(settings, "DRIVE_BULK_MAX_PAIRS", 10000)
+
+GRANT = "grant"
+REVOKE = "revoke"
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+REVOKED = "revoked"
+ABSENT = "absent"
+# No permission is left, but the file is still shared with the user
+SHARED = "shared"
+OWNER = "owner"
+FORBIDDEN = "forbidden"
+NOT_FOUND = "not_found"
+
+
+class GrantError(Exception):
+    pass
+
+
+def target_files(actor, file_ids, group_ids):
+    """
+    Return ``{file_id: File}`` for the listed files and the files of the
+    listed groups of ``actor``. Missing files are left out.
+    """
+    files = File.objects.filter(pk__in=file_ids).only("pk", "owner_id")
+    files = {file_obj.pk: file_obj for file_obj in files}
+    if group_ids:
+        members = File.objects.filter(group__in=group_ids, group__owner=actor).only(
+            "pk", "owner_id"
+        )
+        files.update((file_obj.pk, file_obj) for file_obj in members)
+    return files
+
+
+def apply(actor, action, user_ids, file_ids=(), group_ids=(), level=None):
+    """
+    Grant ``level`` on, or revoke any permission to, every file for every
+    user, in one transaction. Only files owned by ``actor`` are changed.
+    Returns one ``{"file", "user", "status"}`` result per pair.
+    """
+    files = target_files(actor, file_ids, group_ids)
+    all_file_ids = list(dict.fromkeys([*file_ids, *files]))
+    if len(all_file_ids) * len(user_ids) > MAX_PAIRS:
+        raise GrantError(f"Requests are limited to {MAX_PAIRS} file/user pairs.")
+
+    results = []
+    allowed = []
+    for file_id in all_file_ids:
+        file_obj = files.get(file_id)
+        for user_id in user_ids:
+            result = {"file": file_id, "user": user_id}
+            results.append(result)
+            if file_obj is None:
+                result["status"] = NOT_FOUND
+            elif file_obj.owner_id != actor.pk:
+                result["status"] = FORBIDDEN
+            elif file_obj.owner_id == user_id:
+                # Owners always have full access
+                result["status"] = OWNER
+            else:
+                allowed.append(result)
+    if not allowed:
+        return results
+
+    allowed_file_ids = {result["file"] for result in allowed}
+    existing = Permission.objects.filter(
+        file_id__in=allowed_file_ids, user_id__in=user_ids
+    )
+    with transaction.atomic():
+        if action == GRANT:
+            grant(allowed, existing, level)
+        else:
+            revoke(allowed, existing)
+    return results
+
+
+def grant(results, existing, level):
+    current = {
+        (file_id, user_id): permission
+        for file_id, user_id, permission in existing.values_list(
+            "file_id", "user_id", "permission"
+        )
+    }
+    upserts = []
+    for result in results:
+        pair = result["file"], result["user"]
+        if pair not in current:
+            result["status"] = CREATED
+        elif current[pair] != level:
+            result["status"] = UPDATED
+        else:
+            result["status"] = UNCHANGED
+            continue
+        upserts.append(Permission(file_id=pair[0], user_id=pair[1], permission=level))
+    if not upserts:
+        return
+    Permission.objects.bulk_create(
+        upserts,
+        update_conflicts=True,
+        unique_fields=["file", "user"],
+        update_fields=["permission", "updated_at"],
+    )
+    # bulk_create() doesn't send signals, update the access index explicitly
+    access.sync([(p.file_id, p.user_id) for p in upserts])
+
+
+def revoke(results, existing):
+    pairs = {(result["file"], result["user"]) for result in results}
+    revoked = {
+        (p.file_id, p.user_id): p.pk
+        for p in existing.only("pk", "file_id", "user_id")
+        if (p.file_id, p.user_id) in pairs
+    }
+    # Shares grant read access of their own, revoking leaves them alone
+    shared = set(
+        Sharing.objects.filter(
+            shared_file_id__in={file_id for file_id, _ in pairs},
+            shared_with_id__in={user_id for _, user_id in pairs},
+        ).values_list("shared_file_id", "shared_with_id")
+    )
+    for result in results:
+        pair = result["file"], result["user"]
+        if pair in shared:
+            result["status"] = SHARED
+        else:
+            result["status"] = REVOKED if pair in revoked else ABSENT
+    if revoked:
+        # The delete signals are collected and synced in one go
+        with access.deferred():
+            Permission.objects.filter(pk__in=revoked.values()).delete()
@@ -0,0 +1,180 @@
+import logging
+import random
+import time
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, "DRIVE_JOB_MAX_ATTEMPTS", 5)
+BACKOFF_BASE = getattr(settings, "DRIVE_JOB_BACKOFF_BASE", 10)
+BACKOFF_MAX = getattr(settings, "DRIVE_JOB_BACKOFF_MAX", 60 * 60)
+# Running jobs not finished after this long belong to a dead worker
+TIMEOUT = getattr(settings, "DRIVE_JOB_TIMEOUT", 30 * 60)
+# Finished and failed jobs are deleted this long after they ended
+RETENTION = getattr(settings, "DRIVE_JOB_RETENTION", 7 * 24 * 60 * 60)
+
+registry = {}
+
+
+def register(kind):
+    """
+    Register the function running the jobs of ``kind``, it is called with
+    the job payload as keyword arguments.
+    """
+
+    def decorator(func):
+        registry[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue(kind, delay=0, **payload):
+    return enqueue_many(kind, [payload], delay)[0]
+
+
+def enqueue_many(kind, payloads, delay=0):
+    """
+    Queue one job per payload. Inside a transaction the jobs only become
+    visible to workers when it commits, along with the rows they refer to.
+    """
+    if kind not in registry:
+        raise KeyError(f"No job registered as {kind!r}.")
+    run_at = timezone.now() + timedelta(seconds=delay)
+    return Job.objects.bulk_create(
+        [
+            Job(kind=kind, payload=payload, run_at=run_at, max_attempts=MAX_ATTEMPTS)
+            for payload in payloads
+        ]
+    )
+
+
+def claim(limit, kinds=None):
+    """
+    Mark up to ``limit`` due jobs as running and return their ids. Workers
+    never claim the same job: rows locked by another worker are skipped,
+    or, without ``SKIP LOCKED`` (SQLite), each claim is a conditional update.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING, run_at__lte=now).order_by("run_at")
+    if kinds:
+        due = due.filter(kind__in=kinds)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_ids = list(
+                due.select_for_update(skip_locked=True).values_list("pk", flat=True)[
+                    :limit
+                ]
+            )
+            Job.objects.filter(pk__in=job_ids).update(
+                status=Job.RUNNING, started_at=now
+            )
+        return job_ids
+    job_ids = []
+    for job_id in due.values_list("pk", flat=True)[:limit]:
+        if Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now
+        ):
+            job_ids.append(job_id)
+    return job_ids
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def execute(job_id):
+    """
+    Run a claimed job and record the outcome. Returns ``(kind, succeeded,
+    queued seconds, run seconds)``.
+    """
+    job = Job.objects.get(pk=job_id)
+    started = time.monotonic()
+    try:
+        registry[job.kind](**job.payload)
+    except Exception:
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error("Job %s failed: %s", job, job.last_error)
+        succeeded = False
+    else:
+        job.attempts += 1
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+        succeeded = True
+    job.save(
+        update_fields=[
+            "status",
+            "attempts",
+            "run_at",
+            "finished_at",
+            "last_error",
+            "updated_at",
+        ]
+    )
+    queued = (job.started_at - job.created_at).total_seconds()
+    return job.kind, succeeded, queued, time.monotonic() - started
+
+
+def requeue_stale():
+    """
+    Put back the running jobs of workers that died before finishing them,
+    which counts as an attempt: a job killing its worker every time fails
+    once it has used up its attempts. Returns how many were put back.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING, started_at__lt=now - timedelta(seconds=TIMEOUT)
+    )
+    failed = stale.filter(attempts__gte=F("max_attempts") - 1).update(
+        status=Job.FAILED,
+        attempts=F("attempts") + 1,
+        finished_at=now,
+        last_error=f"Still running after {TIMEOUT} seconds, its worker died.",
+        updated_at=now,
+    )
+    if failed:
+        logger.error("%d jobs failed, their workers died on every attempt.", failed)
+    return stale.update(status=Job.PENDING, attempts=F("attempts") + 1, updated_at=now)
+
+
+class Stats:
+    """
+    Job counts and latencies per kind, for a worker's reports.
+    """
+
+    def __init__(self):
+        self.kinds = defaultdict(
+            lambda: {"ok": 0, "failed": 0, "queued": 0.0, "run": 0.0}
+        )
+
+    def add(self, kind, succeeded, queued, run):
+        stats = self.kinds[kind]
+        stats["ok" if succeeded else "failed"] += 1
+        stats["queued"] += queued
+        stats["run"] += run
+
+    def lines(self):
+        for kind, stats in sorted(self.kinds.items()):
+            count = stats["ok"] + stats["failed"]
+            yield (
+                f"{kind}: {stats['ok']} ok, {stats['failed']} failed, "
+                f"queued {stats['queued'] / count:.3f}s, "
+                f"ran {stats['run'] / count:.3f}s on average"
+            )
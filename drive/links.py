@@ -0,0 +1,203 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import LRUCache
+from .models import Blob, File, LinkVersion
+
+TTL = getattr(settings, "DRIVE_LINK_TTL", 60 * 60)
+MAX_TTL = getattr(settings, "DRIVE_LINK_MAX_TTL", 7 * 24 * 60 * 60)
+# Revocations reach the other workers once their copy of the version expires
+CACHE_TTL = getattr(settings, "DRIVE_LINK_CACHE_TTL", 30)
+# Alias of a Django cache shared by all workers, None keeps the cache local
+SHARED_CACHE = getattr(settings, "DRIVE_LINK_CACHE", None)
+
+SALT = "drive.links"
+
+local_cache = LRUCache(
+    maxsize=getattr(settings, "DRIVE_LINK_CACHE_SIZE", 10000),
+    ttl=CACHE_TTL,
+    name="links",
+)
+
+
+class LinkError(Exception):
+    pass
+
+
+def cache_key(kind, object_id):
+    return f"drive:links:{kind}:{object_id}"
+
+
+def fetch_versions(keys):
+    """
+    Read the versions of ``(kind, object_id)`` keys in one query. Objects
+    without a row never had a link issued, or revoked, so they are at 0.
+    """
+    query = Q()
+    for kind, object_id in keys:
+        query |= Q(kind=kind, object_id=object_id)
+    versions = dict.fromkeys(keys, 0)
+    rows = LinkVersion.objects.filter(query).values_list("kind", "object_id", "version")
+    for kind, object_id, version in rows:
+        versions[kind, object_id] = version
+    return versions
+
+
+def get_versions(file_id, user_id):
+    """
+    Return the current file and user versions, from the caches when they
+    have them.
+    """
+    keys = [(LinkVersion.FILE, file_id), (LinkVersion.USER, user_id)]
+    versions = {}
+    for key in keys:
+        version = local_cache.get(cache_key(*key))
+        if version is not None:
+            versions[key] = version
+    missing = [key for key in keys if key not in versions]
+    if missing and SHARED_CACHE:
+        shared = caches[SHARED_CACHE].get_many([cache_key(*key) for key in missing])
+        for key in missing:
+            version = shared.get(cache_key(*key))
+            if version is not None:
+                versions[key] = version
+                local_cache.set(cache_key(*key), version)
+        missing = [key for key in missing if key not in versions]
+    if missing:
+        fetched = fetch_versions(missing)
+        for key, version in fetched.items():
+            local_cache.set(cache_key(*key), version)
+        if SHARED_CACHE:
+            caches[SHARED_CACHE].set_many(
+                {cache_key(*key): version for key, version in fetched.items()},
+                CACHE_TTL,
+            )
+        versions.update(fetched)
+    return versions[keys[0]], versions[keys[1]]
+
+
+def issue(file_obj, user, ttl=None):
+    """
+    Return a token granting a download of ``file_obj`` until it expires or
+    the file or user version is bumped. It carries what serving the file
+    needs, so checking it takes no query.
+    """
+    ttl = min(ttl or TTL, MAX_TTL)
+    # Only objects with a row have their version bumped on revocation
+    LinkVersion.objects.bulk_create(
+        [
+            LinkVersion(kind=LinkVersion.FILE, object_id=file_obj.pk),
+            LinkVersion(kind=LinkVersion.USER, object_id=user.pk),
+        ],
+        ignore_conflicts=True,
+    )
+    keys = [(LinkVersion.FILE, file_obj.pk), (LinkVersion.USER, user.pk)]
+    versions = fetch_versions(keys)
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    payload = {
+        "f": file_obj.pk,
+        "u": user.pk,
+        "fv": versions[keys[0]],
+        "uv": versions[keys[1]],
+        "x": int(expires_at.timestamp()),
+        "n": file_obj.name,
+        "p": file_obj.file.name,
+        "t": file_obj.content_type,
+        "m": file_obj.updated_at.timestamp(),
+    }
+    if file_obj.blob_id is not None:
+        payload["b"] = [file_obj.blob_id, file_obj.blob.digest]
+    token = signing.dumps(payload, salt=SALT, compress=True)
+    return token, expires_at
+
+
+def verify(token):
+    """
+    Return an unsaved ``File`` built from a valid token, or raise
+    ``LinkError``.
+    """
+    try:
+        payload = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        raise LinkError("Invalid link.")
+    if payload["x"] < time.time():
+        raise LinkError("This link has expired.")
+    if get_versions(payload["f"], payload["u"]) != (payload["fv"], payload["uv"]):
+        raise LinkError("This link has been revoked.")
+    file_obj = File(
+        pk=payload["f"],
+        name=payload["n"],
+        file=payload["p"],
+        content_type=payload["t"],
+        updated_at=datetime.fromtimestamp(
+            payload["m"], tz=timezone.get_default_timezone()
+        ),
+    )
+    if "b" in payload:
+        blob_id, digest = payload["b"]
+        file_obj.blob = Blob(pk=blob_id, digest=digest)
+    return file_obj
+
+
+def revoke(kind, object_ids):
+    """
+    Bump the versions of ``object_ids``, invalidating the links issued for
+    them. Objects no link was ever issued for have no row to update.
+    """
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+    # updated_at tells the garbage collector when the last link expires
+    LinkVersion.objects.filter(kind=kind, object_id__in=object_ids).update(
+        version=F("version") + 1, updated_at=timezone.now()
+    )
+    keys = [cache_key(kind, object_id) for object_id in object_ids]
+    invalidate(keys)
+    # Again once committed, others may have cached the old version meanwhile
+    transaction.on_commit(lambda: invalidate(keys))
+
+
+def revoke_file(file_id):
+    revoke(LinkVersion.FILE, [file_id])
+
+
+def revoke_user(user_id):
+    revoke(LinkVersion.USER, [user_id])
+
+
+def revoke_lost_access(pairs):
+    """
+    Revoke the links of the files in ``(file_id, user_id)`` pairs whose user
+    lost access to them and ever issued a link. Links don't record who may
+    still open them, so all the links of such a file go.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return
+    issuers = set(
+        LinkVersion.objects.filter(
+            kind=LinkVersion.USER, object_id__in={user_id for _, user_id in pairs}
+        ).values_list("object_id", flat=True)
+    )
+    revoke(
+        LinkVersion.FILE,
+        {file_id for file_id, user_id in pairs if user_id in issuers},
+    )
+
+
+def invalidate(keys):
+    for key in keys:
+        local_cache.delete(key)
+    if SHARED_CACHE:
+        caches[SHARED_CACHE].delete_many(keys)
+
+
+def clear():
+    local_cache.clear()
@@ -0,0 +1,205 @@
+import json
+import random
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from drive import benchmark
+
+# Recorded with the results, what makes two runs comparable
+SETTINGS = (
+    "users",
+    "files",
+    "groups",
+    "shares",
+    "contents",
+    "file_size",
+    "upload_sizes",
+    "multipart_limit",
+    "iterations",
+    "concurrency",
+    "seed",
+    "serialization",
+)
+
+SERIALIZATION_HEADER = (
+    f"{'listing':<24} {'rows':>6} {'bytes':>9} {'serializer ms':>14} "
+    f"{'fast ms':>9} {'speedup':>8}"
+)
+
+HEADER = (
+    f"{'scenario':<24} {'reqs':>6} {'errors':>6} {'req/s':>9} {'p50 ms':>9} "
+    f"{'p95 ms':>9} {'p99 ms':>9} {'queries':>7} {'bytes':>9}"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway copy of the database with synthetic users, files, groups "
+        "and permissions, drive every API endpoint concurrently and report "
+        "throughput, latency percentiles, queries per request and bytes sent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--files", type=int, default=50, help="Files per user.")
+        parser.add_argument("--groups", type=int, default=5, help="Groups per user.")
+        parser.add_argument(
+            "--shares", type=int, default=3, help="Users each file is shared with."
+        )
+        parser.add_argument(
+            "--contents", type=int, default=20, help="Distinct contents of the files."
+        )
+        parser.add_argument("--file-size", default="4KB")
+        parser.add_argument(
+            "--upload-sizes",
+            default="4KB,1MB,16MB,256MB",
+            help="Comma separated sizes of the upload scenarios, e.g. 1KB,1GB.",
+        )
+        parser.add_argument(
+            "--multipart-limit",
+            default=benchmark.format_size(benchmark.MULTIPART_LIMIT),
+            help="Larger uploads are sent in chunks through upload sessions.",
+        )
+        parser.add_argument(
+            "--iterations", type=int, default=100, help="Requests per scenario."
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Requests sent at once, 0 sends them one by one in this thread.",
+        )
+        parser.add_argument(
+            "--only",
+            action="append",
+            help="Run the scenarios whose name starts with this, repeatable.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument(
+            "--baseline", help="Compare with the JSON results of an earlier run."
+        )
+        parser.add_argument(
+            "--list", action="store_true", help="List the scenarios and exit."
+        )
+        parser.add_argument(
+            "--serialization",
+            action="store_true",
+            help="Instead of the scenarios, time the listings of a user rendered "
+            "through the serializers and from values() rows, --iterations times.",
+        )
+
+    def handle(self, *args, **options):
+        scenarios = benchmark.scenarios(
+            options["upload_sizes"].split(","),
+            benchmark.parse_size(options["multipart_limit"]),
+        )
+        if options["only"]:
+            scenarios = [
+                scenario
+                for scenario in scenarios
+                if scenario.name.startswith(tuple(options["only"]))
+            ]
+            if not scenarios:
+                raise CommandError("No scenario matches --only.")
+        if options["list"]:
+            for scenario in scenarios:
+                self.stdout.write(
+                    f"{scenario.name:<24} {scenario.method:<7} {scenario.url_name}"
+                )
+            return
+        if connection.vendor == "sqlite" and options["concurrency"]:
+            self.stderr.write(
+                "SQLite locks whole tables, concurrent writes will fail with "
+                "'database table is locked'. Use PostgreSQL, or --concurrency 0."
+            )
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as fp:
+                baseline = json.load(fp)
+
+        # Never touch the real data: test databases and a temporary media root
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root, ALLOWED_HOSTS=["testserver"], DEBUG=False
+            ):
+                results, dataset = self.run(scenarios, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        recorded = {key: options[key] for key in SETTINGS}
+        report = benchmark.report(results, dataset, recorded)
+        if baseline is not None:
+            self.write_comparison(report, baseline)
+        if options["output"]:
+            with open(options["output"], "w") as fp:
+                json.dump(report, fp, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, scenarios, options):
+        self.stdout.write("Seeding...")
+        dataset = benchmark.seed(
+            users=options["users"],
+            files=options["files"],
+            groups=options["groups"],
+            shares=options["shares"],
+            contents=options["contents"],
+            file_size=benchmark.parse_size(options["file_size"]),
+            rng=random.Random(options["seed"]),
+        )
+        self.stdout.write(f"Seeded {dataset.as_dict()}")
+        if options["serialization"]:
+            self.stdout.write(SERIALIZATION_HEADER)
+            results = benchmark.compare_serialization(dataset, options["iterations"])
+            for result in results:
+                self.stdout.write(format_serialization(result.as_dict()))
+            return results, dataset
+        self.stdout.write(HEADER)
+        results = []
+        for scenario in scenarios:
+            result = benchmark.run_scenario(
+                scenario,
+                dataset,
+                iterations=options["iterations"],
+                concurrency=options["concurrency"],
+                seed=options["seed"],
+            )
+            results.append(result)
+            self.stdout.write(format_line(result.as_dict()))
+        return results, dataset
+
+    def write_comparison(self, report, baseline):
+        self.stdout.write(f"\n{'compared to baseline':<24} {'req/s':>9} {'p95':>9}")
+        for name, throughput, p95 in benchmark.compare(report, baseline):
+            self.stdout.write(
+                f"{name:<24} {format_change(throughput):>9} {format_change(p95):>9}"
+            )
+
+
+def format_change(change):
+    return "n/a" if change is None else f"{change:+.1%}"
+
+
+def format_serialization(result):
+    return (
+        f"{result['name']:<24} {result['rows']:>6} "
+        f"{benchmark.format_size(result['bytes']):>9} "
+        f"{result['serializer_ms']:>14.3f} {result['fast_ms']:>9.3f} "
+        f"{result['speedup'] or 0:>7.2f}x"
+    )
+
+
+def format_line(result):
+    latency = result.get("latency_ms", {})
+    queries = result.get("queries", {})
+    return (
+        f"{result['name']:<24} {result['requests']:>6} {result['errors']:>6} "
+        f"{result['throughput'] or 0:>9.1f} {latency.get('p50', 0):>9.2f} "
+        f"{latency.get('p95', 0):>9.2f} {latency.get('p99', 0):>9.2f} "
+        f"{queries.get('mean', 0):>7.1f} "
+        f"{benchmark.format_size(result['bytes_in'] + result['bytes_out']):>9}"
+    )
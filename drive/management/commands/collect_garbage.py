@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from drive import gc
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete unreferenced blobs, files queued for deletion, expired upload "
+        "sessions, the link versions of deleted files and users, expired "
+        "change feed entries and old finished jobs, optionally walking the "
+        "storage for orphaned files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=gc.BATCH_SIZE)
+        parser.add_argument(
+            "--grace-period",
+            type=int,
+            default=gc.GRACE_PERIOD,
+            help="Seconds something must have been unused before it is deleted.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report without deleting."
+        )
+        parser.add_argument(
+            "--scan-storage",
+            action="store_true",
+            help="Also walk the storage for files no row references.",
+        )
+        parser.add_argument(
+            "--loop",
+            type=int,
+            metavar="SECONDS",
+            help="Keep running, collecting every SECONDS.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            results = gc.collect(
+                grace_period=options["grace_period"],
+                batch_size=options["batch_size"],
+                dry_run=options["dry_run"],
+                scan_storage=options["scan_storage"],
+            )
+            prefix = "[dry run] " if options["dry_run"] else ""
+            for name, stats in results.items():
+                self.stdout.write(f"{prefix}{name}: {stats}")
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
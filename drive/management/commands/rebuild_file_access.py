@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from drive import access
+from drive.models import File
+
+
+class Command(BaseCommand):
+    help = "Recompute the file access index from owners, permissions and sharings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        total = 0
+        while True:
+            file_ids = list(
+                File.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not file_ids:
+                break
+            access.rebuild(file_ids)
+            last_id = file_ids[-1]
+            total += len(file_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt access for {total} files."))
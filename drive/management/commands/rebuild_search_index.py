@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from drive import search
+from drive.models import File, Group, SearchToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the search tokens of file and group names, for databases "
+        "searched without pg_trgm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if search.backend() != search.TOKENS:
+            self.stdout.write("Names are searched through pg_trgm, nothing to do.")
+            return
+        batch_size = options["batch_size"]
+        for kind, model in ((SearchToken.FILE, File), (SearchToken.GROUP, Group)):
+            last_id = 0
+            total = 0
+            while True:
+                names = dict(
+                    model.objects.filter(pk__gt=last_id)
+                    .order_by("pk")
+                    .values_list("pk", "name")[:batch_size]
+                )
+                if not names:
+                    break
+                search.rebuild(kind, names)
+                last_id = max(names)
+                total += len(names)
+            self.stdout.write(
+                self.style.SUCCESS(f"Rebuilt search tokens for {total} {kind}s.")
+            )
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from drive import quotas
+from drive.models import File
+
+
+class Command(BaseCommand):
+    help = "Recompute the storage usage counters from the files of each user."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--fill-sizes",
+            action="store_true",
+            help="Read the size of files stored before sizes were recorded.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["fill_sizes"]:
+            filled = self.fill_sizes(batch_size)
+            self.stdout.write(f"Recorded the size of {filled} files.")
+        last_id = 0
+        total = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            quotas.recompute(user_ids)
+            last_id = user_ids[-1]
+            total += len(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed usage for {total} users."))
+
+    def fill_sizes(self, batch_size):
+        last_id = 0
+        total = 0
+        while True:
+            files = list(
+                File.objects.filter(pk__gt=last_id, size__isnull=True)
+                .exclude(file="")
+                .order_by("pk")
+                .only("pk", "file")[:batch_size]
+            )
+            if not files:
+                break
+            for file_obj in files:
+                try:
+                    file_obj.size = file_obj.file.size
+                except OSError:
+                    file_obj.size = 0
+            File.objects.bulk_update(files, ["size"])
+            last_id = files[-1].pk
+            total += len(files)
+        return total
@@ -0,0 +1,107 @@
+import multiprocessing
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from drive import jobs
+
+
+def execute(job_id):
+    close_old_connections()
+    try:
+        return jobs.execute(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs with a pool of threads or processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Jobs run at once, 0 runs them one by one in this process.",
+        )
+        parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+        parser.add_argument("--kind", action="append", dest="kinds")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--stats-interval",
+            type=float,
+            default=60.0,
+            help="Seconds between latency reports.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once no job is due."
+        )
+
+    def handle(self, *args, **options):
+        self.stats = jobs.Stats()
+        self.reported_at = time.monotonic()
+        concurrency = options["concurrency"]
+        if concurrency == 0:
+            self.run_inline(options)
+        else:
+            if options["mode"] == "process":
+                # Spawned rather than forked, a child closing the connection it
+                # inherited would close the parent's too
+                pool = ProcessPoolExecutor(
+                    concurrency,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=django.setup,
+                )
+            else:
+                pool = ThreadPoolExecutor(concurrency)
+            with pool:
+                self.run_pool(pool, concurrency, options)
+        self.report()
+
+    def run_inline(self, options):
+        while True:
+            jobs.requeue_stale()
+            job_ids = jobs.claim(1, options["kinds"])
+            if not job_ids:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+            self.stats.add(*jobs.execute(job_ids[0]))
+            self.maybe_report(options)
+
+    def run_pool(self, pool, concurrency, options):
+        running = set()
+        while True:
+            if len(running) < concurrency:
+                jobs.requeue_stale()
+                for job_id in jobs.claim(concurrency - len(running), options["kinds"]):
+                    running.add(pool.submit(execute, job_id))
+            if not running:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+            done, running = wait(
+                running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                self.stats.add(*future.result())
+            self.maybe_report(options)
+
+    def maybe_report(self, options):
+        if time.monotonic() - self.reported_at >= options["stats_interval"]:
+            self.report()
+
+    def report(self):
+        self.reported_at = time.monotonic()
+        for line in self.stats.lines():
+            self.stdout.write(line)
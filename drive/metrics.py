@@ -0,0 +1,318 @@
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, "DRIVE_METRICS", True)
+# Scrapers send "Authorization: Bearer <token>", staff users need none
+TOKEN = getattr(settings, "DRIVE_METRICS_TOKEN", None)
+# Requests taking longer are logged with their queries, None logs none
+SLOW_REQUEST_SECONDS = getattr(settings, "DRIVE_SLOW_REQUEST_SECONDS", 1.0)
+# Statements listed in a slow request entry, slowest first
+SLOW_REQUEST_QUERIES = getattr(settings, "DRIVE_SLOW_REQUEST_QUERIES", 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    "drive_requests_total": (
+        "counter",
+        "Requests handled, by endpoint, method and status.",
+    ),
+    "drive_request_duration_seconds": (
+        "histogram",
+        "Time to produce the response; streamed bodies are sent afterwards.",
+    ),
+    "drive_request_phase_seconds_total": (
+        "counter",
+        "Request time by phase. Time in a nested phase, such as the queries of "
+        "a permission check, only counts for the inner one.",
+    ),
+    "drive_db_queries_total": ("counter", "Database queries, by endpoint."),
+    "drive_request_bytes_total": (
+        "counter",
+        "Body bytes received (in) and sent (out), by endpoint. Its rate is the "
+        "upload and download throughput.",
+    ),
+    "drive_slow_requests_total": (
+        "counter",
+        "Requests slower than DRIVE_SLOW_REQUEST_SECONDS, by endpoint.",
+    ),
+    "drive_cache_hits_total": ("counter", "Hits of the in-process caches."),
+    "drive_cache_misses_total": ("counter", "Misses of the in-process caches."),
+    "drive_cache_entries": ("gauge", "Entries held by the in-process caches."),
+}
+
+current = ContextVar("drive_request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Where the time of one request goes. Phases nest, each keeps only the
+    time not spent in the phases inside it.
+    """
+
+    def __init__(self, collect_statements=False):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.stack = []
+        self.queries = 0
+        self.statements = {} if collect_statements else None
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, started, nested = self.stack.pop()
+        elapsed = time.perf_counter() - started
+        self.phases[name] += elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return elapsed
+
+    def execute(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper()
+        self.enter("db")
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = self.exit()
+            self.queries += 1
+            if self.statements is not None:
+                entry = self.statements.setdefault(sql, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+
+
+@contextmanager
+def phase(name):
+    """
+    Count the time spent in the block, or in the decorated function, for
+    phase ``name`` of the current request. Outside of requests it does
+    nothing.
+    """
+    record = current.get()
+    if record is None:
+        yield
+        return
+    record.enter(name)
+    try:
+        yield
+    finally:
+        record.exit()
+
+
+class Registry:
+    """
+    The counters and histograms of this process. Each worker process keeps
+    its own, scrape every worker to see them all.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            self.counters[name, labels] += amount
+
+    def observe_request(self, endpoint, method, status, duration, record, bytes_in):
+        key = (("endpoint", endpoint),)
+        with self.lock:
+            self.counters[
+                "drive_requests_total",
+                key + (("method", method), ("status", str(status))),
+            ] += 1
+            self.counters["drive_db_queries_total", key] += record.queries
+            self.counters[
+                "drive_request_bytes_total", key + (("direction", "in"),)
+            ] += bytes_in
+            other = duration
+            for name, seconds in record.phases.items():
+                other -= seconds
+                self.counters[
+                    "drive_request_phase_seconds_total", key + (("phase", name),)
+                ] += seconds
+            self.counters[
+                "drive_request_phase_seconds_total", key + (("phase", "other"),)
+            ] += max(other, 0.0)
+            histogram = self.histograms.get(key + (("method", method),))
+            if histogram is None:
+                histogram = self.histograms[key + (("method", method),)] = [0] * (
+                    len(DURATION_BUCKETS) + 2
+                )
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += duration
+
+    def samples(self):
+        """
+        Yield ``(metric, name, labels, value)`` of every sample.
+        """
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [
+                (key, list(values)) for key, values in self.histograms.items()
+            ]
+        for (name, labels), value in counters:
+            yield name, name, labels, value
+        metric = "drive_request_duration_seconds"
+        for labels, values in histograms:
+            for bound, count in zip(DURATION_BUCKETS, values):
+                yield metric, metric + "_bucket", labels + (("le", str(bound)),), count
+            yield metric, metric + "_bucket", labels + (("le", "+Inf"),), values[-2]
+            yield metric, metric + "_count", labels, values[-2]
+            yield metric, metric + "_sum", labels, values[-1]
+        for cache_name, cache in sorted(LRUCache.instances.items()):
+            labels = (("cache", cache_name),)
+            yield "drive_cache_hits_total", "drive_cache_hits_total", labels, cache.hits
+            yield (
+                "drive_cache_misses_total",
+                "drive_cache_misses_total",
+                labels,
+                cache.misses,
+            )
+            yield "drive_cache_entries", "drive_cache_entries", labels, len(cache)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render():
+    """
+    Return the metrics in the Prometheus text exposition format.
+    """
+    by_metric = defaultdict(list)
+    for metric, name, labels, value in registry.samples():
+        by_metric[metric].append((name, labels, value))
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        if metric not in by_metric:
+            continue
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, labels, value in by_metric[metric]:
+            if labels:
+                pairs = ",".join(f'{key}="{escape(str(val))}"' for key, val in labels)
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def has_token(request):
+    if not TOKEN:
+        return False
+    keyword, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    return keyword.lower() == "bearer" and hmac.compare_digest(
+        credentials.strip().encode(), TOKEN.encode()
+    )
+
+
+def endpoint_name(request):
+    match = request.resolver_match
+    return match.view_name if match is not None else "unmatched"
+
+
+def count_sent(endpoint, content):
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.inc(
+            "drive_request_bytes_total",
+            (("endpoint", endpoint), ("direction", "out")),
+            sent,
+        )
+
+
+def response_bytes(endpoint, response):
+    """
+    Return the size of the response body. Streams without a known length are
+    counted as they are sent; file responses are left alone so servers can
+    still ``sendfile`` them.
+    """
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    if getattr(response, "file_to_stream", None) is None and not response.is_async:
+        response.streaming_content = count_sent(endpoint, response.streaming_content)
+    return 0
+
+
+def request_bytes(request):
+    try:
+        return int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return 0
+
+
+def finish(request, response, record):
+    """
+    Record a handled request, and log it when it was slow.
+    """
+    duration = time.perf_counter() - record.started
+    endpoint = endpoint_name(request)
+    bytes_in = request_bytes(request)
+    bytes_out = response_bytes(endpoint, response)
+    registry.observe_request(
+        endpoint, request.method, response.status_code, duration, record, bytes_in
+    )
+    if bytes_out:
+        registry.inc(
+            "drive_request_bytes_total",
+            (("endpoint", endpoint), ("direction", "out")),
+            bytes_out,
+        )
+    if SLOW_REQUEST_SECONDS is not None and duration >= SLOW_REQUEST_SECONDS:
+        registry.inc("drive_slow_requests_total", (("endpoint", endpoint),))
+        log_slow_request(request, response, record, duration, bytes_in, bytes_out)
+
+
+def log_slow_request(request, response, record, duration, bytes_in, bytes_out):
+    # The route, not the path, links carry their token in the path
+    match = request.resolver_match
+    route = match.route if match is not None else "unmatched"
+    phases = ", ".join(
+        f"{name} {seconds * 1000:.1f}ms"
+        for name, seconds in sorted(record.phases.items(), key=lambda item: -item[1])
+    )
+    lines = [
+        f"Slow request: {request.method} {route} {response.status_code} in "
+        f"{duration * 1000:.1f}ms, {record.queries} queries, {bytes_in} bytes in, "
+        f"{bytes_out} bytes out; {phases or 'no phases'}"
+    ]
+    statements = sorted((record.statements or {}).items(), key=lambda item: -item[1][1])
+    for sql, (count, seconds) in statements[:SLOW_REQUEST_QUERIES]:
+        lines.append(f"  {count}x {seconds * 1000:.1f}ms {sql}")
+    if len(statements) > SLOW_REQUEST_QUERIES:
+        lines.append(f"  and {len(statements) - SLOW_REQUEST_QUERIES} more statements")
+    logger.warning("\n".join(lines))
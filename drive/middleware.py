@@ -0,0 +1,58 @@
+from contextlib import ExitStack
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics, routers
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the duration, phases, queries and body sizes of every request for
+    the metrics endpoint, and log the slow ones. Put it first so the time of
+    the other middleware is counted too.
+    """
+
+    def __init__(self, get_response):
+        if not metrics.ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        record = metrics.RequestMetrics(
+            collect_statements=metrics.SLOW_REQUEST_SECONDS is not None
+        )
+        token = metrics.current.set(record)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record.execute))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        metrics.finish(request, response, record)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the reads of safe requests to the read replicas, and keep the
+    users who write on the primary until the replicas have caught up.
+    """
+
+    def __init__(self, get_response):
+        if not routers.REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routing = routers.Routing(read_only=request.method in SAFE_METHODS)
+        token = routers.current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current.reset(token)
+        if routing.wrote and routing.user_id is not None:
+            routers.pin(routing.user_id)
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0004_file_metadata"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="sharing",
+            index=models.Index(
+                fields=["shared_file", "shared_with"],
+                name="drive_shari_shared__7eb26b_idx",
+            ),
+        ),
+    ]
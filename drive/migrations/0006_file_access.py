@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:54
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def bulk_insert(model, rows, batch_size=1000):
+    while batch := list(islice(rows, batch_size)):
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill_file_access(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    FileAccess = apps.get_model("drive", "FileAccess")
+    Permission = apps.get_model("drive", "Permission")
+    Sharing = apps.get_model("drive", "Sharing")
+    # Inserted by precedence, ignore_conflicts keeps the strongest grant
+    rows = (
+        FileAccess(file_id=file_id, user_id=user_id, level="owner", source="owner")
+        for file_id, user_id in File.objects.values_list("pk", "owner_id").iterator()
+    )
+    bulk_insert(FileAccess, rows)
+    rows = (
+        FileAccess(
+            file_id=file_id, user_id=user_id, level=permission, source="permission"
+        )
+        for file_id, user_id, permission in Permission.objects.values_list(
+            "file_id", "user_id", "permission"
+        ).iterator()
+    )
+    bulk_insert(FileAccess, rows)
+    rows = (
+        FileAccess(file_id=file_id, user_id=user_id, level="read", source="sharing")
+        for file_id, user_id in Sharing.objects.values_list(
+            "shared_file_id", "shared_with_id"
+        ).iterator()
+    )
+    bulk_insert(FileAccess, rows)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0005_sharing_lookup_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileAccess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "level",
+                    models.CharField(
+                        choices=[
+                            ("read", "Read"),
+                            ("change", "Change"),
+                            ("owner", "Owner"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("owner", "Owner"),
+                            ("permission", "Permission"),
+                            ("sharing", "Sharing"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="drive.file",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_access",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "source", "file"],
+                        name="drive_filea_user_id_6797e0_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "file"), name="unique_file_access"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_file_access, migrations.RunPython.noop),
+    ]
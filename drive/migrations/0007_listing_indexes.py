@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0006_file_access"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["owner", "created_at", "id"],
+                name="drive_file_owner_i_7252b8_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="group",
+            index=models.Index(
+                fields=["owner", "created_at", "id"],
+                name="drive_group_owner_i_e28a8c_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0007_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blob",
+            name="crc32",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_sharings(apps, schema_editor):
+    Sharing = apps.get_model("drive", "Sharing")
+    # Keep the earliest share of each (file, user) pair
+    duplicates = (
+        Sharing.objects.values("shared_file_id", "shared_with_id")
+        .annotate(count=Count("pk"), first_pk=Min("pk"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates.iterator():
+        Sharing.objects.filter(
+            shared_file_id=row["shared_file_id"],
+            shared_with_id=row["shared_with_id"],
+        ).exclude(pk=row["first_pk"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0008_blob_crc32"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_sharings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="sharing",
+            constraint=models.UniqueConstraint(
+                fields=("shared_file", "shared_with"), name="unique_sharing"
+            ),
+        ),
+        # Covered by the index of the unique constraint
+        migrations.RemoveIndex(
+            model_name="sharing",
+            name="drive_shari_shared__7eb26b_idx",
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_storage_usage(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    StorageUsage = apps.get_model("drive", "StorageUsage")
+    # Files stored before sizes were recorded count once recompute fills them
+    totals = (
+        File.objects.values("owner_id")
+        .annotate(total=Sum("size"))
+        .values_list("owner_id", "total")
+    )
+    StorageUsage.objects.bulk_create(
+        (
+            StorageUsage(user_id=user_id, used=total or 0)
+            for user_id, total in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("drive", "0010_change_log"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StorageUsage",
+            fields=[
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="storage_usage",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("used", models.BigIntegerField(default=0)),
+                ("quota", models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.RunPython(backfill_storage_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+
+WORD_RE = re.compile(r"[^\W_]+")
+
+TRIGRAM_INDEXES = {
+    "drive_file_name_trgm": "drive_file",
+    "drive_group_name_trgm": "drive_group",
+}
+
+
+def search_backend(connection):
+    backend = getattr(settings, "DRIVE_SEARCH_BACKEND", None)
+    if backend:
+        return backend
+    return "trigram" if connection.vendor == "postgresql" else "tokens"
+
+
+def create_trigram_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or search_backend(connection) != "trigram":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index, table in TRIGRAM_INDEXES.items():
+        # The expression icontains and istartswith lookups compare
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {index} ON {table} "
+            "USING gin (UPPER(name::text) gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for index in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+def backfill_search_tokens(apps, schema_editor):
+    if search_backend(schema_editor.connection) != "tokens":
+        return
+    SearchToken = apps.get_model("drive", "SearchToken")
+    for kind, model in (("file", "File"), ("group", "Group")):
+        names = apps.get_model("drive", model).objects.values_list("pk", "name")
+        rows = (
+            SearchToken(kind=kind, object_id=object_id, token=token)
+            for object_id, name in names.iterator()
+            for token in dict.fromkeys(
+                word[:64] for word in WORD_RE.findall(name.lower())
+            )
+        )
+        while batch := list(islice(rows, 1000)):
+            SearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0014_link_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("file", "File"), ("group", "Group")], max_length=10
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("token", models.CharField(max_length=64)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "token", "object_id"],
+                        name="drive_searc_kind_1d84cc_idx",
+                    ),
+                    models.Index(
+                        fields=["kind", "object_id", "token"],
+                        name="drive_searc_kind_6b58e7_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
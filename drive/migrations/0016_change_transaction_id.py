@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drive", "0015_search_tokens"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="change",
+            name="drive_chang_user_id_3aa830_idx",
+        ),
+        migrations.AddField(
+            model_name="change",
+            name="transaction_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="change",
+            index=models.Index(
+                fields=["user", "transaction_id", "id"],
+                name="drive_chang_user_id_ae0c5e_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+import mimetypes
+
+SNIFF_SIZE = 512
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"%!PS", "application/postscript"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"BZh", "application/x-bzip2"),
+    (b"\xfd7zXZ\x00", "application/x-xz"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+    (b"ID3", "audio/mpeg"),
+    (b"\x1a\x45\xdf\xa3", "video/webm"),
+)
+
+
+def guess(name):
+    return mimetypes.guess_type(name)[0] or DEFAULT_CONTENT_TYPE
+
+
+def sniff(head, name=""):
+    """
+    Detect the content type from the first bytes of a file, falling back to
+    the file name for containers (e.g. .docx is a zip) and plain text.
+    """
+    by_name = guess(name)
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if content_type == "application/zip" and by_name != DEFAULT_CONTENT_TYPE:
+                return by_name
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return "video/mp4" if by_name == DEFAULT_CONTENT_TYPE else by_name
+    if b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as exc:
+            # A multi-byte character cut off at the end of the sample is fine
+            if exc.start < len(head) - 3:
+                return by_name
+        return by_name if by_name != DEFAULT_CONTENT_TYPE else "text/plain"
+    return by_name
+
+
+def detect(content):
+    """
+    Return the content type of an uploaded file, reusing the one sniffed by
+    the upload handler when it is available.
+    """
+    detected = getattr(content, "detected_content_type", None)
+    if detected:
+        return detected
+    content.seek(0)
+    head = content.read(SNIFF_SIZE)
+    content.seek(0)
+    return sniff(head, content.name or "")
@@ -1,3 +1,6 @@
+import os
+import uuid
+
 from django.contrib.auth.models import User
 from django.db import models
 
@@ -10,14 +13,40 @@ class BaseModel(models.Model):
         abstract = True
 
 
+def blob_upload_to(instance, filename):
+    digest = instance.digest
+    extension = os.path.splitext(filename)[1].lower()[:16]
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+class Blob(BaseModel):
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    crc32 = models.PositiveBigIntegerField(null=True, blank=True)
+    file = models.FileField(upload_to=blob_upload_to, max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.digest
+
+
 class File(BaseModel):
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to="uploads/")
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    blob = models.ForeignKey(
+        Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="files"
+    )
+    size = models.BigIntegerField(null=True, blank=True)
+    checksum = models.CharField(max_length=64, blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [models.Index(fields=["owner", "created_at", "id"])]
+
 
 class Group(BaseModel):
     name = models.CharField(max_length=255)
@@ -27,6 +56,9 @@ class Group(BaseModel):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [models.Index(fields=["owner", "created_at", "id"])]
+
 
 class Permission(BaseModel):
     READ = "read"
@@ -60,3 +92,200 @@ class Sharing(BaseModel):
 
     def __str__(self):
         return f"{self.shared_file.name} shared with {self.shared_with.username} by {self.shared_by.username}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["shared_file", "shared_with"], name="unique_sharing"
+            ),
+        ]
+
+
+class FileAccess(BaseModel):
+    OWNER = "owner"
+    PERMISSION = "permission"
+    SHARING = "sharing"
+    SOURCE_CHOICES = [
+        (OWNER, "Owner"),
+        (PERMISSION, "Permission"),
+        (SHARING, "Sharing"),
+    ]
+    LEVEL_CHOICES = Permission.PERMISSION_CHOICES + [(OWNER, "Owner")]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="file_access")
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="access")
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+
+    def __str__(self):
+        return f"{self.file_id} - {self.user_id} - {self.level}"
+
+    class Meta:
+        # Derived from File.owner, Permission and Sharing by drive.access
+        constraints = [
+            models.UniqueConstraint(fields=["user", "file"], name="unique_file_access"),
+        ]
+        indexes = [models.Index(fields=["user", "source", "file"])]
+
+
+class UploadSession(BaseModel):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    file = models.OneToOneField(File, null=True, blank=True, on_delete=models.SET_NULL)
+
+    def __str__(self):
+        return f"{self.name} ({self.size} bytes)"
+
+    @property
+    def total_chunks(self):
+        return -(-self.size // self.chunk_size)
+
+
+class UploadChunk(BaseModel):
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name="chunks"
+    )
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    size = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.session_id} #{self.index}"
+
+    class Meta:
+        unique_together = (
+            "session",
+            "index",
+        )  # A chunk is stored once per session, re-sending overwrites it
+
+
+class Change(BaseModel):
+    FILE = "file"
+    GROUP = "group"
+    KIND_CHOICES = [
+        (FILE, "File"),
+        (GROUP, "Group"),
+    ]
+    UPDATED = "updated"
+    DELETED = "deleted"
+    ACTION_CHOICES = [
+        (UPDATED, "Updated"),
+        (DELETED, "Deleted"),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    # One row per user who can see the object, so a feed is a range scan
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="changes")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Not a foreign key, tombstones outlive the object
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # The PostgreSQL transaction that recorded it, 0 elsewhere; feeds are
+    # read in commit order through it
+    transaction_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} {self.kind} {self.object_id} {self.action}"
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "transaction_id", "id"])]
+
+
+class StorageUsage(BaseModel):
+    user = models.OneToOneField(
+        User, primary_key=True, on_delete=models.CASCADE, related_name="storage_usage"
+    )
+    # Sum of the sizes of the user's files, kept up to date by drive.quotas
+    used = models.BigIntegerField(default=0)
+    # None falls back to DRIVE_DEFAULT_QUOTA
+    quota = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.used}/{self.quota}"
+
+
+class PendingDeletion(BaseModel):
+    # A stored file nothing should reference anymore, removed by drive.gc
+    path = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.path
+
+
+class Job(BaseModel):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    class Meta:
+        # Workers claim the oldest due jobs of a status
+        indexes = [models.Index(fields=["status", "run_at"])]
+
+
+class LinkVersion(BaseModel):
+    FILE = "file"
+    USER = "user"
+    KIND_CHOICES = [
+        (FILE, "File"),
+        (USER, "User"),
+    ]
+    # Signed links embed the versions current when they were issued, bumping
+    # one revokes every link of the file, or issued by the user
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Not a foreign key, the version of a deleted file must stay bumped
+    object_id = models.BigIntegerField()
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} v{self.version}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id"], name="unique_link_version"
+            )
+        ]
+
+
+class SearchToken(BaseModel):
+    FILE = "file"
+    GROUP = "group"
+    KIND_CHOICES = [
+        (FILE, "File"),
+        (GROUP, "Group"),
+    ]
+    # The lowercased words of file and group names, maintained by drive.search
+    # where pg_trgm isn't available; prefix lookups are range scans on token
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Not a foreign key, one table indexes both kinds
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} {self.token}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["kind", "token", "object_id"]),
+            models.Index(fields=["kind", "object_id", "token"]),
+        ]
@@ -0,0 +1,10 @@
+from rest_framework import parsers
+
+from . import metrics
+
+
+class MultiPartParser(parsers.MultiPartParser):
+    # Receiving the body and writing the files through the upload handlers
+    @metrics.phase("upload")
+    def parse(self, stream, media_type=None, parser_context=None):
+        return super().parse(stream, media_type, parser_context)
@@ -1,32 +1,47 @@
 from rest_framework import permissions
 
+from . import acl, metrics
 from .models import Permission
 
 
+class CanReadMetrics(permissions.BasePermission):
+    # Staff users, or scrapers presenting DRIVE_METRICS_TOKEN
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_staff) or metrics.has_token(
+            request
+        )
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.owner == request.user
+        return obj.owner_id == request.user.pk
 
 
 class IsOwnerOrCheckPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if obj.owner == request.user:
+        access = acl.get_access(request, obj)
+        if access == acl.OWNER:
             return True
-        if (
-            request.method in permissions.SAFE_METHODS
-            and Permission.objects.filter(
-                file=obj,
-                user=request.user,
-                permission__in=[Permission.READ, Permission.CHANGE],
-            ).exists()
+        if request.method in permissions.SAFE_METHODS and access in (
+            Permission.READ,
+            Permission.CHANGE,
         ):
             return True
-        if (
-            request.method == "PUT"
-            and Permission.objects.filter(
-                file=obj, user=request.user, permission=Permission.CHANGE
-            ).exists()
-        ):
+        if request.method == "PUT" and access == Permission.CHANGE:
+            return True
+        return False
+
+
+class IsOwnerOrCanIssueLink(permissions.BasePermission):
+    # Anyone who can download a file may hand out links to it, only the owner
+    # revokes them all
+    def has_object_permission(self, request, view, obj):
+        access = acl.get_access(request, obj)
+        if access == acl.OWNER:
             return True
+        return request.method == "POST" and access in (
+            Permission.READ,
+            Permission.CHANGE,
+        )
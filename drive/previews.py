@@ -0,0 +1,150 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from . import mime, uploads
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+
+# Longest edge of the previews, in pixels
+SIZES = tuple(getattr(settings, "DRIVE_PREVIEW_SIZES", (128, 256, 512)))
+QUALITY = getattr(settings, "DRIVE_PREVIEW_QUALITY", 80)
+PREVIEW_DIR = "previews"
+PDFTOPPM = shutil.which("pdftoppm")
+PDF_TIMEOUT = 30
+
+IMAGE_TYPES = {
+    "image/bmp",
+    "image/gif",
+    "image/jpeg",
+    "image/png",
+    "image/tiff",
+    "image/webp",
+}
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def preview_path(digest, size):
+    return f"{PREVIEW_DIR}/{digest[:2]}/{digest}/{size}.jpg"
+
+
+def content_type(blob):
+    with blob.file.open("rb") as fp:
+        return mime.sniff(fp.read(mime.SNIFF_SIZE), blob.file.name)
+
+
+def can_preview(content_type):
+    if Image is None:
+        return False
+    return content_type in IMAGE_TYPES or (
+        content_type == "application/pdf" and PDFTOPPM is not None
+    )
+
+
+def open_image(blob, content_type, size):
+    if content_type == "application/pdf":
+        return render_pdf(blob, size)
+    with blob.file.open("rb") as fp:
+        image = Image.open(fp)
+        # Lets JPEG decode at a fraction of its resolution
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+        return image
+
+
+def render_pdf(blob, size):
+    """
+    Render the first page with poppler's pdftoppm, which only works on local
+    files, so remote storages get a temporary copy.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            source = blob.file.path
+        except NotImplementedError:
+            source = os.path.join(tmp, "source.pdf")
+            with blob.file.open("rb") as fp, open(source, "wb") as out:
+                shutil.copyfileobj(fp, out)
+        target = os.path.join(tmp, "page")
+        try:
+            subprocess.run(
+                [PDFTOPPM, "-png", "-singlefile", "-f", "1", "-l", "1"]
+                + ["-scale-to", str(size), source, target],
+                check=True,
+                capture_output=True,
+                timeout=PDF_TIMEOUT,
+            )
+        except (OSError, subprocess.SubprocessError) as exc:
+            raise PreviewUnavailable(f"Could not render the PDF: {exc}")
+        with Image.open(target + ".png") as image:
+            image.load()
+            return image
+
+
+def render(blob, size, content_type):
+    try:
+        image = open_image(blob, content_type, size)
+        image.thumbnail((size, size))
+        if image.mode != "RGB":
+            # JPEG has no alpha, flatten transparent images on white
+            background = Image.new("RGB", image.size, "white")
+            image = image.convert("RGBA")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise PreviewUnavailable(f"Could not render a preview: {exc}")
+    return output.getvalue()
+
+
+def get_or_create(blob, size, content_type):
+    """
+    Return the storage path of the preview of ``blob``, rendering it first
+    when it isn't stored yet.
+    """
+    if not can_preview(content_type):
+        raise PreviewUnavailable(f"No preview for {content_type}.")
+    storage = uploads.file_storage()
+    path = preview_path(blob.digest, size)
+    if not storage.exists(path):
+        saved = storage.save(path, ContentFile(render(blob, size, content_type)))
+        if saved != path:
+            # A concurrent render stored it first, under the name served
+            storage.delete(saved)
+    return path
+
+
+def generate(blob):
+    """
+    Blob processor rendering every preview size of new images and PDFs.
+    """
+    detected = content_type(blob)
+    if not can_preview(detected):
+        return
+    try:
+        for size in SIZES:
+            get_or_create(blob, size, detected)
+    except PreviewUnavailable:
+        # Retrying won't fix a broken file, requests will answer 404
+        pass
+
+
+def delete(digest):
+    storage = uploads.file_storage()
+    directory = os.path.dirname(preview_path(digest, 0))
+    if not storage.exists(directory):
+        return
+    for name in storage.listdir(directory)[1]:
+        storage.delete(f"{directory}/{name}")
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db.models import F, Sum
+
+from .models import File, StorageUsage
+
+# None means unlimited
+DEFAULT_QUOTA = getattr(settings, "DRIVE_DEFAULT_QUOTA", None)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def add(user_id, delta):
+    """
+    Adjust the usage counter of a user by ``delta`` bytes, with a single
+    update once the counter exists.
+    """
+    if not delta:
+        return
+    usage = StorageUsage.objects.filter(user_id=user_id)
+    # Without a counter there's nothing to decrement, the user may be going away
+    if not usage.update(used=F("used") + delta) and delta > 0:
+        StorageUsage.objects.bulk_create(
+            [StorageUsage(user_id=user_id)], ignore_conflicts=True
+        )
+        usage.update(used=F("used") + delta)
+
+
+def get_usage(user_id):
+    usage = StorageUsage.objects.filter(user_id=user_id).first()
+    if usage is None:
+        return 0, DEFAULT_QUOTA
+    return usage.used, DEFAULT_QUOTA if usage.quota is None else usage.quota
+
+
+def available(user_id):
+    """
+    Return the bytes the user may still store, None when there's no limit.
+    """
+    used, quota = get_usage(user_id)
+    return None if quota is None else max(quota - used, 0)
+
+
+def check(user_id, incoming):
+    """
+    Raise ``QuotaExceeded`` when storing ``incoming`` more bytes would take
+    the user over quota.
+    """
+    used, quota = get_usage(user_id)
+    if quota is not None and used + incoming > quota:
+        raise QuotaExceeded(
+            f"Storing {incoming} bytes would exceed the quota of {quota} bytes, "
+            f"{max(quota - used, 0)} bytes are available."
+        )
+
+
+def recompute(user_ids):
+    """
+    Reset the usage counters of the given users from their files.
+    """
+    totals = dict(
+        File.objects.filter(owner_id__in=user_ids)
+        .values("owner_id")
+        .annotate(total=Sum("size"))
+        .values_list("owner_id", "total")
+    )
+    StorageUsage.objects.bulk_create(
+        [
+            StorageUsage(user_id=user_id, used=totals.get(user_id) or 0)
+            for user_id in user_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["used", "updated_at"],
+    )
@@ -0,0 +1,175 @@
+import logging
+import math
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Aliases of DATABASES entries replicating "default"
+REPLICAS = list(getattr(settings, "DRIVE_READ_REPLICAS", []))
+# Replicas further behind than this many seconds are not read from
+MAX_LAG = getattr(settings, "DRIVE_REPLICA_MAX_LAG", 5)
+LAG_CHECK_INTERVAL = getattr(settings, "DRIVE_REPLICA_LAG_CHECK_INTERVAL", 2)
+# Cache remembering when users last wrote, it must be shared by all workers
+PIN_CACHE = getattr(settings, "DRIVE_REPLICA_PIN_CACHE", "default")
+
+# Zero on a server that isn't replicating, and when a streaming replica has
+# replayed everything it received. Otherwise, and while its WAL receiver is
+# disconnected, the age of the last replayed transaction: NULL until it has
+# replayed one. Seeing the receiver's status takes the pg_read_all_stats role,
+# without it replicas are always measured by that age.
+POSTGRESQL_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+        ) AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+current = ContextVar("drive_replica_routing", default=None)
+
+# alias -> (checked at, caught up to), both wall clock times
+replication = {}
+check_lock = threading.Lock()
+
+
+def pin_key(user_id):
+    return f"drive:replica:pin:{user_id}"
+
+
+def pin(user_id):
+    """
+    Remember that ``user_id`` just wrote, their reads stay on the primary
+    until a replica has replayed the write. Past ``MAX_LAG`` every replica
+    read from has.
+    """
+    caches[PIN_CACHE].set(pin_key(user_id), time.time(), math.ceil(MAX_LAG) + 1)
+
+
+def last_write(user_id):
+    return caches[PIN_CACHE].get(pin_key(user_id))
+
+
+def measure(alias):
+    """
+    Return the time up to which ``alias`` has replayed the writes of the
+    primary, or None when it can't be reached or hasn't replayed anything.
+    Only PostgreSQL reports its replay position, other replicas are taken to
+    be caught up.
+    """
+    connection = connections[alias]
+    checked_at = time.time()
+    if connection.vendor != "postgresql":
+        return checked_at
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable.", alias, exc_info=True)
+        return None
+    if lag is None:
+        return None
+    return checked_at - float(lag)
+
+
+def caught_up_to(alias):
+    """
+    Return the last measured replay time of ``alias``. One thread at a time
+    measures again when it is older than ``LAG_CHECK_INTERVAL``, the others
+    keep using the previous measure meanwhile.
+    """
+    checked_at, caught_up = replication.get(alias, (None, None))
+    now = time.time()
+    if checked_at is not None and now - checked_at < LAG_CHECK_INTERVAL:
+        return caught_up
+    if check_lock.acquire(blocking=False):
+        try:
+            caught_up = measure(alias)
+            replication[alias] = (now, caught_up)
+        finally:
+            check_lock.release()
+    return caught_up
+
+
+def choose_replica(written_at=None):
+    """
+    Return a replica at most ``MAX_LAG`` behind that has replayed the writes
+    made up to ``written_at``, or None when there is none.
+    """
+    now = time.time()
+    candidates = []
+    for alias in REPLICAS:
+        caught_up = caught_up_to(alias)
+        if caught_up is None or now - caught_up > MAX_LAG:
+            continue
+        if written_at is not None and caught_up <= written_at:
+            continue
+        candidates.append(alias)
+    return random.choice(candidates) if candidates else None
+
+
+class Routing:
+    """
+    Where the reads of the current request go. Until the user is known, and
+    once the request has written, they go to the primary; a request sticks
+    to the replica it first read from.
+    """
+
+    def __init__(self, read_only):
+        self.read_only = read_only
+        self.user_id = None
+        self.wrote = False
+        self.replica = None
+
+    def read_alias(self):
+        if not self.read_only or self.wrote or self.user_id is None:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if self.replica is None:
+            self.replica = choose_replica(last_write(self.user_id)) or DEFAULT_DB_ALIAS
+        return self.replica
+
+
+def authenticated(user_id):
+    routing = current.get()
+    if routing is not None:
+        routing.user_id = user_id
+
+
+class ReplicaRouter:
+    """
+    Send the reads of safe requests to the replicas routed by
+    ``ReplicaRoutingMiddleware``, everything else to the primary. Outside of
+    requests, in management commands and job workers, nothing is routed.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current.get()
+        if routing is None:
+            return None
+        return routing.read_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in REPLICAS:
+            return False
+        return None
@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+from rest_framework.settings import api_settings
+
+from . import metrics
+from .models import File, Group
+from .serializers import FileSerializer
+
+# False renders listings through the serializers
+ENABLED = getattr(settings, "DRIVE_FAST_SERIALIZATION", True)
+
+FILE_FIELDS = FileSerializer.Meta.fields
+# The keyset paginator reads these from every row
+PAGINATION_FIELDS = ("id", "created_at")
+
+
+def file_fields(fields=None):
+    return [name for name in FILE_FIELDS if not fields or name in fields]
+
+
+def file_url():
+    """
+    Return a function turning a stored name into what ``FileSerializer``
+    renders for it. For the file system storage the base URL is looked up
+    once; stored names went through ``get_valid_name()``, so joining them to
+    it is a concatenation.
+    """
+    if not api_settings.UPLOADED_FILES_USE_URL:
+        return lambda name: name
+    storage = File._meta.get_field("file").storage
+    # default_storage is lazy, its bound methods are the real storage's
+    url = getattr(storage.url, "__func__", None)
+    if url is not FileSystemStorage.url or storage.base_url is None:
+        return storage.url
+    base_url = storage.base_url
+    return lambda name: base_url + filepath_to_uri(name).lstrip("/")
+
+
+def file_values(queryset, fields=None):
+    """
+    Return ``queryset`` as ``values()`` rows of the columns ``render_files``
+    needs, and the paginator.
+    """
+    return queryset.values(*dict.fromkeys([*file_fields(fields), *PAGINATION_FIELDS]))
+
+
+@metrics.phase("serialization")
+def render_files(rows, fields=None):
+    """
+    Render ``values()`` rows like ``FileSerializer(rows, many=True,
+    fields=fields).data`` would render their files.
+    """
+    names = file_fields(fields)
+    url = file_url() if "file" in names else None
+    result = []
+    for row in rows:
+        item = {name: row[name] for name in names}
+        if url is not None:
+            item["file"] = url(item["file"]) if item["file"] else None
+        result.append(item)
+    return result
+
+
+def group_files(group_ids, summary=False):
+    """
+    Return the rendered files of each group, or only their ids with
+    ``summary``, read from the join table in one query.
+    """
+    through = Group.files.through.objects.filter(group_id__in=group_ids)
+    files = {group_id: [] for group_id in group_ids}
+    if summary:
+        for group_id, file_id in through.values_list("group_id", "file_id"):
+            files[group_id].append(file_id)
+        return files
+    columns = [f"file__{name}" for name in FILE_FIELDS]
+    rows = through.values_list("group_id", *columns)
+    url = file_url()
+    for group_id, *values in rows:
+        item = dict(zip(FILE_FIELDS, values))
+        item["file"] = url(item["file"]) if item["file"] else None
+        files[group_id].append(item)
+    return files
+
+
+def group_values(queryset):
+    return queryset.values("id", "name", "created_at")
+
+
+@metrics.phase("serialization")
+def render_groups(rows, fields=None, files_mode=None):
+    """
+    Render ``values()`` rows like ``GroupSerializer(rows, many=True,
+    fields=fields, context={"files": files_mode}).data`` would render their
+    groups.
+    """
+    rows = list(rows)
+    names = [name for name in ("id", "name") if not fields or name in fields]
+    files = None
+    if not fields or "files" in fields:
+        summary = files_mode == "summary"
+        files = group_files([row["id"] for row in rows], summary)
+    result = []
+    for row in rows:
+        item = {name: row[name] for name in names}
+        if files is not None:
+            if summary:
+                item["file_ids"] = files[row["id"]]
+                item["file_count"] = len(item["file_ids"])
+            else:
+                item["files"] = files[row["id"]]
+        result.append(item)
+    return result
+
+
+def access_values(queryset):
+    columns = [f"file__{name}" for name in FILE_FIELDS]
+    return queryset.values_list(*columns, "level", "source")
+
+
+@metrics.phase("serialization")
+def render_access(rows):
+    """
+    Render ``values_list()`` rows of ``access_values`` like
+    ``FileAccessSerializer`` would render the grants.
+    """
+    url = file_url()
+    count = len(FILE_FIELDS)
+    result = []
+    for row in rows:
+        item = dict(zip(FILE_FIELDS, row[:count]))
+        item["file"] = url(item["file"]) if item["file"] else None
+        result.append({"file": item, "level": row[count], "source": row[count + 1]})
+    return result
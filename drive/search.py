@@ -0,0 +1,204 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Exists, IntegerField, OuterRef, Value, When
+
+from .models import FileAccess, Group, SearchToken
+
+TRIGRAM = "trigram"
+TOKENS = "tokens"
+
+# "trigram" matches names with the pg_trgm indexes of migration 0015,
+# "tokens" through the SearchToken table; None picks trigram on PostgreSQL
+BACKEND = getattr(settings, "DRIVE_SEARCH_BACKEND", None)
+# Results of each kind returned by default and at most
+LIMIT = getattr(settings, "DRIVE_SEARCH_LIMIT", 50)
+MAX_LIMIT = getattr(settings, "DRIVE_SEARCH_MAX_LIMIT", 200)
+# Names returned by autocompletion
+SUGGESTIONS = getattr(settings, "DRIVE_SEARCH_SUGGESTIONS", 10)
+# Words matching fewer files than this pick the candidates of a search,
+# otherwise the files the user can see are checked one by one
+CANDIDATES = getattr(settings, "DRIVE_SEARCH_CANDIDATES", 1000)
+
+BATCH_SIZE = 1000
+TOKEN_LENGTH = SearchToken._meta.get_field("token").max_length
+# "Q3 report_final.pdf" has the words q3, report, final and pdf
+WORD_RE = re.compile(r"[^\W_]+")
+# Sorts after every token starting with the prefix it is appended to
+MAX_CHAR = "\U0010ffff"
+
+
+def backend():
+    if BACKEND:
+        return BACKEND
+    return TRIGRAM if connection.vendor == "postgresql" else TOKENS
+
+
+def words(text):
+    """
+    Return the distinct lowercased words of ``text``, cut to the token length.
+    """
+    return list(
+        dict.fromkeys(word[:TOKEN_LENGTH] for word in WORD_RE.findall(text.lower()))
+    )
+
+
+def add(kind, names):
+    """
+    Index new objects of ``kind``, ``names`` maps their ids to their names.
+    PostgreSQL maintains the trigram indexes itself, there is nothing to do
+    with that backend.
+    """
+    if backend() != TOKENS:
+        return
+    insert(
+        kind,
+        (
+            (object_id, token)
+            for object_id, name in names.items()
+            for token in words(name)
+        ),
+    )
+
+
+def insert(kind, rows):
+    SearchToken.objects.bulk_create(
+        [
+            SearchToken(kind=kind, object_id=object_id, token=token)
+            for object_id, token in rows
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def update(kind, object_id, name):
+    """
+    Bring the tokens of a saved object in line with its name. A save that
+    kept the words of the name costs one query.
+    """
+    if backend() != TOKENS:
+        return
+    tokens = SearchToken.objects.filter(kind=kind, object_id=object_id)
+    current = set(tokens.values_list("token", flat=True))
+    wanted = words(name)
+    stale = current.difference(wanted)
+    if stale:
+        tokens.filter(token__in=stale).delete()
+    insert(kind, ((object_id, token) for token in wanted if token not in current))
+
+
+def remove(kind, object_ids):
+    if backend() != TOKENS:
+        return
+    SearchToken.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def rebuild(kind, names):
+    remove(kind, list(names))
+    add(kind, names)
+
+
+def prefixed(kind, term):
+    return SearchToken.objects.filter(
+        kind=kind, token__gte=term, token__lt=term + MAX_CHAR
+    )
+
+
+def rarest(kind, terms):
+    """
+    Return the term matching the fewest tokens, or None when every term
+    matches at least ``CANDIDATES``. Each count stops there, it reads that
+    many index entries at most.
+    """
+    counts = {term: prefixed(kind, term)[:CANDIDATES].count() for term in terms}
+    term = min(terms, key=counts.get)
+    return term if counts[term] < CANDIDATES else None
+
+
+def match(queryset, kind, terms, name="name", pk="pk", driving=None):
+    """
+    Keep the rows of ``queryset`` whose ``name`` holds every term: as a
+    substring with the trigram backend, as the prefix of one of its words
+    with the tokens backend. With the latter the ``driving`` term picks the
+    candidates from the whole table, and the other terms are probed for each
+    candidate; without one, every row of ``queryset`` is probed.
+    """
+    if backend() == TRIGRAM:
+        for term in terms:
+            # UPPER(name::text) LIKE UPPER('%term%'), what the indexes cover
+            queryset = queryset.filter(**{f"{name}__icontains": term})
+        return queryset
+    for term in terms:
+        tokens = prefixed(kind, term)
+        if term == driving:
+            queryset = queryset.filter(**{f"{pk}__in": tokens.values("object_id")})
+        else:
+            queryset = queryset.filter(Exists(tokens.filter(object_id=OuterRef(pk))))
+    return queryset
+
+
+def match_files(queryset, terms):
+    # A rare word is found fastest from its tokens, a common one from the
+    # files the user can see
+    driving = rarest(SearchToken.FILE, terms) if backend() == TOKENS else None
+    return match(
+        queryset, SearchToken.FILE, terms, "file__name", "file_id", driving=driving
+    )
+
+
+def rank(query, name="name"):
+    # Names starting with the query first
+    return Case(
+        When(**{f"{name}__istartswith": query}, then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+
+
+def files(user, query):
+    """
+    Return the access rows of the files ``user`` owns or was granted whose
+    name matches ``query``, best matches first.
+    """
+    query = query.strip()
+    grants = match_files(FileAccess.objects.filter(user=user), words(query))
+    return grants.annotate(rank=rank(query, "file__name")).order_by(
+        "rank", "file__name", "file_id"
+    )
+
+
+def groups(user, query):
+    """
+    Return the groups of ``user`` whose name matches ``query``, best matches
+    first.
+    """
+    query = query.strip()
+    found = match(Group.objects.filter(owner=user), SearchToken.GROUP, words(query))
+    return found.annotate(rank=rank(query)).order_by("rank", "name", "pk")
+
+
+def suggest(user, query, limit=SUGGESTIONS):
+    """
+    Return up to ``limit`` distinct names of the files and groups ``user``
+    can see starting with ``query``, to complete what they are typing.
+    """
+    query = query.strip()
+    terms = words(query)
+    file_names = match_files(
+        FileAccess.objects.filter(user=user, file__name__istartswith=query), terms
+    )
+    group_names = match(
+        Group.objects.filter(owner=user, name__istartswith=query),
+        SearchToken.GROUP,
+        terms,
+    )
+    names = set(
+        file_names.order_by("file__name")
+        .values_list("file__name", flat=True)
+        .distinct()[:limit]
+    )
+    names.update(
+        group_names.order_by("name").values_list("name", flat=True).distinct()[:limit]
+    )
+    return sorted(names, key=lambda name: (name.lower(), name))[:limit]
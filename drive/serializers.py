@@ -1,25 +1,148 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-from .models import File, Group, Sharing
+from . import blobs, delta, grants, links, metrics, mime, uploads
+from .models import File, FileAccess, Group, Permission, Sharing, UploadSession
 
 
-class FileSerializer(serializers.ModelSerializer):
+class TimedRepresentationMixin:
+    """
+    Count the time spent turning instances into primitives as the
+    "serialization" phase of the request.
+    """
+
+    @metrics.phase("serialization")
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class FieldsProjectionMixin:
+    """
+    Let callers pass ``fields=[...]`` to render only a subset of the fields.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class FileSerializer(
+    TimedRepresentationMixin, FieldsProjectionMixin, serializers.ModelSerializer
+):
+    def create(self, validated_data):
+        content = validated_data.pop("file")
+        file_obj = File(**validated_data)
+        content_type = mime.detect(content)
+        blobs.attach(file_obj, blobs.store(content), content_type)
+        file_obj.save()
+        return file_obj
+
+    def update(self, instance, validated_data):
+        content = validated_data.pop("file", None)
+        if content is not None:
+            content_type = mime.detect(content)
+            blobs.attach(instance, blobs.store(content), content_type)
+        return super().update(instance, validated_data)
+
     class Meta:
         model = File
-        fields = ("id", "name", "file")
-        read_only_fields = ("id",)
+        fields = ("id", "name", "file", "size", "checksum", "content_type")
+        read_only_fields = ("id", "size", "checksum", "content_type")
+
+
+class FileDigestSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    digest = serializers.RegexField(r"^[0-9a-f]{64}$")
+    size = serializers.IntegerField(min_value=0)
+
+
+class FileDeltaSerializer(serializers.Serializer):
+    base = serializers.RegexField(r"^[0-9a-f]{64}$")
+    block_size = serializers.IntegerField(
+        min_value=delta.MIN_BLOCK_SIZE, max_value=delta.MAX_BLOCK_SIZE
+    )
+    # Parsed from a string when sent as a multipart field
+    manifest = serializers.JSONField(binary=True)
+    digest = serializers.RegexField(r"^[0-9a-f]{64}$", required=False)
+
 
+class FileLinkSerializer(serializers.Serializer):
+    # Seconds until the link expires
+    expires_in = serializers.IntegerField(
+        min_value=1, max_value=links.MAX_TTL, default=links.TTL
+    )
+
+
+class FileAccessSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    file = FileSerializer(read_only=True)
+
+    class Meta:
+        model = FileAccess
+        fields = ("file", "level", "source")
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    Look up all the submitted primary keys in one query instead of one each.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+        pks = []
+        for item in data:
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.child_relation.fail(
+                    "incorrect_type", data_type=type(item).__name__
+                )
+        objects = self.child_relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                self.child_relation.fail("does_not_exist", pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class GroupSerializer(
+    TimedRepresentationMixin, FieldsProjectionMixin, serializers.ModelSerializer
+):
+    files = BulkPrimaryKeyRelatedField(
+        queryset=File.objects.all(), many=True, write_only=True
+    )
 
-class GroupSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data["files"] = FileSerializer(instance.files.all(), many=True).data
+        if "files" in self.fields:
+            # Rendered from the prefetch cache when the view prefetched files
+            files = instance.files.all()
+            if self.context.get("files") == "summary":
+                data["file_ids"] = [file.pk for file in files]
+                data["file_count"] = len(data["file_ids"])
+            else:
+                data["files"] = FileSerializer(files, many=True).data
         return data
 
     def create(self, validated_data):
         validated_data["files"] = filter(
-            lambda file: file.owner == self.context["request"].user,
+            lambda file: file.owner_id == self.context["request"].user.pk,
             validated_data.get("files"),
         )
         return super().create(validated_data)
@@ -28,12 +151,9 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         fields = ("id", "name", "files")
         read_only_fields = ("id",)
-        extra_kwargs = {
-            "files": {"write_only": True},
-        }
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     email = serializers.EmailField(write_only=True)
     password1 = serializers.CharField(write_only=True)
     password2 = serializers.CharField(write_only=True)
@@ -56,7 +176,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "email", "password1", "password2"]
 
 
-class SharingSerializer(serializers.ModelSerializer):
+class SharingSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     shared_with = UserSerializer(read_only=True)
     shared_by = UserSerializer(read_only=True)
     shared_file = FileSerializer(read_only=True)
@@ -68,3 +188,48 @@ class SharingSerializer(serializers.ModelSerializer):
 
 class SharingUserSerializer(serializers.Serializer):
     user_ids = serializers.ListField(child=serializers.IntegerField())
+
+
+class PermissionBulkSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(
+        choices=[grants.GRANT, grants.REVOKE], default=grants.GRANT
+    )
+    permission = serializers.ChoiceField(
+        choices=Permission.PERMISSION_CHOICES, required=False
+    )
+    files = serializers.ListField(child=serializers.IntegerField(), default=list)
+    groups = serializers.ListField(child=serializers.IntegerField(), default=list)
+    users = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_users(self, value):
+        value = list(dict.fromkeys(value))
+        found = set(User.objects.filter(pk__in=value).values_list("pk", flat=True))
+        missing = [user_id for user_id in value if user_id not in found]
+        if missing:
+            raise serializers.ValidationError(f"Unknown users: {missing}")
+        return value
+
+    def validate(self, attrs):
+        if not attrs["files"] and not attrs["groups"]:
+            raise serializers.ValidationError("Select files or groups.")
+        if attrs["action"] == grants.GRANT and "permission" not in attrs:
+            raise serializers.ValidationError(
+                {"permission": "This field is required to grant access."}
+            )
+        return attrs
+
+
+class UploadSessionSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(
+        min_value=1, max_value=uploads.MAX_CHUNK_SIZE, required=False
+    )
+    size = serializers.IntegerField(min_value=0)
+    received = serializers.SerializerMethodField()
+
+    def get_received(self, obj):
+        return uploads.received_ranges(obj)
+
+    class Meta:
+        model = UploadSession
+        fields = ("id", "name", "size", "chunk_size", "received", "file")
+        read_only_fields = ("id", "file")
@@ -0,0 +1,190 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import (
+    access,
+    acl,
+    authentication,
+    blobs,
+    changes,
+    gc,
+    links,
+    quotas,
+    search,
+    tasks,
+)
+from .models import (
+    Blob,
+    Change,
+    File,
+    FileAccess,
+    Group,
+    Permission,
+    SearchToken,
+    Sharing,
+)
+
+
+@receiver(post_save, sender=Blob)
+def process_new_blob(sender, instance, created, **kwargs):
+    if created:
+        tasks.enqueue_blob_processing(instance)
+
+
+@receiver(post_save, sender=File)
+def sync_owner_access(sender, instance, created, **kwargs):
+    access.sync_owner(instance, created)
+
+
+@receiver(post_save, sender=File)
+def revoke_replaced_links(sender, instance, created, **kwargs):
+    # Links carry the stored name, they must not serve replaced content.
+    # Registered before the handlers that consume the _previous_* markers
+    if not created and "_previous_file_name" in instance.__dict__:
+        if instance.__dict__["_previous_file_name"] != instance.file.name:
+            links.revoke_file(instance.pk)
+
+
+@receiver(post_save, sender=File)
+def retain_file_blob(sender, instance, created, **kwargs):
+    if created:
+        previous_blob_id = None
+    elif "_previous_blob_id" in instance.__dict__:
+        previous_blob_id = instance.__dict__.pop("_previous_blob_id")
+        previous_file_name = instance.__dict__.pop("_previous_file_name", None)
+        if previous_blob_id is None and previous_file_name != instance.file.name:
+            # Stored outside the blob store, nothing else points to it
+            gc.schedule([previous_file_name])
+    else:
+        return
+    if previous_blob_id == instance.blob_id:
+        return
+    if instance.blob_id is not None:
+        blobs.retain(instance.blob_id)
+    if previous_blob_id is not None:
+        blobs.release(previous_blob_id)
+
+
+@receiver(post_save, sender=File)
+def count_storage_usage(sender, instance, created, **kwargs):
+    if created:
+        quotas.add(instance.owner_id, instance.size or 0)
+    elif "_previous_size" in instance.__dict__:
+        previous_size = instance.__dict__.pop("_previous_size")
+        quotas.add(instance.owner_id, (instance.size or 0) - (previous_size or 0))
+
+
+@receiver(post_save, sender=File)
+def record_file_change(sender, instance, created, **kwargs):
+    # New files reach the change log through their owner access row
+    if not created:
+        user_ids = FileAccess.objects.filter(file=instance).values_list(
+            "user_id", flat=True
+        )
+        changes.record_file(instance.pk, user_ids)
+
+
+@receiver(post_save, sender=File)
+def index_file_name(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        search.add(SearchToken.FILE, {instance.pk: instance.name})
+    elif update_fields is None or "name" in update_fields:
+        search.update(SearchToken.FILE, instance.pk, instance.name)
+
+
+@receiver(pre_delete, sender=File)
+def collect_file_audience(sender, instance, **kwargs):
+    # The access rows are gone by the time post_delete is sent
+    instance._change_user_ids = list(
+        FileAccess.objects.filter(file=instance).values_list("user_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=File)
+def release_file_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
+    else:
+        gc.schedule([instance.file.name])
+    quotas.add(instance.owner_id, -(instance.size or 0))
+    acl.invalidate_file(instance.pk)
+    links.revoke_file(instance.pk)
+    changes.record_file(
+        instance.pk, getattr(instance, "_change_user_ids", ()), Change.DELETED
+    )
+    search.remove(SearchToken.FILE, [instance.pk])
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def sync_permission_access(sender, instance, **kwargs):
+    access.sync([(instance.file_id, instance.user_id)])
+
+
+@receiver(post_save, sender=Sharing)
+@receiver(post_delete, sender=Sharing)
+def sync_sharing_access(sender, instance, **kwargs):
+    access.sync([(instance.shared_file_id, instance.shared_with_id)])
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    authentication.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    # A deactivated user or a changed password must not stay authenticated;
+    # deleted users take their tokens along, which invalidates them above
+    if not created:
+        authentication.invalidate_user(instance.pk)
+        if not instance.is_active:
+            links.revoke_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_user_links(sender, instance, **kwargs):
+    links.revoke_user(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def record_group_change(sender, instance, **kwargs):
+    changes.record([(instance.owner_id, Change.GROUP, instance.pk, Change.UPDATED)])
+
+
+@receiver(post_delete, sender=Group)
+def record_group_deletion(sender, instance, **kwargs):
+    changes.record([(instance.owner_id, Change.GROUP, instance.pk, Change.DELETED)])
+
+
+@receiver(post_save, sender=Group)
+def index_group_name(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        search.add(SearchToken.GROUP, {instance.pk: instance.name})
+    elif update_fields is None or "name" in update_fields:
+        search.update(SearchToken.GROUP, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Group)
+def unindex_group_name(sender, instance, **kwargs):
+    search.remove(SearchToken.GROUP, [instance.pk])
+
+
+@receiver(m2m_changed, sender=Group.files.through)
+def record_group_files_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # Changed from the file side, instance is a File
+        group_ids = Group.objects.filter(pk__in=pk_set or ()).values_list(
+            "pk", "owner_id"
+        )
+        changes.record(
+            (owner_id, Change.GROUP, group_id, Change.UPDATED)
+            for group_id, owner_id in group_ids
+        )
+    else:
+        record_group_change(sender, instance)
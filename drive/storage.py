@@ -0,0 +1,202 @@
+import gzip
+import io
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.storage import FileSystemStorage
+
+from . import metrics, mime
+
+# None stores everything as uploaded
+COMPRESSION_LEVEL = getattr(settings, "DRIVE_COMPRESSION_LEVEL", 6)
+COMPRESSION_MIN_SIZE = getattr(settings, "DRIVE_COMPRESSION_MIN_SIZE", 1024)
+# Content that doesn't shrink below this fraction is stored as uploaded
+COMPRESSION_MAX_RATIO = getattr(settings, "DRIVE_COMPRESSION_MAX_RATIO", 0.9)
+
+# get_valid_name() strips "~", so no uploaded name can end like this
+GZIP_SUFFIX = "~gz"
+# The gzip trailer records the size modulo 2**32, larger files are left alone
+GZIP_MAX_SIZE = 2**32
+
+INCOMPRESSIBLE_PREFIXES = ("image/", "audio/", "video/", "font/")
+COMPRESSIBLE_IMAGES = {"image/svg+xml", "image/bmp", "image/x-ms-bmp"}
+INCOMPRESSIBLE_TYPES = {
+    "application/gzip",
+    "application/java-archive",
+    "application/pdf",
+    "application/vnd.rar",
+    "application/x-7z-compressed",
+    "application/x-bzip2",
+    "application/x-rar-compressed",
+    "application/x-xz",
+    "application/zip",
+    "application/zstd",
+}
+# Office documents and friends are zip containers
+INCOMPRESSIBLE_TYPE_PREFIXES = (
+    "application/vnd.openxmlformats-",
+    "application/vnd.oasis.opendocument.",
+)
+
+
+def is_compressible(content_type):
+    if content_type in COMPRESSIBLE_IMAGES:
+        return True
+    return not (
+        content_type.startswith(INCOMPRESSIBLE_PREFIXES)
+        or content_type.startswith(INCOMPRESSIBLE_TYPE_PREFIXES)
+        or content_type.endswith("+zip")
+        or content_type in INCOMPRESSIBLE_TYPES
+    )
+
+
+class CompressedFile(DjangoFile):
+    """
+    A compressed copy waiting in a temporary file on the storage volume, so
+    ``FileSystemStorage`` renames it into place.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class GzipReader:
+    """
+    Read the decompressed bytes of a stored gzip file of known size. Seeks
+    only take effect on the next read, so probing the end for the size, as
+    ``FileResponse`` does, decompresses nothing. There is deliberately no
+    ``fileno()``, servers must not ``sendfile`` the compressed bytes.
+    """
+
+    def __init__(self, fp, size):
+        self.fp = fp
+        self.gzip = gzip.GzipFile(fileobj=fp, mode="rb")
+        self.size = size
+        self.position = 0
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.position >= self.size:
+            return b""
+        if self.gzip.tell() != self.position:
+            # Forward seeks decompress what they skip, backward ones rewind
+            self.gzip.seek(self.position)
+        data = self.gzip.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}
+        self.position = max(0, base[whence] + offset)
+        return self.position
+
+    def close(self):
+        self.gzip.close()
+        self.fp.close()
+
+
+class CompressedFileSystemStorage(FileSystemStorage):
+    """
+    Store compressible content gzipped under ``<name>~gz``. Reads go through
+    ``open()`` and ``size()`` and see the original bytes; ``open_encoded()``
+    hands out the stored bytes for clients that accept ``Content-Encoding``.
+    Files saved before compression was enabled are read as they are.
+    """
+
+    def content_encoding(self, name):
+        return "gzip" if name.endswith(GZIP_SUFFIX) else None
+
+    def original_name(self, name):
+        return name.removesuffix(GZIP_SUFFIX)
+
+    def should_compress(self, name, content):
+        if COMPRESSION_LEVEL is None:
+            return False
+        size = content.size
+        if size is None or not COMPRESSION_MIN_SIZE <= size < GZIP_MAX_SIZE:
+            return False
+        return is_compressible(mime.detect(content))
+
+    @metrics.phase("storage")
+    def _save(self, name, content):
+        if not self.should_compress(name, content):
+            return super()._save(name, content)
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                with gzip.GzipFile(
+                    filename="",
+                    mode="wb",
+                    fileobj=fp,
+                    compresslevel=COMPRESSION_LEVEL,
+                    mtime=0,
+                ) as compressor:
+                    content.seek(0)
+                    for chunk in content.chunks():
+                        compressor.write(chunk)
+                compressed_size = fp.tell()
+            if compressed_size > content.size * COMPRESSION_MAX_RATIO:
+                os.remove(temp_path)
+                content.seek(0)
+                return super()._save(name, content)
+            with CompressedFile(open(temp_path, "rb")) as compressed:
+                return super()._save(
+                    self.get_available_name(name + GZIP_SUFFIX), compressed
+                )
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @metrics.phase("storage")
+    def _open(self, name, mode="rb"):
+        if self.content_encoding(name) is None:
+            return super()._open(name, mode)
+        if "r" not in mode or "+" in mode:
+            raise ValueError("Compressed files can only be opened for reading.")
+        fp = open(self.path(name), "rb")
+        return DjangoFile(GzipReader(fp, self.size(name)), name)
+
+    @metrics.phase("storage")
+    def open_encoded(self, name):
+        """
+        Open the bytes as they are stored, compressed when ``content_encoding``
+        says so.
+        """
+        return super()._open(name, "rb")
+
+    @metrics.phase("storage")
+    def size(self, name):
+        if self.content_encoding(name) is None:
+            return super().size(name)
+        with open(self.path(name), "rb") as fp:
+            fp.seek(-4, os.SEEK_END)
+            return struct.unpack("<L", fp.read(4))[0]
+
+    @metrics.phase("storage")
+    def stored_size(self, name):
+        return super().size(name)
+
+    @metrics.phase("storage")
+    def exists(self, name):
+        return super().exists(name)
+
+    @metrics.phase("storage")
+    def delete(self, name):
+        return super().delete(name)
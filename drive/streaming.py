@@ -0,0 +1,297 @@
+import io
+import mimetypes
+import os
+import re
+from functools import partial
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import (
+    content_disposition_header,
+    http_date,
+    parse_http_date_safe,
+    quote_etag,
+)
+
+from . import zipstream
+
+BLOCK_SIZE = getattr(settings, "DRIVE_DOWNLOAD_BLOCK_SIZE", 64 * 1024)
+# None streams from Python, "nginx" uses X-Accel-Redirect, "xsendfile" uses X-Sendfile
+SENDFILE_BACKEND = getattr(settings, "DRIVE_SENDFILE_BACKEND", None)
+SENDFILE_URL_PREFIX = getattr(settings, "DRIVE_SENDFILE_URL_PREFIX", "/protected/")
+
+# One year, the longest lifetime caches are expected to honour
+PREVIEW_MAX_AGE = 365 * 24 * 60 * 60
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+ACCEPT_REFUSED_RE = re.compile(r"\bq=0(\.0*)?\s*$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class DownloadResponse(FileResponse):
+    block_size = BLOCK_SIZE
+
+
+class FileRange:
+    """
+    Expose ``length`` bytes of ``fp`` starting at ``start`` as a file of its
+    own. ``fileno()`` is kept so WSGI servers can still use ``sendfile``.
+    """
+
+    def __init__(self, fp, start, length):
+        self.fp = fp
+        self.start = start
+        self.length = length
+        self.position = 0
+        fp.seek(start)
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.fp.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.length}
+        self.position = max(0, min(base[whence] + offset, self.length))
+        self.fp.seek(self.start + self.position)
+        return self.position
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def close(self):
+        self.fp.close()
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive ``(start, end)`` of a single byte range, or None when
+    the header should be ignored (malformed or multiple ranges).
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+def if_range_passes(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        # Only a strong ETag match allows a partial response
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def file_etag(file_obj, encoding=None):
+    if file_obj.blob_id is not None:
+        tag = file_obj.blob.digest
+    else:
+        tag = f"{file_obj.pk}-{int(file_obj.updated_at.timestamp())}"
+    if encoding is not None:
+        # Each representation needs its own strong validator
+        tag += f"-{encoding}"
+    return quote_etag(tag)
+
+
+def stored_encoding(storage, name):
+    content_encoding = getattr(storage, "content_encoding", None)
+    return content_encoding(name) if content_encoding is not None else None
+
+
+def accepts_encoding(request, encoding):
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        token, _, params = item.partition(";")
+        if token.strip().lower() == encoding:
+            return not ACCEPT_REFUSED_RE.search(params)
+    return False
+
+
+def download_name(file_obj):
+    name = file_obj.name
+    if not os.path.splitext(name)[1]:
+        stored_name = file_obj.file.name
+        original_name = getattr(file_obj.file.storage, "original_name", None)
+        if original_name is not None:
+            stored_name = original_name(stored_name)
+        name += os.path.splitext(stored_name)[1]
+    return name
+
+
+def sendfile_response(storage, name):
+    response = HttpResponse()
+    if SENDFILE_BACKEND == "nginx":
+        response["X-Accel-Redirect"] = SENDFILE_URL_PREFIX + quote(name)
+    else:
+        response["X-Sendfile"] = storage.path(name)
+    return response
+
+
+def serve_file(request, file_obj, as_attachment=True):
+    field = file_obj.file
+    if not field:
+        raise Http404("File has no content.")
+    encoding = stored_encoding(field.storage, field.name)
+    # Ranges address the original bytes, so those requests are decoded
+    send_encoded = (
+        encoding is not None
+        and "HTTP_RANGE" not in request.META
+        and accepts_encoding(request, encoding)
+    )
+    etag = file_etag(file_obj, encoding if send_encoded else None)
+    last_modified = int(file_obj.updated_at.timestamp())
+    response = get_conditional_response(request, etag, last_modified)
+    if response is not None:
+        if encoding is not None:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    filename = download_name(file_obj)
+    content_type = file_obj.content_type or (
+        mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    )
+    if SENDFILE_BACKEND and (encoding is None or send_encoded):
+        # The proxy reads the bytes and answers Range requests itself
+        response = sendfile_response(field.storage, field.name)
+        response["Content-Type"] = content_type
+        response["Content-Disposition"] = content_disposition_header(
+            as_attachment, filename
+        )
+    elif send_encoded:
+        response = DownloadResponse(
+            field.storage.open_encoded(field.name),
+            as_attachment=as_attachment,
+            filename=filename,
+            content_type=content_type,
+        )
+    else:
+        size = field.size
+        byte_range = None
+        if "HTTP_RANGE" in request.META and if_range_passes(
+            request, etag, last_modified
+        ):
+            try:
+                byte_range = parse_range(request.META["HTTP_RANGE"], size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+        fp = field.storage.open(field.name, "rb")
+        if byte_range is None:
+            response = DownloadResponse(
+                fp,
+                as_attachment=as_attachment,
+                filename=filename,
+                content_type=content_type,
+            )
+        else:
+            start, end = byte_range
+            response = DownloadResponse(
+                FileRange(fp, start, end - start + 1),
+                status=206,
+                as_attachment=as_attachment,
+                filename=filename,
+                content_type=content_type,
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Accept-Ranges"] = "bytes"
+    if send_encoded:
+        response["Content-Encoding"] = encoding
+    if encoding is not None:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def serve_preview(request, storage, path, digest, size):
+    """
+    Serve a stored preview. Previews are keyed by content, so a URL with
+    ``?v=<checksum>`` of the content it was built for can be cached for good.
+    """
+    etag = quote_etag(f"{digest}-{size}")
+    response = get_conditional_response(request, etag)
+    if response is None:
+        if SENDFILE_BACKEND:
+            response = sendfile_response(storage, path)
+            response["Content-Type"] = "image/jpeg"
+        else:
+            response = DownloadResponse(
+                storage.open(path, "rb"), content_type="image/jpeg"
+            )
+    response["ETag"] = etag
+    if request.query_params.get("v") == digest:
+        response["Cache-Control"] = f"private, max-age={PREVIEW_MAX_AGE}, immutable"
+    else:
+        response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def read_chunks(field):
+    fp = field.storage.open(field.name, "rb")
+    try:
+        while chunk := fp.read(BLOCK_SIZE):
+            yield chunk
+    finally:
+        fp.close()
+
+
+def archive_names(files):
+    seen = set()
+    for file_obj in files:
+        # Names never contain path separators, so nothing extracts outside
+        name = download_name(file_obj).replace("/", "_").replace("\\", "_")
+        stem, extension = os.path.splitext(name)
+        candidate = name
+        counter = 1
+        while candidate in seen:
+            candidate = f"{stem} ({counter}){extension}"
+            counter += 1
+        seen.add(candidate)
+        yield candidate
+
+
+def serve_archive(files, filename, compression=zipstream.STORED):
+    """
+    Stream a ZIP of ``files``. Stored members reuse the CRC-32 recorded in
+    the blob store, so their headers are written before their bytes.
+    """
+    files = [file_obj for file_obj in files if file_obj.file]
+    members = [
+        zipstream.ZipMember(
+            name,
+            partial(read_chunks, file_obj.file),
+            size=file_obj.blob.size if file_obj.blob_id else None,
+            crc32=file_obj.blob.crc32 if file_obj.blob_id else None,
+            modified=file_obj.updated_at.timestamp(),
+        )
+        for name, file_obj in zip(archive_names(files), files)
+    ]
+    response = StreamingHttpResponse(
+        zipstream.ZipStream(compression).stream(members),
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
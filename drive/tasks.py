@@ -0,0 +1,38 @@
+from functools import cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import jobs
+from .models import Blob
+
+PROCESS_BLOB = "process_blob"
+
+
+@cache
+def blob_processors():
+    return {
+        path: import_string(path)
+        for path in getattr(settings, "DRIVE_BLOB_PROCESSORS", [])
+    }
+
+
+def enqueue_blob_processing(blob):
+    """
+    Queue one job per processor for new content. Content is stored once
+    per digest, so every processor sees each content once.
+    """
+    if blob_processors():
+        jobs.enqueue_many(
+            PROCESS_BLOB,
+            [{"blob_id": blob.pk, "processor": path} for path in blob_processors()],
+        )
+
+
+@jobs.register(PROCESS_BLOB)
+def process_blob(blob_id, processor):
+    blob = Blob.objects.filter(pk=blob_id).first()
+    if blob is None:
+        # Collected before its turn came
+        return
+    blob_processors()[processor](blob)
@@ -1,14 +1,92 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core import signing
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from .models import File
+from . import (
+    acl,
+    authentication,
+    batch,
+    benchmark,
+    blobs,
+    changes,
+    checks,
+    delta,
+    gc,
+    jobs,
+    links,
+    metrics,
+    previews,
+    renderers,
+    routers,
+    rows,
+    search,
+    storage,
+    tasks,
+    uploadhandlers,
+    uploads,
+)
+from .cache import LRUCache
+from .models import (
+    Blob,
+    Change,
+    File,
+    FileAccess,
+    Group,
+    Job,
+    LinkVersion,
+    PendingDeletion,
+    Permission,
+    SearchToken,
+    Sharing,
+    StorageUsage,
+    UploadSession,
+)
+from .urls import urlpatterns
+
+
+class TemporaryMediaMixin:
+    """
+    Store the files the tests write in a temporary MEDIA_ROOT, removed once
+    the test case has run, rather than in the working directory.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        cls.addClassCleanup(media.disable)
+        super().setUpClass()
 
 
-class FileUploadAPITest(TestCase):
+class FileUploadAPITest(TemporaryMediaMixin, TestCase):
     def setUp(self):
         self.client = APIClient()
         self.user = User.objects.create_user(
@@ -74,6 +152,114 @@ class FileShareAPITest(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_file_share_is_idempotent(self):
+        url = reverse("file-share", kwargs={"file_id": self.file.id})
+        data = {"user_ids": [self.user2.id]}
+        self.client.post(url, data, format="json")
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Sharing.objects.filter(shared_file=self.file).count(), 1)
+
+
+class PermissionBulkAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="owner")
+        self.team = [User.objects.create_user(username=f"member{i}") for i in range(3)]
+        self.files = [
+            File.objects.create(name=f"file{i}", owner=self.user) for i in range(2)
+        ]
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("permission-bulk")
+        acl.clear()
+
+    def post(self, **data):
+        return self.client.post(self.url, data, format="json")
+
+    def statuses(self, response):
+        return {(r["file"], r["user"]): r["status"] for r in response.data["results"]}
+
+    def test_grant_is_idempotent(self):
+        users = [user.id for user in self.team]
+        files = [file_obj.id for file_obj in self.files]
+        response = self.post(files=files, users=users, permission="read")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(self.statuses(response).values()), {"created"})
+        self.assertEqual(Permission.objects.count(), 6)
+
+        response = self.post(files=files[:1], users=users[:2], permission="change")
+        self.assertEqual(set(self.statuses(response).values()), {"updated"})
+        response = self.post(files=files, users=users, permission="read")
+        self.assertEqual(list(self.statuses(response).values()).count("updated"), 2)
+        self.assertEqual(list(self.statuses(response).values()).count("unchanged"), 4)
+        self.assertEqual(
+            FileAccess.objects.filter(user__in=self.team, level="read").count(), 6
+        )
+
+    def test_group_and_revoke(self):
+        group = Group.objects.create(name="Team", owner=self.user)
+        group.files.set(self.files)
+        member = self.team[0]
+        response = self.post(groups=[group.id], users=[member.id], permission="change")
+        self.assertEqual(len(response.data["results"]), 2)
+        url = reverse("file-delete", kwargs={"file_id": self.files[0].id})
+        self.client.force_authenticate(user=member)
+        self.assertEqual(self.client.put(url, {"name": "renamed"}).status_code, 200)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.post(
+            action="revoke", files=[self.files[0].id], users=[member.id, self.user.id]
+        )
+        self.assertEqual(
+            self.statuses(response),
+            {
+                (self.files[0].id, member.id): "revoked",
+                (self.files[0].id, self.user.id): "owner",
+            },
+        )
+        self.assertFalse(
+            FileAccess.objects.filter(file=self.files[0], user=member).exists()
+        )
+        self.client.force_authenticate(user=member)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_revoke_reports_remaining_shares(self):
+        member = self.team[0]
+        file_obj = self.files[0]
+        self.post(files=[file_obj.id], users=[member.id], permission="change")
+        Sharing.objects.create(
+            shared_file=file_obj, shared_with=member, shared_by=self.user
+        )
+
+        response = self.post(action="revoke", files=[file_obj.id], users=[member.id])
+        self.assertEqual(self.statuses(response), {(file_obj.id, member.id): "shared"})
+        self.assertFalse(Permission.objects.filter(file=file_obj).exists())
+        self.assertEqual(acl.fetch_access(file_obj.id, member.id), "read")
+
+    def test_partial_failures(self):
+        other = File.objects.create(name="theirs", owner=self.team[0])
+        response = self.post(
+            files=[self.files[0].id, other.id, 999],
+            users=[self.team[1].id],
+            permission="read",
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            list(self.statuses(response).values()),
+            ["created", "forbidden", "not_found"],
+        )
+        self.assertFalse(Permission.objects.filter(file=other).exists())
+
+    def test_invalid_requests(self):
+        user_id = self.team[0].id
+        for data in (
+            {"files": [self.files[0].id], "users": [user_id]},
+            {"users": [user_id], "permission": "read"},
+            {"files": [self.files[0].id], "users": [999], "permission": "read"},
+        ):
+            response = self.post(**data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class AuthenticatedAPITest(TestCase):
     def setUp(self):
@@ -97,3 +283,2051 @@ class AuthenticatedAPITest(TestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.url = reverse("file-upload")
+        authentication.clear()
+
+    def test_token_is_cached(self):
+        # Token lookup, then the file listing
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token invalid")
+        for _ in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_token(self):
+        self.client.get(self.url)
+        response = self.client.post(reverse("user-logout"))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @mock.patch.object(authentication, "SHARED_CACHE", "default")
+    def test_logout_reaches_other_workers(self):
+        workers = [LRUCache(ttl=60), LRUCache(ttl=60)]
+
+        def get(worker, method="get", url=None):
+            with mock.patch.object(authentication, "local_cache", workers[worker]):
+                return getattr(self.client, method)(url or self.url)
+
+        for worker in range(2):
+            self.assertEqual(get(worker).status_code, status.HTTP_200_OK)
+        response = get(0, "post", reverse("user-logout"))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(get(1).status_code, status.HTTP_401_UNAUTHORIZED)
+        caches["default"].clear()
+
+
+class ChunkedUploadAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def create_session(self, size, chunk_size):
+        url = reverse("upload-session-create")
+        data = {"name": "chunked.bin", "size": size, "chunk_size": chunk_size}
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def put_chunk(self, session_id, index, content):
+        url = reverse("upload-chunk", kwargs={"session_id": session_id, "index": index})
+        return self.client.put(url, content, content_type="application/octet-stream")
+
+    def test_chunks_out_of_order_then_complete(self):
+        session_id = self.create_session(size=10, chunk_size=4)
+        self.assertEqual(self.put_chunk(session_id, 2, b"89").status_code, 200)
+        self.assertEqual(self.put_chunk(session_id, 0, b"0123").status_code, 200)
+
+        url = reverse("upload-session", kwargs={"session_id": session_id})
+        response = self.client.get(url)
+        self.assertEqual(response.data["received"], [[0, 4], [8, 10]])
+
+        url = reverse("upload-session-complete", kwargs={"session_id": session_id})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.put_chunk(session_id, 1, b"4567").status_code, 200)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        file_obj = File.objects.get(pk=response.data["id"])
+        with file_obj.file.open("rb") as fp:
+            self.assertEqual(fp.read(), b"0123456789")
+
+    def test_chunk_with_wrong_size(self):
+        session_id = self.create_session(size=10, chunk_size=4)
+        response = self.put_chunk(session_id, 0, b"012")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_chunk(session_id, 3, b"0123")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_wrong_size_retry_keeps_received_chunk(self):
+        session_id = self.create_session(size=8, chunk_size=4)
+        self.assertEqual(self.put_chunk(session_id, 0, b"0123").status_code, 200)
+        response = self.put_chunk(session_id, 0, b"xyzzy")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session_id, 1, b"4567").status_code, 200)
+
+        url = reverse("upload-session-complete", kwargs={"session_id": session_id})
+        response = self.client.post(url)
+        file_obj = File.objects.get(pk=response.data["id"])
+        with file_obj.file.open("rb") as fp:
+            self.assertEqual(fp.read(), b"01234567")
+
+    def test_announced_size_is_checked_before_writing(self):
+        session = uploads.create_session(self.user, "chunked.bin", 8, chunk_size=4)
+        stream = io.BytesIO(b"0123")
+        with self.assertRaises(uploads.ChunkError):
+            uploads.write_chunk(session, 0, stream, content_length=5)
+        self.assertEqual(stream.tell(), 0)
+        self.assertEqual(os.listdir(uploads.partial_dir(session)), [])
+
+        with self.assertRaises(uploads.ChunkError):
+            uploads.write_chunk(session, 0, io.BytesIO(b"012"))
+        self.assertEqual(os.listdir(uploads.partial_dir(session)), [])
+
+    def test_chunks_keep_session_alive(self):
+        session_id = self.create_session(size=8, chunk_size=4)
+        started = timezone.now() - timedelta(days=2)
+        UploadSession.objects.filter(pk=session_id).update(updated_at=started)
+        self.assertEqual(self.put_chunk(session_id, 0, b"0123").status_code, 200)
+
+        self.assertEqual(gc.collect(grace_period=0)["sessions"].deleted, 0)
+        self.assertGreater(UploadSession.objects.get(pk=session_id).updated_at, started)
+
+
+class FileDownloadAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.other_user = User.objects.create_user(
+            username="other_user", password="test_password"
+        )
+        self.file = File.objects.create(
+            name="notes",
+            file=SimpleUploadedFile("notes.txt", b"0123456789"),
+            owner=self.user,
+        )
+        self.url = reverse("file-download", kwargs={"file_id": self.file.id})
+        self.client.force_authenticate(user=self.user)
+        acl.clear()
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertIn('filename="notes.txt"', response["Content-Disposition"])
+
+    def test_range_download(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=20-")
+        self.assertEqual(
+            response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+    def test_stale_if_range_returns_full_content(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"stale"'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_requires_permission(self):
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        Permission.objects.create(
+            file=self.file, user=self.other_user, permission=Permission.READ
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CompressedStorageTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_authenticate(user=self.user)
+        self.content = b"".join(b"%d,row %d,ok\n" % (i, i) for i in range(2000))
+
+    def upload(self, name, content, file_name=None):
+        upload = SimpleUploadedFile(file_name or name, content)
+        data = {"name": name, "file": upload}
+        response = self.client.post(reverse("file-upload"), data, format="multipart")
+        return File.objects.get(pk=response.data["id"])
+
+    def test_compressible_content_is_stored_gzipped(self):
+        file_obj = self.upload("rows.csv", self.content)
+        stored_name = file_obj.file.name
+
+        self.assertTrue(stored_name.endswith(storage.GZIP_SUFFIX))
+        self.assertLess(
+            file_obj.file.storage.stored_size(stored_name), len(self.content) / 3
+        )
+        self.assertEqual(file_obj.file.size, len(self.content))
+        with file_obj.file.open("rb") as fp:
+            self.assertEqual(fp.read(), self.content)
+
+    def test_download_decodes_or_passes_through(self):
+        file_obj = self.upload("rows", self.content, "rows.csv")
+        url = reverse("file-download", kwargs={"file_id": file_obj.id})
+
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertIn('filename="rows.csv"', response["Content-Disposition"])
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertNotIn("Content-Encoding", response)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+        encoded = self.client.get(url, HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertEqual(encoded["Content-Encoding"], "gzip")
+        body = b"".join(encoded.streaming_content)
+        self.assertEqual(gzip.decompress(body), self.content)
+        self.assertNotEqual(encoded["ETag"], response["ETag"])
+
+        refused = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertNotIn("Content-Encoding", refused)
+
+        partial = self.client.get(
+            url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=10000-10009"
+        )
+        self.assertEqual(partial.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertNotIn("Content-Encoding", partial)
+        self.assertEqual(b"".join(partial.streaming_content), self.content[10000:10010])
+
+    def test_incompressible_content_is_stored_as_is(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("rows.csv", self.content)
+        packed = self.upload("rows.zip", archive.getvalue())
+        noise = self.upload("noise.bin", os.urandom(4096))
+        small = self.upload("small.txt", b"tiny")
+        gzipped = self.upload("rows.csv.gz", gzip.compress(self.content))
+
+        for file_obj in (packed, noise, small, gzipped):
+            self.assertFalse(file_obj.file.name.endswith(storage.GZIP_SUFFIX))
+        # Uploaded gzip files are served as the bytes they are
+        url = reverse("file-download", kwargs={"file_id": gzipped.id})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", response)
+        body = b"".join(response.streaming_content)
+        self.assertEqual(gzip.decompress(body), self.content)
+
+
+class SignedLinkAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username="owner")
+        self.reader = User.objects.create_user(username="reader")
+        self.client.force_authenticate(user=self.owner)
+        data = {"name": "notes.txt", "file": SimpleUploadedFile("n.txt", b"notes")}
+        response = self.client.post(reverse("file-upload"), data, format="multipart")
+        self.file_id = response.data["id"]
+        self.link_url = reverse("file-link", kwargs={"file_id": self.file_id})
+        Permission.objects.create(
+            file_id=self.file_id, user=self.reader, permission=Permission.READ
+        )
+        acl.clear()
+        links.clear()
+
+    def issue(self, user, **data):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(self.link_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["url"]
+
+    def fetch(self, url):
+        return APIClient().get(url)
+
+    def test_download_without_credentials_or_queries(self):
+        url = self.issue(self.reader, expires_in=60)
+        response = self.fetch(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"notes")
+        self.assertIn("attachment", response["Content-Disposition"])
+
+        with self.assertNumQueries(0):
+            response = self.fetch(url + "?inline=1")
+        self.assertIn("inline", response["Content-Disposition"])
+
+    def test_issuing_requires_read_access(self):
+        stranger = User.objects.create_user(username="stranger")
+        self.client.force_authenticate(user=stranger)
+        response = self.client.post(self.link_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.reader)
+        response = self.client.delete(self.link_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_tampered_and_expired_links(self):
+        url = self.issue(self.owner)
+        token = url.rstrip("/").rsplit("/", 1)[1]
+        response = self.fetch(url.replace(token, token[:-2] + "xx"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        payload = signing.loads(token, salt=links.SALT)
+        payload["x"] -= 2 * links.TTL
+        expired = signing.dumps(payload, salt=links.SALT, compress=True)
+        response = self.fetch(url.replace(token, expired))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_losing_access_revokes_issued_links(self):
+        url = self.issue(self.reader)
+        self.assertEqual(self.fetch(url).status_code, status.HTTP_200_OK)
+        Permission.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.fetch(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_losing_access_without_links_keeps_links(self):
+        url = self.issue(self.owner)
+        Permission.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.fetch(url).status_code, status.HTTP_200_OK)
+
+    def test_revoking_by_file_and_by_user(self):
+        owner_url = self.issue(self.owner)
+        reader_url = self.issue(self.reader)
+
+        response = self.client.delete(reverse("link-revoke"))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.fetch(reader_url).status_code, 403)
+        self.assertEqual(self.fetch(owner_url).status_code, 200)
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.delete(self.link_url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.fetch(owner_url).status_code, 403)
+        self.assertEqual(self.fetch(self.issue(self.owner)).status_code, 200)
+
+    def test_replaced_or_deleted_files_revoke_links(self):
+        url = self.issue(self.owner)
+        file_url = reverse("file-delete", kwargs={"file_id": self.file_id})
+        data = {"file": SimpleUploadedFile("n.txt", b"new notes")}
+        self.client.put(file_url, data, format="multipart")
+        self.assertEqual(self.fetch(url).status_code, 403)
+
+        url = self.issue(self.owner)
+        self.client.delete(file_url)
+        self.assertEqual(self.fetch(url).status_code, 403)
+
+        # Kept until every revoked link has expired
+        gc.collect(grace_period=0)
+        self.assertTrue(LinkVersion.objects.filter(object_id=self.file_id).exists())
+        LinkVersion.objects.update(updated_at=timezone.now() - timedelta(days=30))
+        gc.collect(grace_period=0)
+        self.assertEqual(LinkVersion.objects.filter(kind=LinkVersion.FILE).count(), 0)
+
+
+class BlobDeduplicationAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name="report.txt"):
+        url = reverse("file-upload")
+        data = {"name": name, "file": SimpleUploadedFile(name, content)}
+        response = self.client.post(url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(pk=response.data["id"])
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload(b"same bytes")
+        second = self.upload(b"same bytes", name="copy.txt")
+
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        url = reverse("file-delete", kwargs={"file_id": first.id})
+        self.client.delete(url)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_replacing_content_moves_reference(self):
+        file_obj = self.upload(b"version one")
+        url = reverse("file-delete", kwargs={"file_id": file_obj.id})
+        data = {"file": SimpleUploadedFile("report.txt", b"version two")}
+        response = self.client.put(url, data, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        counts = dict(Blob.objects.values_list("size", "ref_count"))
+        self.assertEqual(counts, {len(b"version one"): 0, len(b"version two"): 1})
+
+    def test_upload_by_known_digest(self):
+        file_obj = self.upload(b"installer")
+        url = reverse("file-upload-digest")
+        data = {
+            "name": "installer copy",
+            "digest": file_obj.blob.digest,
+            "size": file_obj.blob.size,
+        }
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(File.objects.get(pk=response.data["id"]).blob, file_obj.blob)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        data["digest"] = "0" * 64
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_by_digest_requires_access(self):
+        file_obj = self.upload(b"private notes")
+        other_user = User.objects.create_user(username="other_user")
+        self.client.force_authenticate(user=other_user)
+        url = reverse("file-upload-digest")
+        data = {"name": "copy", "digest": file_obj.checksum, "size": file_obj.size}
+        # Same answer as for unknown content
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        Permission.objects.create(file=file_obj, user=other_user, permission="read")
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class DigestUploadHandlerTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_upload_metadata_is_computed_while_streaming(self):
+        content = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+        url = reverse("file-upload")
+        data = {"name": "picture", "file": SimpleUploadedFile("picture.bin", content)}
+        response = self.client.post(url, data, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["size"], len(content))
+        self.assertEqual(response.data["checksum"], hashlib.sha256(content).hexdigest())
+        self.assertEqual(response.data["content_type"], "image/png")
+        # The staged upload was moved into the blob store, not copied
+        self.assertEqual(os.listdir(uploadhandlers.staging_dir()), [])
+
+    def test_text_is_sniffed_without_extension(self):
+        url = reverse("file-upload")
+        data = {"name": "notes", "file": SimpleUploadedFile("notes", b"plain words")}
+        response = self.client.post(url, data, format="multipart")
+
+        self.assertEqual(response.data["content_type"], "text/plain")
+
+
+class AccessResolutionTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            username="owner", password="test_password"
+        )
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.file = File.objects.create(name="test_file", file=None, owner=self.owner)
+        self.url = reverse("file-delete", kwargs={"file_id": self.file.id})
+        self.client.force_authenticate(user=self.user)
+        acl.clear()
+
+    def test_resolution_is_cached_and_invalidated(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(acl.resolve(self.file.id, self.user.id))
+        with self.assertNumQueries(0):
+            self.assertIsNone(acl.resolve(self.file.id, self.user.id))
+
+        permission = Permission.objects.create(
+            file=self.file, user=self.user, permission=Permission.CHANGE
+        )
+        self.assertEqual(acl.resolve(self.file.id, self.user.id), Permission.CHANGE)
+
+        permission.delete()
+        self.assertIsNone(acl.resolve(self.file.id, self.user.id))
+
+    def test_shared_cache_replaces_local_cache(self):
+        Permission.objects.create(
+            file=self.file, user=self.user, permission=Permission.READ
+        )
+        key = acl.cache_key(self.file.id, self.user.id)
+        # A grant this worker cached before another one revoked it
+        acl.local_cache.set(key, Permission.CHANGE)
+        with mock.patch.object(acl, "SHARED_CACHE", "default"):
+            self.assertEqual(acl.resolve(self.file.id, self.user.id), Permission.READ)
+            self.assertEqual(caches["default"].get(key), Permission.READ)
+
+            Permission.objects.filter(file=self.file, user=self.user).delete()
+            self.assertIsNone(acl.resolve(self.file.id, self.user.id))
+        caches["default"].delete(key)
+
+    def test_sharing_grants_read_access(self):
+        Sharing.objects.create(
+            shared_file=self.file, shared_with=self.user, shared_by=self.owner
+        )
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(self.url, {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_change_permission_allows_update_only(self):
+        Permission.objects.create(
+            file=self.file, user=self.user, permission=Permission.CHANGE
+        )
+
+        response = self.client.put(self.url, {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_owner_check_needs_no_query(self):
+        self.client.force_authenticate(user=self.owner)
+        # The file lookup is the only query left on the owner's path
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SharedFileListAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            username="owner", password="test_password"
+        )
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.shared = File.objects.create(name="shared", file=None, owner=self.owner)
+        self.granted = File.objects.create(name="granted", file=None, owner=self.owner)
+        self.own = File.objects.create(name="own", file=None, owner=self.user)
+        self.client.force_authenticate(user=self.user)
+        acl.clear()
+
+    def test_list_files_shared_with_me(self):
+        url = reverse("file-share", kwargs={"file_id": self.shared.id})
+        self.client.force_authenticate(user=self.owner)
+        self.client.post(url, {"user_ids": [self.user.id]}, format="json")
+        Permission.objects.create(
+            file=self.granted, user=self.user, permission=Permission.CHANGE
+        )
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse("file-shared-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        listed = {item["file"]["name"]: item["level"] for item in response.data}
+        self.assertEqual(listed, {"shared": "read", "granted": "change"})
+
+        response = self.client.get(reverse("file-shared-list"), {"include_owned": 1})
+        self.assertEqual(len(response.data), 3)
+
+    def test_index_follows_permission_changes(self):
+        permission = Permission.objects.create(
+            file=self.shared, user=self.user, permission=Permission.CHANGE
+        )
+        Sharing.objects.create(
+            shared_file=self.shared, shared_with=self.user, shared_by=self.owner
+        )
+        grant = FileAccess.objects.get(file=self.shared, user=self.user)
+        self.assertEqual((grant.level, grant.source), ("change", "permission"))
+
+        # Falls back to the remaining sharing once the permission is gone
+        permission.delete()
+        grant = FileAccess.objects.get(file=self.shared, user=self.user)
+        self.assertEqual((grant.level, grant.source), ("read", "sharing"))
+
+        Sharing.objects.filter(shared_file=self.shared).delete()
+        self.assertFalse(
+            FileAccess.objects.filter(file=self.shared, user=self.user).exists()
+        )
+
+    def test_ownership_transfer(self):
+        self.shared.owner = self.user
+        self.shared.save()
+
+        owners = FileAccess.objects.filter(file=self.shared).values_list(
+            "user", "level"
+        )
+        self.assertEqual(list(owners), [(self.user.id, "owner")])
+
+
+class KeysetPaginationAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.files = [
+            File.objects.create(name=f"file_{i}", file=None, owner=self.user)
+            for i in range(5)
+        ]
+        # Ties on created_at are broken by id
+        File.objects.filter(pk__in=[f.pk for f in self.files[1:4]]).update(
+            created_at=self.files[1].created_at
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_walk_all_pages(self):
+        url = reverse("file-upload")
+        response = self.client.get(url, {"page_size": 2})
+        names = [item["name"] for item in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            names += [item["name"] for item in response.data["results"]]
+
+        self.assertEqual(names, [f"file_{i}" for i in range(5)])
+
+    def test_unpaginated_listing_is_unchanged(self):
+        response = self.client.get(reverse("file-upload"))
+        self.assertEqual(len(response.data), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("file-upload"), {"cursor": "bogus"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fields_projection(self):
+        group = Group.objects.create(name="Videos", owner=self.user)
+        group.files.set(self.files)
+
+        response = self.client.get(reverse("file-upload"), {"fields": "id,name"})
+        self.assertEqual(set(response.data[0]), {"id", "name"})
+        response = self.client.get(
+            reverse("groups-list-create"), {"fields": "id,name", "page_size": 10}
+        )
+        self.assertEqual(response.data["results"], [{"id": group.id, "name": "Videos"}])
+
+
+class ArchiveDownloadAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.other_user = User.objects.create_user(
+            username="other_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+        acl.clear()
+
+    def upload(self, name, content):
+        url = reverse("file-upload")
+        data = {"name": name, "file": SimpleUploadedFile(name, content)}
+        response = self.client.post(url, data, format="multipart")
+        return File.objects.get(pk=response.data["id"])
+
+    def read_archive(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_group_archive(self):
+        uploaded = self.upload("a.txt", b"first file")
+        duplicate = self.upload("a.txt", b"second file")
+        # Stored outside the blob store, so its CRC is computed while streaming
+        legacy = File.objects.create(
+            name="legacy.bin",
+            file=SimpleUploadedFile("legacy.bin", b"\x00" * 1000),
+            owner=self.user,
+        )
+        hidden = File.objects.create(
+            name="hidden.txt",
+            file=SimpleUploadedFile("hidden.txt", b"secret"),
+            owner=self.other_user,
+        )
+        group = Group.objects.create(name="Docs", owner=self.user)
+        group.files.set([uploaded, duplicate, legacy, hidden])
+        url = reverse("group-download", kwargs={"group_id": group.id})
+
+        for compression in ("store", "deflate"):
+            response = self.client.get(url, {"compression": compression})
+            self.assertIn('filename="Docs.zip"', response["Content-Disposition"])
+            self.assertEqual(
+                self.read_archive(response),
+                {
+                    "a.txt": b"first file",
+                    "a (1).txt": b"second file",
+                    "legacy.bin": b"\x00" * 1000,
+                },
+            )
+
+    def test_group_archive_of_another_user(self):
+        shared = File.objects.create(
+            name="shared.txt",
+            file=SimpleUploadedFile("shared.txt", b"shared"),
+            owner=self.other_user,
+        )
+        Permission.objects.create(file=shared, user=self.user, permission="read")
+        group = Group.objects.create(name="Theirs", owner=self.other_user)
+        group.files.set([shared])
+        url = reverse("group-download", kwargs={"group_id": group.id})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_selection_archive_checks_every_file(self):
+        own = self.upload("own.txt", b"mine")
+        other = File.objects.create(
+            name="other.txt",
+            file=SimpleUploadedFile("other.txt", b"theirs"),
+            owner=self.other_user,
+        )
+        url = reverse("file-archive")
+        response = self.client.get(url, {"ids": f"{own.id},{other.id}"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        Permission.objects.create(file=other, user=self.user, permission="read")
+        response = self.client.get(url, {"ids": f"{own.id},{other.id}"})
+        self.assertEqual(
+            self.read_archive(response), {"own.txt": b"mine", "other.txt": b"theirs"}
+        )
+
+        response = self.client.get(url, {"ids": "999"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FileDeltaAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_authenticate(user=self.user)
+        self.content = bytes(range(256)) * 16  # four 1 KiB blocks
+        response = self.client.post(
+            reverse("file-upload"),
+            {"name": "data.bin", "file": SimpleUploadedFile("data.bin", self.content)},
+            format="multipart",
+        )
+        self.file_id = response.data["id"]
+        self.blocks_url = reverse("file-blocks", kwargs={"file_id": self.file_id})
+        self.url = reverse("file-delta", kwargs={"file_id": self.file_id})
+
+    def put_delta(self, manifest, parts, base=None, **data):
+        data = {
+            "base": base or hashlib.sha256(self.content).hexdigest(),
+            "block_size": 1024,
+            "manifest": json.dumps(manifest),
+            **data,
+            **{name: SimpleUploadedFile(name, part) for name, part in parts.items()},
+        }
+        return self.client.put(self.url, data, format="multipart")
+
+    def download(self):
+        url = reverse("file-download", kwargs={"file_id": self.file_id})
+        return b"".join(self.client.get(url).streaming_content)
+
+    def test_block_signatures(self):
+        response = self.client.get(self.blocks_url, {"block_size": 1024})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["digest"], hashlib.sha256(self.content).hexdigest()
+        )
+        self.assertEqual(len(response.data["blocks"]), 4)
+        block = self.content[1024:2048]
+        self.assertEqual(
+            response.data["blocks"][1],
+            [zlib.adler32(block), hashlib.sha256(block).hexdigest()],
+        )
+        response = self.client.get(self.blocks_url, {"block_size": 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delta_update(self):
+        new_content = self.content[:2048] + b"changed" + self.content[3072:]
+        response = self.put_delta(
+            [{"copy": [0, 2]}, {"data": "part0"}, {"copy": [3, 1]}],
+            {"part0": b"changed"},
+            digest=hashlib.sha256(new_content).hexdigest(),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["checksum"], hashlib.sha256(new_content).hexdigest()
+        )
+        self.assertEqual(self.download(), new_content)
+        # The previous content is released, the new one referenced once
+        self.assertEqual(
+            Blob.objects.get(digest=hashlib.sha256(self.content).hexdigest()).ref_count,
+            0,
+        )
+
+        # Based on content that has been replaced since
+        response = self.put_delta([{"copy": [0, 1]}], {})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_invalid_deltas(self):
+        for manifest, parts in (
+            ([{"copy": [3, 2]}], {}),
+            ([{"data": "missing"}], {}),
+            ([{"move": 1}], {}),
+            ([{"copy": 5}], {}),
+            ([{"copy": None}], {}),
+            ([{"copy": [0, 1, 2]}], {}),
+            ([{"copy": [0]}], {}),
+            ([{"copy": [True, 1]}], {}),
+            ([{"copy": ["0", 1]}], {}),
+            ([{"data": ["part0"]}], {"part0": b"x"}),
+            ([{"data": None}], {}),
+            (["copy"], {}),
+        ):
+            response = self.put_delta(manifest, parts)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_delta([{"copy": [0, 1]}], {}, digest="0" * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.download(), self.content)
+
+    def test_oversized_deltas_are_refused_before_staging(self):
+        StorageUsage.objects.filter(user=self.user).update(quota=len(self.content) * 2)
+        manifest = [{"copy": [0, 4]}] * 3
+        with mock.patch.object(delta, "stage_chunks") as stage_chunks:
+            response = self.put_delta(manifest, {})
+            self.assertEqual(response.status_code, status.HTTP_507_INSUFFICIENT_STORAGE)
+            with mock.patch.object(delta, "MAX_SIZE", len(self.content)):
+                response = self.put_delta(manifest[:2], {})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            with mock.patch.object(delta, "MAX_INSTRUCTIONS", 1):
+                response = self.put_delta(manifest[:2], {})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        stage_chunks.assert_not_called()
+        # A short last block counts for what it holds
+        self.assertEqual(
+            delta.validate_manifest([{"copy": [1, 1]}], {}, 1500, 1024), 476
+        )
+
+
+class BatchUploadAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("file-upload-batch")
+
+    def test_multiple_files(self):
+        group = Group.objects.create(name="Batch", owner=self.user)
+        data = {
+            "files": [
+                SimpleUploadedFile("a.txt", b"first"),
+                SimpleUploadedFile("b.txt", b"second"),
+                SimpleUploadedFile("c.txt", b"first"),
+            ],
+            "group": group.id,
+        }
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [result["name"] for result in response.data["files"]],
+            ["a.txt", "b.txt", "c.txt"],
+        )
+        files = File.objects.filter(owner=self.user)
+        self.assertEqual(files.count(), 3)
+        self.assertEqual(set(group.files.all()), set(files))
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(
+            Blob.objects.get(digest=hashlib.sha256(b"first").hexdigest()).ref_count, 2
+        )
+        self.assertEqual(
+            FileAccess.objects.filter(user=self.user, level=FileAccess.OWNER).count(), 3
+        )
+        for result in response.data["files"]:
+            download = reverse("file-download", kwargs={"file_id": result["id"]})
+            self.assertEqual(self.client.get(download).status_code, 200)
+
+    def test_zip_archive(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("docs/", b"")
+            zf.writestr("docs/readme.txt", b"hello")
+            zf.writestr("../escape.txt", b"outside")
+        data = {"archive": SimpleUploadedFile("docs.zip", archive.getvalue())}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(File.objects.values_list("name", flat=True)),
+            ["docs/readme.txt", "escape.txt"],
+        )
+
+    def test_unreadable_zip_members(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("secret.txt", b"hidden")
+            zf.writestr("open.txt", b"visible")
+        content = bytearray(archive.getvalue())
+        # Flag the first member as encrypted, in its local and central headers
+        content[6] |= 0x1
+        content[content.index(b"PK\x01\x02") + 8] |= 0x1
+        data = {"archive": SimpleUploadedFile("mixed.zip", bytes(content))}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = {item["name"]: item for item in response.data["files"]}
+        self.assertEqual(results["secret.txt"]["status"], "error")
+        self.assertIn("encrypted", results["secret.txt"]["error"])
+        self.assertEqual(results["open.txt"]["status"], "created")
+        self.assertEqual(
+            list(File.objects.values_list("name", flat=True)), ["open.txt"]
+        )
+
+    def test_tar_archive(self):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            info = tarfile.TarInfo("notes.md")
+            info.size = 5
+            tar.addfile(info, io.BytesIO(b"notes"))
+            tar.addfile(tarfile.TarInfo("link"), None)
+        data = {"archive": SimpleUploadedFile("notes.tar.gz", archive.getvalue())}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        file_obj = File.objects.get(name="notes.md")
+        self.assertEqual(file_obj.checksum, hashlib.sha256(b"notes").hexdigest())
+
+    def test_archive_expansion_is_limited(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("zeros.bin", bytes(1024 * 1024))
+        content = archive.getvalue()
+        self.assertLess(len(content), 10000)
+
+        StorageUsage.objects.create(user=self.user, quota=100000)
+        data = {"archive": SimpleUploadedFile("bomb.zip", content)}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_507_INSUFFICIENT_STORAGE)
+
+        StorageUsage.objects.filter(user=self.user).update(quota=None)
+        with mock.patch.object(batch, "MAX_EXTRACTED_SIZE", 1000):
+            data = {"archive": SimpleUploadedFile("bomb.zip", content)}
+            response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_invalid_requests(self):
+        response = self.client.post(self.url, {}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = {"archive": SimpleUploadedFile("bad.zip", b"not an archive")}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        other = User.objects.create_user(username="other_user")
+        group = Group.objects.create(name="Theirs", owner=other)
+        data = {"files": SimpleUploadedFile("a.txt", b"a"), "group": group.id}
+        response = self.client.post(self.url, data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(File.objects.exists())
+
+
+class ChangeFeedAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.other_user = User.objects.create_user(username="other_user")
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("change-feed")
+
+    def feed(self, cursor, **params):
+        response = self.client.get(self.url, {"cursor": cursor, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changes = [
+            (change["kind"], change["object_id"], change["action"])
+            for change in response.data["changes"]
+        ]
+        return response.data["cursor"], changes
+
+    def test_changes_since_cursor(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.data["reset"])
+        cursor = response.data["cursor"]
+
+        file_obj = File.objects.create(name="notes", owner=self.user)
+        group = Group.objects.create(name="Docs", owner=self.user)
+        group.files.add(file_obj)
+        cursor, changes = self.feed(cursor)
+        self.assertEqual(
+            changes,
+            [
+                ("file", file_obj.id, "updated"),
+                ("group", group.id, "updated"),
+                ("group", group.id, "updated"),
+            ],
+        )
+        self.assertEqual(self.feed(cursor)[1], [])
+
+        Permission.objects.create(
+            file=file_obj, user=self.other_user, permission="read"
+        )
+        file_obj.name = "renamed"
+        file_obj.save()
+        cursor, changes = self.feed(cursor)
+        self.assertEqual(changes, [("file", file_obj.id, "updated")])
+
+        file_id, group_id = file_obj.id, group.id
+        file_obj.delete()
+        group.delete()
+        cursor, changes = self.feed(cursor)
+        self.assertEqual(
+            changes, [("file", file_id, "deleted"), ("group", group_id, "deleted")]
+        )
+
+        self.client.force_authenticate(user=self.other_user)
+        _, changes = self.feed(0)
+        # Losing access and the deletion itself may both leave a tombstone
+        self.assertEqual(changes[:2], [("file", file_id, "updated")] * 2)
+        self.assertEqual(set(changes[2:]), {("file", file_id, "deleted")})
+
+    def test_limit_and_wait(self):
+        for i in range(3):
+            File.objects.create(name=f"file_{i}", owner=self.user)
+        response = self.client.get(self.url, {"cursor": 0, "page_size": 2})
+        self.assertTrue(response.data["has_more"])
+        cursor, changes = self.feed(response.data["cursor"], wait=0.1)
+        self.assertEqual(len(changes), 1)
+        cursor, changes = self.feed(cursor, wait=0.1)
+        self.assertEqual(changes, [])
+        response = self.client.get(self.url, {"cursor": "x"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pollers_are_bounded(self):
+        cursor, found = self.feed(0)
+        started = time.monotonic()
+        with mock.patch.object(changes, "pollers", threading.Semaphore(0)):
+            cursor, found = self.feed(cursor, wait=5)
+        self.assertEqual(found, [])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_local_cache_is_refused_on_deploy(self):
+        with mock.patch.object(changes, "NOTIFY_CACHE", "default"):
+            errors = checks.check_changes_cache(None)
+            self.assertEqual([error.id for error in errors], ["drive.E002"])
+            with mock.patch.object(changes, "MAX_WAIT", 0):
+                self.assertEqual(checks.check_changes_cache(None), [])
+
+    def test_changes_are_read_in_transaction_order(self):
+        cursor = self.client.get(self.url).data["cursor"]
+        # Recorded by a transaction that started first but committed last
+        late = Change.objects.create(
+            user=self.user, kind=Change.FILE, object_id=1, action=Change.UPDATED
+        )
+        early = Change.objects.create(
+            user=self.user,
+            kind=Change.FILE,
+            object_id=2,
+            action=Change.UPDATED,
+            transaction_id=1,
+        )
+        Change.objects.filter(pk=late.pk).update(transaction_id=2)
+        cursor, found = self.feed(cursor, page_size=1)
+        self.assertEqual(found, [("file", early.object_id, "updated")])
+        cursor, found = self.feed(cursor)
+        self.assertEqual(found, [("file", late.object_id, "updated")])
+        self.assertEqual(self.feed(cursor)[1], [])
+
+    def test_expired_cursors_reset(self):
+        File.objects.create(name="old", owner=self.user)
+        Change.objects.update(created_at=timezone.now() - timedelta(days=60))
+        stats = gc.collect(grace_period=0)["changes"]
+        self.assertEqual(stats.deleted, 1)
+        self.assertFalse(Change.objects.exists())
+
+        stale = changes.format_cursor((0, 0), time.time() - changes.RETENTION)
+        response = self.client.get(self.url, {"cursor": stale})
+        self.assertTrue(response.data["reset"])
+        cursor, found = self.feed(response.data["cursor"])
+        self.assertEqual(found, [])
+        self.assertFalse(self.client.get(self.url, {"cursor": cursor}).data["reset"])
+
+
+class StorageQuotaTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name="file.txt"):
+        data = {"name": name, "file": SimpleUploadedFile(name, content)}
+        return self.client.post(reverse("file-upload"), data, format="multipart")
+
+    def usage(self):
+        return self.client.get(reverse("storage-usage")).data
+
+    def test_usage_is_counted(self):
+        first = self.upload(b"x" * 100).data["id"]
+        self.upload(b"x" * 100, name="copy.txt")
+        self.assertEqual(self.usage()["used"], 200)
+
+        url = reverse("file-delete", kwargs={"file_id": first})
+        data = {"file": SimpleUploadedFile("file.txt", b"y" * 40)}
+        self.client.put(url, data, format="multipart")
+        self.assertEqual(self.usage()["used"], 140)
+        self.client.put(url, {"name": "renamed"}, format="json")
+        self.assertEqual(self.usage()["used"], 140)
+        self.client.delete(url)
+        self.assertEqual(self.usage(), {"used": 100, "quota": None, "available": None})
+
+        StorageUsage.objects.filter(user=self.user).update(used=12345)
+        call_command("recompute_storage_usage", stdout=io.StringIO())
+        self.assertEqual(self.usage()["used"], 100)
+
+    def test_quota_rejects_uploads_early(self):
+        StorageUsage.objects.create(user=self.user, quota=1000)
+        self.assertEqual(self.upload(b"x" * 600).status_code, status.HTTP_201_CREATED)
+        response = self.upload(b"x" * 600)
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(File.objects.count(), 1)
+
+        url = reverse("upload-session-create")
+        response = self.client.post(url, {"name": "big.bin", "size": 500})
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(self.usage()["available"], 400)
+
+
+class GarbageCollectionTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_authenticate(user=self.user)
+        self.storage = File._meta.get_field("file").storage
+
+    def upload(self, content):
+        data = {"name": "file.txt", "file": SimpleUploadedFile("file.txt", content)}
+        response = self.client.post(reverse("file-upload"), data, format="multipart")
+        return File.objects.select_related("blob").get(pk=response.data["id"])
+
+    def test_unreferenced_blobs(self):
+        file_obj = self.upload(b"first version")
+        first = file_obj.blob
+        url = reverse("file-delete", kwargs={"file_id": file_obj.id})
+        data = {"file": SimpleUploadedFile("file.txt", b"second version")}
+        self.client.put(url, data, format="multipart")
+        kept = self.upload(b"kept")
+
+        # Still inside the grace period
+        self.assertEqual(gc.collect()["blobs"].deleted, 0)
+        stats = gc.collect(grace_period=0, dry_run=True)["blobs"]
+        self.assertEqual((stats.deleted, stats.bytes), (1, len(b"first version")))
+        self.assertTrue(Blob.objects.filter(pk=first.pk).exists())
+
+        self.client.delete(url)
+        out = io.StringIO()
+        call_command("collect_garbage", "--grace-period=0", stdout=out)
+        self.assertIn("blobs: scanned 2, deleted 2", out.getvalue())
+        self.assertEqual(list(Blob.objects.all()), [kept.blob])
+        self.assertFalse(self.storage.exists(first.file.name))
+        self.assertTrue(self.storage.exists(kept.file.name))
+
+    def test_deduplicated_orphan_is_kept(self):
+        file_obj = self.upload(b"orphaned")
+        blob = file_obj.blob
+        self.client.delete(reverse("file-delete", kwargs={"file_id": file_obj.id}))
+        Blob.objects.filter(pk=blob.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=gc.GRACE_PERIOD + 60)
+        )
+
+        stored = blobs.store(SimpleUploadedFile("again.txt", b"orphaned"))
+        self.assertEqual(stored.pk, blob.pk)
+        self.assertEqual(gc.collect()["blobs"].deleted, 0)
+        self.assertTrue(self.storage.exists(blob.file.name))
+
+    def test_legacy_files_and_sessions(self):
+        file_obj = File.objects.create(
+            name="legacy.txt",
+            file=SimpleUploadedFile("legacy.txt", b"legacy"),
+            owner=self.user,
+        )
+        path = file_obj.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj.delete()
+        self.assertTrue(PendingDeletion.objects.filter(path=path).exists())
+        session = uploads.create_session(self.user, "big.bin", 10)
+        UploadSession.objects.filter(pk=session.pk).update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+
+        results = gc.collect(grace_period=0)
+        self.assertEqual(results["pending"].deleted, 1)
+        self.assertEqual(results["sessions"].deleted, 1)
+        self.assertFalse(self.storage.exists(path))
+        self.assertFalse(PendingDeletion.objects.exists())
+        self.assertFalse(os.path.exists(uploads.partial_dir(session)))
+
+    def test_storage_scan(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            file_obj = self.upload(b"referenced")
+            stray = self.storage.save("uploads/stray.txt", io.BytesIO(b"stray"))
+            stats = gc.collect(grace_period=0, scan_storage=True)["storage"]
+            self.assertEqual((stats.scanned, stats.deleted), (2, 1))
+            self.assertFalse(self.storage.exists(stray))
+            self.assertTrue(self.storage.exists(file_obj.file.name))
+
+
+processed_blobs = []
+
+
+def record_blob(blob):
+    processed_blobs.append(blob.digest)
+
+
+@jobs.register("test.flaky")
+def flaky_job(fail_times, key):
+    attempts = flaky_job.attempts[key] = flaky_job.attempts.get(key, 0) + 1
+    if attempts <= fail_times:
+        raise RuntimeError("Temporary failure")
+
+
+flaky_job.attempts = {}
+
+
+class JobQueueTest(TemporaryMediaMixin, TestCase):
+    def run_jobs(self):
+        out = io.StringIO()
+        call_command("run_jobs", "--concurrency=0", "--once", stdout=out)
+        return out.getvalue()
+
+    def make_due(self):
+        Job.objects.update(run_at=timezone.now())
+
+    def test_retries_with_backoff(self):
+        job = jobs.enqueue("test.flaky", fail_times=1, key="retry")
+        self.assertIn("test.flaky: 0 ok, 1 failed", self.run_jobs())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("Temporary failure", job.last_error)
+        # Not due yet
+        self.assertEqual(self.run_jobs(), "")
+
+        self.make_due()
+        self.assertIn("test.flaky: 1 ok, 0 failed", self.run_jobs())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+
+    def test_gives_up_after_max_attempts(self):
+        job = jobs.enqueue("test.flaky", fail_times=10, key="give_up")
+        with self.assertLogs("drive.jobs", "ERROR"):
+            for _ in range(job.max_attempts):
+                self.make_due()
+                self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_claim(self):
+        jobs.enqueue_many("test.flaky", [{"fail_times": 0, "key": i} for i in range(3)])
+        first = jobs.claim(2)
+        second = jobs.claim(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(jobs.claim(2), [])
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 3)
+
+    def test_old_jobs_are_collected(self):
+        done, failed, pending = [
+            jobs.enqueue("test.flaky", fail_times=0, key=f"old{i}") for i in range(3)
+        ]
+        ended = timezone.now() - timedelta(seconds=jobs.RETENTION + 60)
+        Job.objects.filter(pk=done.pk).update(status=Job.DONE, finished_at=ended)
+        Job.objects.filter(pk=failed.pk).update(status=Job.FAILED, finished_at=ended)
+        Job.objects.filter(pk=pending.pk).update(finished_at=ended)
+        self.assertEqual(gc.collect()["jobs"].deleted, 2)
+        self.assertEqual(list(Job.objects.all()), [pending])
+
+    def test_stale_jobs_use_up_their_attempts(self):
+        job = jobs.enqueue("test.flaky", fail_times=0, key="stale")
+        for attempt in range(job.max_attempts):
+            self.assertEqual(jobs.claim(1), [job.pk])
+            Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+            if attempt < job.max_attempts - 1:
+                self.assertEqual(jobs.requeue_stale(), 1)
+        with self.assertLogs("drive.jobs", "ERROR"):
+            self.assertEqual(jobs.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, job.max_attempts))
+        self.assertEqual(jobs.claim(1), [])
+
+    def test_new_blobs_are_processed(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="test_user"))
+        tasks.blob_processors.cache_clear()
+        self.addCleanup(tasks.blob_processors.cache_clear)
+        with self.settings(DRIVE_BLOB_PROCESSORS=["drive.tests.record_blob"]):
+            for name in ("a.txt", "b.txt"):
+                data = {"name": name, "file": SimpleUploadedFile(name, b"same")}
+                client.post(reverse("file-upload"), data, format="multipart")
+            # The upload itself only queued the work
+            self.assertEqual(processed_blobs, [])
+            self.assertEqual(Job.objects.count(), 1)
+            self.run_jobs()
+        self.assertEqual(processed_blobs, [hashlib.sha256(b"same").hexdigest()])
+
+
+class FilePreviewAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, name, content):
+        data = {"name": name, "file": SimpleUploadedFile(name, content)}
+        response = self.client.post(reverse("file-upload"), data, format="multipart")
+        return File.objects.select_related("blob").get(pk=response.data["id"])
+
+    def preview_url(self, file_obj):
+        return reverse("file-preview", kwargs={"file_id": file_obj.id})
+
+    def test_unsupported_files(self):
+        file_obj = self.upload("notes.txt", b"plain text")
+        url = self.preview_url(file_obj)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url, {"size": 100})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_image_preview(self):
+        image = io.BytesIO()
+        previews.Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)).save(image, "PNG")
+        file_obj = self.upload("photo.png", image.getvalue())
+        digest = file_obj.blob.digest
+        url = self.preview_url(file_obj)
+
+        response = self.client.get(url, {"size": 256, "v": digest})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        preview = previews.Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(preview.size, (256, 128))
+        storage = File._meta.get_field("file").storage
+        self.assertTrue(storage.exists(previews.preview_path(digest, 256)))
+
+        response = self.client.get(
+            url, {"size": 256}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        # Previews go away with their blob
+        self.client.delete(reverse("file-delete", kwargs={"file_id": file_obj.id}))
+        gc.collect(grace_period=0)
+        self.assertFalse(storage.exists(previews.preview_path(digest, 256)))
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_previews_are_rendered_after_upload(self):
+        image = io.BytesIO()
+        previews.Image.new("RGB", (64, 64), "blue").save(image, "JPEG")
+        file_obj = self.upload("small.jpg", image.getvalue())
+        call_command("run_jobs", "--concurrency=0", "--once", stdout=io.StringIO())
+        storage = File._meta.get_field("file").storage
+        for size in previews.SIZES:
+            path = previews.preview_path(file_obj.blob.digest, size)
+            self.assertTrue(storage.exists(path))
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_render_race_leaves_no_duplicate(self):
+        image = io.BytesIO()
+        previews.Image.new("RGB", (64, 64), "blue").save(image, "JPEG")
+        file_obj = self.upload("race.jpg", image.getvalue())
+        path = previews.get_or_create(file_obj.blob, 128, "image/jpeg")
+        storage = File._meta.get_field("file").storage
+        exists = storage.exists
+        answers = [False]
+
+        def racing_exists(name):
+            # Another render checked before this one stored its preview
+            return answers.pop() if answers else exists(name)
+
+        with mock.patch.object(storage, "exists", racing_exists):
+            self.assertEqual(
+                previews.get_or_create(file_obj.blob, 128, "image/jpeg"), path
+            )
+        names = storage.listdir(os.path.dirname(path))[1]
+        self.assertEqual(
+            [name for name in names if name.startswith("128")], ["128.jpg"]
+        )
+
+
+class BenchmarkTest(TemporaryMediaMixin, TestCase):
+    def test_every_endpoint_has_a_scenario(self):
+        scenarios = benchmark.scenarios()
+        covered = {scenario.url_name for scenario in scenarios}
+        self.assertEqual(covered, {pattern.name for pattern in urlpatterns})
+        names = [scenario.name for scenario in scenarios]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_scenarios_succeed(self):
+        dataset = benchmark.seed(users=3, files=4, groups=2, shares=1, contents=3)
+        self.assertEqual(dataset.as_dict()["files"], 12)
+        # The larger upload goes through an upload session in chunks
+        for scenario in benchmark.scenarios(["1KB", "2MB"], multipart_limit=2**20):
+            with self.subTest(scenario.name):
+                result = benchmark.run_scenario(
+                    scenario, dataset, iterations=2, concurrency=0
+                ).as_dict()
+                self.assertEqual(result["requests"], 2)
+                self.assertEqual(result["errors"], 0, result["statuses"])
+
+    def test_serialization(self):
+        dataset = benchmark.seed(users=2, files=3, groups=1, shares=1, contents=2)
+        results = benchmark.compare_serialization(dataset, repeat=1)
+        self.assertEqual([result.as_dict()["rows"] for result in results], [3, 1, 3])
+
+    def test_compare(self):
+        baseline = {"scenarios": [{"name": "a", "throughput": 100.0}]}
+        baseline["scenarios"][0]["latency_ms"] = {"p95": 10.0}
+        current = {"scenarios": [{"name": "a", "throughput": 150.0}]}
+        current["scenarios"][0]["latency_ms"] = {"p95": 5.0}
+        self.assertEqual(list(benchmark.compare(current, baseline)), [("a", 0.5, -0.5)])
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size("4KB"), 4096)
+        self.assertEqual(benchmark.parse_size("1gb"), 2**30)
+        self.assertEqual(benchmark.parse_size("10"), 10)
+        self.assertEqual(benchmark.format_size(16 * 2**20), "16MB")
+
+
+class RequestMetricsTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.user = User.objects.create_user(username="test_user")
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def sample(self, name, **labels):
+        for _, sample_name, sample_labels, value in metrics.registry.samples():
+            if sample_name == name and labels.items() <= dict(sample_labels).items():
+                return value
+        return None
+
+    def test_phases(self):
+        content = b"metrics " * 1000
+        data = {"name": "a.txt", "file": SimpleUploadedFile("a.txt", content)}
+        response = self.client.post(reverse("file-upload"), data, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.get(reverse("file-upload"))
+
+        labels = {"endpoint": "file-upload"}
+        self.assertEqual(
+            self.sample("drive_requests_total", method="POST", status="201", **labels),
+            1,
+        )
+        self.assertEqual(
+            self.sample("drive_request_duration_seconds_count", method="GET", **labels),
+            1,
+        )
+        self.assertGreater(self.sample("drive_db_queries_total", **labels), 0)
+        for phase in ("auth", "upload", "db", "serialization", "storage", "other"):
+            self.assertIsNotNone(
+                self.sample("drive_request_phase_seconds_total", phase=phase, **labels),
+                phase,
+            )
+        self.assertGreater(
+            self.sample("drive_request_bytes_total", direction="in", **labels),
+            len(content),
+        )
+        self.assertGreater(
+            self.sample("drive_request_bytes_total", direction="out", **labels), 0
+        )
+        self.assertIsNotNone(self.sample("drive_cache_hits_total", cache="auth"))
+
+    def test_nested_phases(self):
+        record = metrics.RequestMetrics()
+        token = metrics.current.set(record)
+        try:
+            with metrics.phase("permissions"):
+                with metrics.phase("db"):
+                    time.sleep(0.02)
+        finally:
+            metrics.current.reset(token)
+        self.assertGreaterEqual(record.phases["db"], 0.02)
+        self.assertLess(record.phases["permissions"], 0.02)
+
+    def test_streamed_bytes(self):
+        file_obj = File.objects.create(
+            name="a.txt", owner=self.user, file=SimpleUploadedFile("a.txt", b"x" * 100)
+        )
+        response = self.client.get(reverse("file-archive"), {"ids": file_obj.pk})
+        body = b"".join(response.streaming_content)
+        response.close()
+        self.assertEqual(
+            self.sample(
+                "drive_request_bytes_total", endpoint="file-archive", direction="out"
+            ),
+            len(body),
+        )
+
+    def test_endpoint(self):
+        self.client.get(reverse("storage-usage"))
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        authentication.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn("# TYPE drive_request_duration_seconds histogram", body)
+        self.assertIn(
+            'drive_requests_total{endpoint="storage-usage",method="GET",status="200"} 1',
+            body,
+        )
+        self.assertIn('drive_cache_hits_total{cache="acl"}', body)
+
+        scraper = APIClient()
+        with mock.patch.object(metrics, "TOKEN", "secret"):
+            response = scraper.get(url, HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = scraper.get(url, HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_slow_request_log(self):
+        with mock.patch.object(metrics, "SLOW_REQUEST_SECONDS", 0):
+            with self.assertLogs("drive.metrics", "WARNING") as logs:
+                self.client.get(reverse("file-upload"))
+        message = logs.output[0]
+        self.assertIn("Slow request: GET api/v1/upload/ 200", message)
+        self.assertIn('FROM "drive_file"', message)
+        self.assertEqual(
+            self.sample("drive_slow_requests_total", endpoint="file-upload"), 1
+        )
+
+
+@mock.patch.object(routers, "REPLICAS", ["replica"])
+class ReplicaRoutingTest(TemporaryMediaMixin, TransactionTestCase):
+    # Test cases run in a transaction, which keeps every read on the primary
+    def setUp(self):
+        routers.replication.clear()
+        caches[routers.PIN_CACHE].clear()
+        self.lag = 0
+
+    def measure(self, alias):
+        return None if self.lag is None else time.time() - self.lag
+
+    def route(self, read_only=True, user_id=1, wrote=False):
+        routing = routers.Routing(read_only)
+        routing.user_id = user_id
+        token = routers.current.set(routing)
+        try:
+            if wrote:
+                routers.ReplicaRouter().db_for_write(File)
+            with mock.patch.object(routers, "measure", self.measure):
+                return routers.ReplicaRouter().db_for_read(File)
+        finally:
+            routers.current.reset(token)
+
+    def test_reads_of_safe_requests(self):
+        self.assertEqual(self.route(), "replica")
+        self.assertEqual(self.route(read_only=False), "default")
+        # Authentication itself reads from the primary
+        self.assertEqual(self.route(user_id=None), "default")
+        self.assertEqual(self.route(wrote=True), "default")
+        self.assertIsNone(routers.ReplicaRouter().db_for_read(File))
+
+    def test_lag(self):
+        self.lag = routers.MAX_LAG + 1
+        self.assertEqual(self.route(), "default")
+        routers.replication.clear()
+        self.lag = None
+        self.assertEqual(self.route(), "default")
+        # Measured again once the interval is over
+        self.lag = 0
+        self.assertEqual(self.route(), "default")
+        routers.replication["replica"] = (time.time() - 60, None)
+        self.assertEqual(self.route(), "replica")
+
+    def test_pinned_after_write(self):
+        self.lag = 1
+        routers.pin(1)
+        self.assertEqual(self.route(user_id=1), "default")
+        self.assertEqual(self.route(user_id=2), "replica")
+        # Once the replica has replayed the write
+        caches[routers.PIN_CACHE].set(routers.pin_key(1), time.time() - 2)
+        self.assertEqual(self.route(user_id=1), "replica")
+
+    def test_middleware(self):
+        user = User.objects.create_user(username="test_user")
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        # An unreachable replica falls back to the primary
+        self.lag = None
+        with mock.patch.object(routers, "measure", self.measure):
+            response = client.get(reverse("file-upload"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsNone(routers.last_write(user.pk))
+
+            data = {"name": "a.txt", "file": SimpleUploadedFile("a.txt", b"a")}
+            response = client.post(reverse("file-upload"), data, format="multipart")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertIsNotNone(routers.last_write(user.pk))
+
+    def test_replica_that_has_replayed_nothing_is_skipped(self):
+        connection = mock.MagicMock(vendor="postgresql")
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (None,)
+        with mock.patch.dict(routers.connections, {"replica": connection}):
+            self.assertIsNone(routers.measure("replica"))
+            cursor.fetchone.return_value = (0,)
+            self.assertIsNotNone(routers.measure("replica"))
+
+    @mock.patch.object(routers, "PIN_CACHE", "default")
+    def test_local_pin_cache_is_refused(self):
+        errors = checks.check_replica_pin_cache(None)
+        self.assertEqual([error.id for error in errors], ["drive.E001"])
+        with mock.patch.object(routers, "REPLICAS", []):
+            self.assertEqual(checks.check_replica_pin_cache(None), [])
+
+
+class FastSerializationTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.other_user = User.objects.create_user(username="other_user")
+        self.client.force_authenticate(user=self.user)
+        names = ["a b.txt", "ünïcödé ☃.txt", "100% (1).csv"]
+        files = [
+            File.objects.create(
+                name=name, owner=self.user, file=SimpleUploadedFile(name, b"data")
+            )
+            for name in names
+        ]
+        files.append(File.objects.create(name="empty", owner=self.user, file=None))
+        group = Group.objects.create(name="Mixed", owner=self.user)
+        group.files.set(files[:3])
+        Group.objects.create(name="Empty", owner=self.user)
+        shared = File.objects.create(
+            name="theirs.txt",
+            owner=self.other_user,
+            file=SimpleUploadedFile("theirs.txt", b"theirs"),
+        )
+        Permission.objects.create(file=shared, user=self.user, permission="read")
+
+    def assertSameResponse(self, url, params=None):
+        with mock.patch.object(rows, "ENABLED", False):
+            expected = self.client.get(url, params)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+
+    def test_same_output(self):
+        for params in (None, {"fields": "id,file"}, {"page_size": 2}):
+            with self.subTest(params=params):
+                self.assertSameResponse(reverse("file-upload"), params)
+        for params in (
+            None,
+            {"files": "summary"},
+            {"fields": "name"},
+            {"fields": "files", "files": "summary", "page_size": 1},
+        ):
+            with self.subTest(params=params):
+                self.assertSameResponse(reverse("groups-list-create"), params)
+        for params in (None, {"include_owned": "1"}):
+            with self.subTest(params=params):
+                self.assertSameResponse(reverse("file-shared-list"), params)
+
+    def test_renderer(self):
+        data = {
+            "when": timezone.now(),
+            "price": Decimal("1.50"),
+            "text": 'line\u2028separator ünïcödé "quoted"\n',
+            "items": [1, 2.5, None, True, {"nested": []}],
+            1: "int key",
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(renderers.JSONRenderer().render(data), expected)
+
+
+class SearchAPITest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="test_user")
+        self.other_user = User.objects.create_user(username="other_user")
+        self.client.force_authenticate(user=self.user)
+        self.report = self.create_file("Q3 report_final.pdf", self.user)
+        self.notes = self.create_file("meeting notes.txt", self.user)
+        self.shared = self.create_file("Report annual.docx", self.other_user)
+        Permission.objects.create(file=self.shared, user=self.user, permission="read")
+        self.hidden = self.create_file("report draft.txt", self.other_user)
+        self.group = Group.objects.create(name="Reports 2024", owner=self.user)
+        Group.objects.create(name="Reports", owner=self.other_user)
+
+    def create_file(self, name, owner):
+        return File.objects.create(
+            name=name, owner=owner, file=SimpleUploadedFile("data.txt", b"data")
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(reverse("search"), {"q": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def found_ids(self, query):
+        return [item["file"]["id"] for item in self.search(query)["files"]]
+
+    def test_owned_and_shared_files(self):
+        data = self.search("report")
+        # Names starting with the query first
+        self.assertEqual(
+            [item["file"]["id"] for item in data["files"]],
+            [self.shared.id, self.report.id],
+        )
+        self.assertEqual(data["files"][0]["level"], "read")
+        self.assertEqual(data["files"][0]["source"], FileAccess.PERMISSION)
+        self.assertEqual(
+            data["groups"], [{"id": self.group.id, "name": "Reports 2024"}]
+        )
+
+    def test_every_word_matches(self):
+        self.assertEqual(self.found_ids("rep fin"), [self.report.id])
+        self.assertEqual(self.found_ids("FINAL.pdf"), [self.report.id])
+        self.assertEqual(self.found_ids("report notes"), [])
+
+    def test_common_words(self):
+        # Checked against the files the user can see instead of looked up
+        with mock.patch.object(search, "CANDIDATES", 1):
+            self.assertEqual(self.found_ids("rep fin"), [self.report.id])
+            self.assertEqual(self.found_ids("report"), [self.shared.id, self.report.id])
+
+    def test_renamed_and_deleted_files(self):
+        self.report.name = "budget.xlsx"
+        self.report.save()
+        self.assertEqual(self.found_ids("report"), [self.shared.id])
+        self.assertEqual(self.found_ids("budget"), [self.report.id])
+        self.notes.delete()
+        self.assertFalse(
+            SearchToken.objects.filter(kind=SearchToken.FILE, object_id=self.notes.id)
+        )
+
+    def test_batch_uploads_are_indexed(self):
+        files = [SimpleUploadedFile("invoice 7.pdf", b"one")]
+        response = self.client.post(reverse("file-upload-batch"), {"files": files})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        [found] = self.search("invoice")["files"]
+        self.assertEqual(found["file"]["name"], "invoice 7.pdf")
+
+    def test_limit(self):
+        self.assertEqual(len(self.search("report", limit=1)["files"]), 1)
+
+    def test_autocomplete(self):
+        url = reverse("search-autocomplete")
+        response = self.client.get(url, {"q": "rep"})
+        self.assertEqual(
+            response.data, {"suggestions": ["Report annual.docx", "Reports 2024"]}
+        )
+        response = self.client.get(url, {"q": "REPORT a"})
+        self.assertEqual(response.data, {"suggestions": ["Report annual.docx"]})
+
+    def test_query_is_required(self):
+        for params in ({}, {"q": " -. "}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("search"), params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_same_output_through_serializers(self):
+        expected = self.client.get(reverse("search"), {"q": "report"}).content
+        with mock.patch.object(rows, "ENABLED", False):
+            response = self.client.get(reverse("search"), {"q": "report"})
+        self.assertEqual(response.content, expected)
+
+    def test_rebuild_search_index(self):
+        SearchToken.objects.all().delete()
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(self.found_ids("final"), [self.report.id])
+        self.assertEqual(len(self.search("2024")["groups"]), 1)
+
+    def test_words(self):
+        self.assertEqual(
+            search.words("Q3 report_final-FINAL.pdf"), ["q3", "report", "final", "pdf"]
+        )
+
+
+class QueryBudgetTest(TemporaryMediaMixin, TestCase):
+    """
+    Pin the number of queries of every endpoint in drive/urls.py, for
+    several dataset sizes, so an N+1 fails here instead of in production.
+    """
+
+    dataset_sizes = (1, 10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="test_user", password="test_password"
+        )
+        self.other_user = User.objects.create_user(
+            username="other_user", password="test_password"
+        )
+        self.client.force_authenticate(user=self.user)
+        acl.clear()
+
+    def create_files(self, count, owner=None):
+        return [
+            File.objects.create(
+                name=f"file_{i}",
+                file=SimpleUploadedFile(f"file_{i}.txt", b"content"),
+                owner=owner or self.user,
+            )
+            for i in range(count)
+        ]
+
+    def create_users(self, count):
+        return [
+            User.objects.create_user(username=f"user_{i}_{User.objects.count()}")
+            for i in range(count)
+        ]
+
+    def assertQueryBudget(self, expected, method, url, data=None, **kwargs):
+        with self.assertNumQueries(expected):
+            response = getattr(self.client, method)(url, data, **kwargs)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_register_and_login(self):
+        self.client.force_authenticate(user=None)
+        data = {
+            "username": "new_user",
+            "email": "new@example.com",
+            "password1": "secret",
+            "password2": "secret",
+        }
+        self.assertQueryBudget(6, "post", reverse("user-register"), data)
+        data = {"username": "new_user", "password": "secret"}
+        self.assertQueryBudget(2, "post", reverse("user-login"), data)
+        self.client.force_authenticate(user=User.objects.get(username="new_user"))
+        self.assertQueryBudget(2, "post", reverse("user-logout"))
+
+    def test_file_list(self):
+        for size in self.dataset_sizes:
+            self.create_files(size)
+            self.assertQueryBudget(1, "get", reverse("file-upload"))
+            self.assertQueryBudget(1, "get", reverse("file-upload"), {"page_size": 5})
+
+    def test_file_upload(self):
+        data = {"name": "upload", "file": SimpleUploadedFile("upload.txt", b"data")}
+        self.assertQueryBudget(19, "post", reverse("file-upload"), data)
+
+    def test_batch_upload(self):
+        url = reverse("file-upload-batch")
+        self.client.post(url, {"files": SimpleUploadedFile("b.txt", b"batch")})
+        for size in self.dataset_sizes:
+            # Only content that isn't stored yet costs queries per file, stored
+            # blobs are claimed from the garbage collector in one update
+            files = [SimpleUploadedFile(f"b{i}.txt", b"batch") for i in range(size)]
+            self.assertQueryBudget(17, "post", url, {"files": files})
+        files = [SimpleUploadedFile(f"n{i}.txt", f"{i}".encode()) for i in range(5)]
+        self.assertQueryBudget(36, "post", url, {"files": files})
+
+    def test_file_upload_by_digest(self):
+        file_obj = self.create_files(1)[0]
+        blob = Blob.objects.create(
+            digest="a" * 64, size=7, file=file_obj.file.name, ref_count=1
+        )
+        File.objects.filter(pk=file_obj.pk).update(blob=blob)
+        data = {"name": "copy", "digest": blob.digest, "size": blob.size}
+        self.assertQueryBudget(15, "post", reverse("file-upload-digest"), data)
+
+    def test_chunked_upload(self):
+        url = reverse("upload-session-create")
+        data = {"name": "chunked.bin", "size": 8, "chunk_size": 4}
+        session_id = self.assertQueryBudget(3, "post", url, data).data["id"]
+        for index in range(2):
+            url = reverse(
+                "upload-chunk", kwargs={"session_id": session_id, "index": index}
+            )
+            self.assertQueryBudget(
+                8, "put", url, b"0123", content_type="application/octet-stream"
+            )
+        url = reverse("upload-session", kwargs={"session_id": session_id})
+        self.assertQueryBudget(2, "get", url)
+        url = reverse("upload-session-complete", kwargs={"session_id": session_id})
+        self.assertQueryBudget(27, "post", url)
+
+    def test_file_retrieve_update_delete(self):
+        file_obj = self.create_files(1, owner=self.other_user)[0]
+        Permission.objects.create(
+            file=file_obj, user=self.user, permission=Permission.CHANGE
+        )
+        url = reverse("file-delete", kwargs={"file_id": file_obj.id})
+        self.assertQueryBudget(2, "get", url)
+        self.assertQueryBudget(8, "put", url, {"name": "renamed"}, format="json")
+        self.client.force_authenticate(user=self.other_user)
+        self.assertQueryBudget(20, "delete", url)
+
+    def test_file_delta(self):
+        file_obj = self.create_files(1)[0]
+        url = reverse("file-blocks", kwargs={"file_id": file_obj.id})
+        self.assertQueryBudget(1, "get", url, {"block_size": 1024})
+        data = {
+            "base": hashlib.sha256(b"content").hexdigest(),
+            "block_size": 1024,
+            "manifest": json.dumps([{"copy": [0, 1]}, {"data": "tail"}]),
+            "tail": SimpleUploadedFile("tail", b" and more"),
+        }
+        url = reverse("file-delta", kwargs={"file_id": file_obj.id})
+        self.assertQueryBudget(21, "put", url, data, format="multipart")
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_file_preview(self):
+        image = io.BytesIO()
+        previews.Image.new("RGB", (64, 64)).save(image, "PNG")
+        data = {"name": "image", "file": SimpleUploadedFile("i.png", image.getvalue())}
+        response = self.client.post(reverse("file-upload"), data)
+        url = reverse("file-preview", kwargs={"file_id": response.data["id"]})
+        self.assertQueryBudget(1, "get", url)
+
+    def test_file_link(self):
+        file_obj = self.create_files(1)[0]
+        url = reverse("file-link", kwargs={"file_id": file_obj.id})
+        response = self.assertQueryBudget(3, "post", url)
+        links.clear()
+        self.assertQueryBudget(1, "get", response.data["url"])
+        self.assertQueryBudget(0, "get", response.data["url"])
+        self.assertQueryBudget(2, "delete", url)
+        self.assertQueryBudget(1, "delete", reverse("link-revoke"))
+
+    def test_file_download(self):
+        file_obj = self.create_files(1)[0]
+        url = reverse("file-download", kwargs={"file_id": file_obj.id})
+        self.assertQueryBudget(1, "get", url)
+
+    def test_file_share(self):
+        file_obj = self.create_files(1)[0]
+        url = reverse("file-share", kwargs={"file_id": file_obj.id})
+        for size in self.dataset_sizes:
+            user_ids = [user.id for user in self.create_users(size)]
+            self.assertQueryBudget(
+                10, "post", url, {"user_ids": user_ids}, format="json"
+            )
+
+    def test_bulk_permissions(self):
+        url = reverse("permission-bulk")
+        for size in self.dataset_sizes:
+            files = [file_obj.id for file_obj in self.create_files(size)]
+            users = [user.id for user in self.create_users(size)]
+            data = {"files": files, "users": users, "permission": "read"}
+            self.assertQueryBudget(13, "post", url, data, format="json")
+            data = {"action": "revoke", "files": files, "users": users}
+            self.assertQueryBudget(16, "post", url, data, format="json")
+
+    def test_storage_usage(self):
+        for size in self.dataset_sizes:
+            self.create_files(size)
+            self.assertQueryBudget(1, "get", reverse("storage-usage"))
+
+    def test_change_feed(self):
+        for size in self.dataset_sizes:
+            self.create_files(size)
+            self.assertQueryBudget(1, "get", reverse("change-feed"), {"cursor": 0})
+
+    def test_shared_file_list(self):
+        for size in self.dataset_sizes:
+            for file_obj in self.create_files(size, owner=self.other_user):
+                Sharing.objects.create(
+                    shared_file=file_obj,
+                    shared_with=self.user,
+                    shared_by=self.other_user,
+                )
+            self.assertQueryBudget(1, "get", reverse("file-shared-list"))
+
+    def test_search(self):
+        for size in self.dataset_sizes:
+            files = self.create_files(size, owner=self.other_user)
+            for file_obj in files:
+                Permission.objects.create(
+                    file=file_obj, user=self.user, permission=Permission.READ
+                )
+            Group.objects.create(name="file_group", owner=self.user)
+            # One bounded count per word, then the files and the groups
+            self.assertQueryBudget(3, "get", reverse("search"), {"q": "file"})
+            url = reverse("search-autocomplete")
+            self.assertQueryBudget(3, "get", url, {"q": "file_"})
+
+    def test_group_list(self):
+        for size in self.dataset_sizes:
+            for i in range(size):
+                group = Group.objects.create(name=f"group_{i}", owner=self.user)
+                group.files.set(self.create_files(3))
+            url = reverse("groups-list-create")
+            self.assertQueryBudget(2, "get", url)
+            self.assertQueryBudget(2, "get", url, {"files": "summary"})
+            self.assertQueryBudget(2, "get", url, {"page_size": 5})
+
+    def test_group_create(self):
+        url = reverse("groups-list-create")
+        for size in self.dataset_sizes:
+            file_ids = [file_obj.id for file_obj in self.create_files(size)]
+            data = {"name": "Videos", "files": file_ids}
+            self.assertQueryBudget(9, "post", url, data, format="json")
+
+    def test_group_retrieve_update_delete(self):
+        for size in self.dataset_sizes:
+            group = Group.objects.create(name="Videos", owner=self.user)
+            files = self.create_files(size)
+            group.files.set(files)
+            url = reverse("group-retrieve-update-delete", kwargs={"group_id": group.id})
+            self.assertQueryBudget(2, "get", url)
+            data = {"files": [file_obj.id for file_obj in files]}
+            self.assertQueryBudget(7, "put", url, data, format="json")
+            self.assertQueryBudget(5, "delete", url)
+
+    def test_archive_downloads(self):
+        for size in self.dataset_sizes:
+            files = self.create_files(size, owner=self.other_user)
+            for file_obj in files:
+                Permission.objects.create(
+                    file=file_obj, user=self.user, permission=Permission.READ
+                )
+            file_ids = ",".join(str(file_obj.id) for file_obj in files)
+            url = reverse("file-archive")
+            self.assertQueryBudget(2, "get", url, {"ids": file_ids})
+
+            group = Group.objects.create(name="Docs", owner=self.user)
+            group.files.set(files)
+            url = reverse("group-download", kwargs={"group_id": group.id})
+            acl.clear()
+            self.assertQueryBudget(3, "get", url)
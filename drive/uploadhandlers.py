@@ -0,0 +1,110 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from functools import partial
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from . import mime, uploads
+
+STAGING_DIR = "uploads/staging"
+
+
+def staging_dir():
+    try:
+        path = uploads.file_storage().path(STAGING_DIR)
+    except NotImplementedError:
+        # Remote storage, the bytes have to be sent over anyway
+        return settings.FILE_UPLOAD_TEMP_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """
+    An upload written to a temporary file on the storage volume itself, so
+    saving it is a rename instead of a second copy of the bytes.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=staging_dir())
+        UploadedFile.__init__(
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+        self.sha256 = None
+        self.crc32 = None
+        self.detected_content_type = None
+
+
+class DigestUploadHandler(FileUploadHandler):
+    """
+    Stream uploads to the storage volume while computing their size, SHA-256,
+    CRC-32 and content type in the same pass.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self.hash = hashlib.sha256()
+        self.crc32 = 0
+        self.head = b""
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.hash.update(raw_data)
+        self.crc32 = zlib.crc32(raw_data, self.crc32)
+        if len(self.head) < mime.SNIFF_SIZE:
+            self.head += raw_data[: mime.SNIFF_SIZE - len(self.head)]
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hash.hexdigest()
+        self.file.crc32 = self.crc32
+        self.file.detected_content_type = mime.sniff(self.head, self.file_name)
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            temp_location = self.file.temporary_file_path()
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
+
+
+class SizeLimitExceeded(Exception):
+    pass
+
+
+def stage(stream, name, block_size=64 * 1024, limit=None):
+    """
+    Copy a readable stream into a staged upload, hashing and sniffing it
+    exactly like an upload received through ``DigestUploadHandler``. Raise
+    ``SizeLimitExceeded``, leaving nothing behind, once more than ``limit``
+    bytes are read.
+    """
+    return stage_chunks(iter(partial(stream.read, block_size), b""), name, limit)
+
+
+def stage_chunks(chunks, name, limit=None):
+    handler = DigestUploadHandler()
+    handler.new_file("file", name, mime.guess(name), None)
+    size = 0
+    try:
+        for chunk in chunks:
+            if limit is not None and size + len(chunk) > limit:
+                raise SizeLimitExceeded(f"{name} is larger than {limit} bytes.")
+            handler.receive_data_chunk(chunk, size)
+            size += len(chunk)
+    except BaseException:
+        handler.upload_interrupted()
+        raise
+    return handler.file_complete(size)
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, mime, quotas
+from .models import File, UploadChunk, UploadSession
+
+CHUNK_SIZE = getattr(settings, "DRIVE_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, "DRIVE_UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+PARTIAL_DIR = "uploads/partial"
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+    pass
+
+
+class StagedFile(DjangoFile):
+    """
+    A file that already lives on the storage volume, so the storage backend
+    can move it into place instead of copying its bytes.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def file_storage():
+    return File._meta.get_field("file").storage
+
+
+def partial_dir(session):
+    # One file per received chunk, named after its index
+    return file_storage().path(f"{PARTIAL_DIR}/{session.pk}")
+
+
+def create_session(owner, name, size, chunk_size=None):
+    session = UploadSession.objects.create(
+        owner=owner, name=name, size=size, chunk_size=chunk_size or CHUNK_SIZE
+    )
+    os.makedirs(partial_dir(session), exist_ok=True)
+    return session
+
+
+def write_chunk(session, index, stream, content_length=None):
+    """
+    Store chunk ``index`` of an upload read from ``stream``, refusing it up
+    front when the announced ``content_length`` isn't the chunk's size.
+    """
+    if index >= session.total_chunks:
+        raise ChunkError(f"Chunk index must be below {session.total_chunks}.")
+    offset = index * session.chunk_size
+    expected = min(session.chunk_size, session.size - offset)
+    if content_length is not None and content_length != expected:
+        raise ChunkError(f"Chunk {index} must be exactly {expected} bytes.")
+    directory = partial_dir(session)
+    os.makedirs(directory, exist_ok=True)
+    # Renamed into place once complete, a retry that turns out short never
+    # replaces a chunk that was already received
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        received = 0
+        with os.fdopen(fd, "wb") as fp:
+            while stream is not None and received <= expected:
+                block = stream.read(min(COPY_BLOCK_SIZE, expected + 1 - received))
+                if not block:
+                    break
+                fp.write(block)
+                received += len(block)
+        if received != expected:
+            raise ChunkError(f"Chunk {index} must be exactly {expected} bytes.")
+        os.replace(temp_path, os.path.join(directory, str(index)))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    chunk, created = UploadChunk.objects.update_or_create(
+        session=session, index=index, defaults={"offset": offset, "size": received}
+    )
+    # Sessions expire once they have been idle for UPLOAD_SESSION_TTL
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk
+
+
+def assemble(session):
+    directory = partial_dir(session)
+    path = os.path.join(directory, "assembled")
+    with open(path, "wb") as out:
+        for index in range(session.total_chunks):
+            with open(os.path.join(directory, str(index)), "rb") as fp:
+                shutil.copyfileobj(fp, out, COPY_BLOCK_SIZE)
+    return path
+
+
+def received_ranges(session):
+    """
+    Collapse the received chunks into a list of ``[start, end)`` byte ranges.
+    """
+    ranges = []
+    chunks = UploadChunk.objects.filter(session=session).order_by("index")
+    for offset, size in chunks.values_list("offset", "size"):
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = offset + size
+        else:
+            ranges.append([offset, offset + size])
+    return ranges
+
+
+def complete_session(session):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.file_id is not None:
+            return session.file
+        if session.chunks.count() != session.total_chunks:
+            raise ChunkError("Upload is missing chunks.")
+        # Checked again, other uploads may have finished since the session began
+        quotas.check(session.owner_id, session.size)
+        file_obj = File(name=session.name, owner=session.owner)
+        with StagedFile(
+            open(assemble(session), "rb"), name=os.path.basename(session.name)
+        ) as staged:
+            content_type = mime.detect(staged)
+            blobs.attach(file_obj, blobs.store(staged), content_type)
+        file_obj.save()
+        session.file = file_obj
+        session.save(update_fields=["file", "updated_at"])
+        session.chunks.all().delete()
+    # Left behind when the content was already stored under the same digest
+    discard_partial(session)
+    return file_obj
+
+
+def discard_partial(session):
+    try:
+        shutil.rmtree(partial_dir(session))
+    except NotADirectoryError:
+        # Sessions begun before chunks were stored apart
+        os.remove(partial_dir(session))
+    except FileNotFoundError:
+        pass
+
+
+def abort_session(session):
+    discard_partial(session)
+    session.delete()
@@ -1,29 +1,121 @@
 from django.urls import path
 
 from .views import (
+    ChangeFeedAPIView,
+    FileArchiveAPIView,
+    FileBatchUploadAPIView,
+    FileBlocksAPIView,
+    FileDeltaAPIView,
+    FileDigestUploadAPIView,
+    FileDownloadAPIView,
+    FileLinkAPIView,
     FileListUploadAPIView,
+    FilePreviewAPIView,
     FileRetrieveUpdateDeleteAPIView,
     FileShareAPIView,
+    GroupDownloadAPIView,
     GroupListCreateAPIView,
     GroupRetrieveUpdateDeleteAPIView,
+    LinkDownloadAPIView,
+    LinkRevokeAPIView,
+    MetricsAPIView,
+    PermissionBulkAPIView,
+    SearchAPIView,
+    SearchSuggestAPIView,
+    SharedFileListAPIView,
+    StorageUsageAPIView,
+    UploadChunkAPIView,
+    UploadSessionAPIView,
+    UploadSessionCompleteAPIView,
+    UploadSessionCreateAPIView,
     UserLoginAPIView,
+    UserLogoutAPIView,
     UserRegistrationAPIView,
 )
 
 urlpatterns = [
     path("register/", UserRegistrationAPIView.as_view(), name="user-register"),
     path("login/", UserLoginAPIView.as_view(), name="user-login"),
+    path("logout/", UserLogoutAPIView.as_view(), name="user-logout"),
     path("upload/", FileListUploadAPIView.as_view(), name="file-upload"),
+    path(
+        "upload/digest/", FileDigestUploadAPIView.as_view(), name="file-upload-digest"
+    ),
+    path("upload/batch/", FileBatchUploadAPIView.as_view(), name="file-upload-batch"),
+    path(
+        "upload/sessions/",
+        UploadSessionCreateAPIView.as_view(),
+        name="upload-session-create",
+    ),
+    path(
+        "upload/sessions/<uuid:session_id>/",
+        UploadSessionAPIView.as_view(),
+        name="upload-session",
+    ),
+    path(
+        "upload/sessions/<uuid:session_id>/chunks/<int:index>/",
+        UploadChunkAPIView.as_view(),
+        name="upload-chunk",
+    ),
+    path(
+        "upload/sessions/<uuid:session_id>/complete/",
+        UploadSessionCompleteAPIView.as_view(),
+        name="upload-session-complete",
+    ),
     path("groups/", GroupListCreateAPIView.as_view(), name="groups-list-create"),
     path(
         "group/<int:group_id>/",
         GroupRetrieveUpdateDeleteAPIView.as_view(),
         name="group-retrieve-update-delete",
     ),
+    path(
+        "group/<int:group_id>/download/",
+        GroupDownloadAPIView.as_view(),
+        name="group-download",
+    ),
     path(
         "file/<int:file_id>/",
         FileRetrieveUpdateDeleteAPIView.as_view(),
         name="file-delete",
     ),
+    path(
+        "file/<int:file_id>/download/",
+        FileDownloadAPIView.as_view(),
+        name="file-download",
+    ),
+    path(
+        "file/<int:file_id>/link/",
+        FileLinkAPIView.as_view(),
+        name="file-link",
+    ),
+    path(
+        "file/<int:file_id>/blocks/",
+        FileBlocksAPIView.as_view(),
+        name="file-blocks",
+    ),
+    path(
+        "file/<int:file_id>/delta/",
+        FileDeltaAPIView.as_view(),
+        name="file-delta",
+    ),
+    path(
+        "file/<int:file_id>/preview/",
+        FilePreviewAPIView.as_view(),
+        name="file-preview",
+    ),
+    path("files/download/", FileArchiveAPIView.as_view(), name="file-archive"),
+    path("links/", LinkRevokeAPIView.as_view(), name="link-revoke"),
+    path("links/<str:token>/", LinkDownloadAPIView.as_view(), name="link-download"),
     path("share/<int:file_id>/", FileShareAPIView.as_view(), name="file-share"),
+    path("permissions/bulk/", PermissionBulkAPIView.as_view(), name="permission-bulk"),
+    path("usage/", StorageUsageAPIView.as_view(), name="storage-usage"),
+    path("changes/", ChangeFeedAPIView.as_view(), name="change-feed"),
+    path("shared/", SharedFileListAPIView.as_view(), name="file-shared-list"),
+    path("search/", SearchAPIView.as_view(), name="search"),
+    path(
+        "search/autocomplete/",
+        SearchSuggestAPIView.as_view(),
+        name="search-autocomplete",
+    ),
+    path("metrics/", MetricsAPIView.as_view(), name="metrics"),
 ]
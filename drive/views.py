@@ -1,38 +1,265 @@
+from functools import partial
+
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import generics, status
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import (
+    APIException,
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import File, Group, Sharing
-from .permissions import IsOwnerOrCheckPermission, IsOwnerOrReadOnly
+from . import (
+    access,
+    acl,
+    batch,
+    blobs,
+    changes,
+    delta,
+    grants,
+    links,
+    metrics,
+    previews,
+    quotas,
+    rows,
+    search,
+    streaming,
+    uploads,
+    zipstream,
+)
+from .models import File, FileAccess, Group, Sharing, UploadSession
+from .pagination import KeysetPagination
+from .permissions import (
+    CanReadMetrics,
+    IsOwnerOrCanIssueLink,
+    IsOwnerOrCheckPermission,
+    IsOwnerOrReadOnly,
+)
 from .serializers import (
+    FileAccessSerializer,
+    FileDeltaSerializer,
+    FileDigestSerializer,
+    FileLinkSerializer,
     FileSerializer,
     GroupSerializer,
+    PermissionBulkSerializer,
     SharingUserSerializer,
+    UploadSessionSerializer,
     UserSerializer,
 )
 
 
+class InsufficientStorage(APIException):
+    status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+    default_detail = "Storage quota exceeded."
+    default_code = "insufficient_storage"
+
+
+def check_quota(user_id, incoming):
+    try:
+        quotas.check(user_id, incoming)
+    except quotas.QuotaExceeded as exc:
+        raise InsufficientStorage(str(exc))
+
+
+def content_length(request):
+    # Known before the body is read, so uploads over quota are never received
+    try:
+        return int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return 0
+
+
+def requested_fields(request):
+    fields = request.query_params.get("fields")
+    return [field for field in fields.split(",") if field] if fields else None
+
+
+def prefetch_group_files(queryset, files_mode):
+    if files_mode == "summary":
+        return queryset.prefetch_related(
+            Prefetch("files", queryset=File.objects.only("id"))
+        )
+    return queryset.prefetch_related("files")
+
+
+def archive_compression(request):
+    if request.query_params.get("compression") == "deflate":
+        return zipstream.DEFLATED
+    return zipstream.STORED
+
+
+def project(queryset, fields):
+    """
+    Defer the columns a ``fields=`` projection leaves out of the response.
+    """
+    if not fields:
+        return queryset
+    concrete = {field.name for field in queryset.model._meta.concrete_fields}
+    return queryset.only("pk", "created_at", *(f for f in fields if f in concrete))
+
+
 class FileListUploadAPIView(APIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = FileSerializer
+    pagination_class = KeysetPagination
 
     def get(self, request, *args, **kwargs):
+        fields = requested_fields(request)
         files = File.objects.filter(owner=request.user)
-        serializer = self.serializer_class(files, many=True)
-        return Response(serializer.data)
+        if rows.ENABLED:
+            files = rows.file_values(files, fields)
+            render = partial(rows.render_files, fields=fields)
+        else:
+            files = project(files, fields)
+            render = partial(self.serialize, fields=fields)
+        paginator = self.pagination_class()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(files, request, view=self)
+            return paginator.get_paginated_response(render(page))
+        return Response(render(files))
+
+    def serialize(self, files, fields):
+        return self.serializer_class(files, many=True, fields=fields).data
 
     def post(self, request, *args, **kwargs):
+        check_quota(request.user.pk, content_length(request))
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save(owner=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class FileDigestUploadAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = FileDigestSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        check_quota(request.user.pk, serializer.validated_data["size"])
+        # Only content the user can already read is copied without its bytes,
+        # anything else must be uploaded
+        blob = blobs.find_readable(
+            serializer.validated_data["digest"],
+            serializer.validated_data["size"],
+            request.user.pk,
+        )
+        if blob is None:
+            raise NotFound("No readable file has this content, upload it instead.")
+        file_obj = File(name=serializer.validated_data["name"], owner=request.user)
+        blobs.attach(file_obj, blob)
+        file_obj.save()
+        return Response(FileSerializer(file_obj).data, status=status.HTTP_201_CREATED)
+
+
+class FileBatchUploadAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        check_quota(request.user.pk, content_length(request))
+        group = None
+        if request.data.get("group"):
+            group = get_object_or_404(
+                Group, pk=request.data["group"], owner=request.user
+            )
+        if "archive" in request.FILES:
+            items = batch.archive_items(request.FILES["archive"])
+        elif "files" in request.FILES:
+            items = batch.upload_items(request.FILES.getlist("files"))
+        else:
+            raise ValidationError({"detail": "Send either files or an archive."})
+        try:
+            results = batch.ingest(request.user, items, group=group)
+        except batch.ArchiveError as exc:
+            raise ValidationError({"detail": str(exc)})
+        except quotas.QuotaExceeded as exc:
+            raise InsufficientStorage(str(exc))
+        failed = any(result["status"] != "created" for result in results)
+        return Response(
+            {"files": results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED,
+        )
+
+
+class UploadSessionCreateAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = UploadSessionSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        check_quota(request.user.pk, serializer.validated_data["size"])
+        session = uploads.create_session(
+            owner=request.user, **serializer.validated_data
+        )
+        return Response(
+            self.serializer_class(session).data, status=status.HTTP_201_CREATED
+        )
+
+
+class UploadSessionAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = UploadSessionSerializer
+
+    def get(self, request, session_id, *args, **kwargs):
+        session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+        serializer = self.serializer_class(session)
+        return Response(serializer.data)
+
+    def delete(self, request, session_id, *args, **kwargs):
+        session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+        uploads.abort_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def put(self, request, session_id, index, *args, **kwargs):
+        session = get_object_or_404(
+            UploadSession, pk=session_id, owner=request.user, file__isnull=True
+        )
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or "")
+        except ValueError:
+            content_length = None
+        # Read the raw body in blocks instead of going through the parsers
+        try:
+            chunk = uploads.write_chunk(session, index, request.stream, content_length)
+        except uploads.ChunkError as exc:
+            raise ValidationError({"detail": str(exc)})
+        return Response(
+            {"index": chunk.index, "offset": chunk.offset, "size": chunk.size}
+        )
+
+
+class UploadSessionCompleteAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = FileSerializer
+
+    def post(self, request, session_id, *args, **kwargs):
+        session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+        try:
+            file_obj = uploads.complete_session(session)
+        except uploads.ChunkError as exc:
+            raise ValidationError({"detail": str(exc)})
+        except quotas.QuotaExceeded as exc:
+            raise InsufficientStorage(str(exc))
+        serializer = self.serializer_class(file_obj)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class FileRetrieveUpdateDeleteAPIView(APIView):
     permission_classes = (
         IsAuthenticated,
@@ -51,6 +278,11 @@ class FileRetrieveUpdateDeleteAPIView(APIView):
         file_obj = get_object_or_404(File, pk=file_id)
         # Check permissions
         self.check_object_permissions(request, file_obj)
+        if request.content_type.startswith("multipart/"):
+            # Replacing the content only adds what exceeds the current size
+            check_quota(
+                file_obj.owner_id, content_length(request) - (file_obj.size or 0)
+            )
         serializer = self.serializer_class(file_obj, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -64,6 +296,316 @@ class FileRetrieveUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class FileBlocksAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCheckPermission,
+    )
+
+    def get(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File.objects.select_related("blob"), pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        if not file_obj.file:
+            raise NotFound("File has no content.")
+        try:
+            block_size = int(request.query_params.get("block_size", delta.BLOCK_SIZE))
+        except ValueError:
+            raise ValidationError({"block_size": "A number is required."})
+        if not delta.MIN_BLOCK_SIZE <= block_size <= delta.MAX_BLOCK_SIZE:
+            raise ValidationError(
+                {
+                    "block_size": f"Must be between {delta.MIN_BLOCK_SIZE} "
+                    f"and {delta.MAX_BLOCK_SIZE}."
+                }
+            )
+        return Response(
+            {
+                "digest": delta.current_digest(file_obj),
+                "size": file_obj.file.size,
+                "block_size": block_size,
+                "blocks": delta.signatures(file_obj, block_size),
+            }
+        )
+
+
+class FileDeltaAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCheckPermission,
+    )
+    serializer_class = FileDeltaSerializer
+
+    def put(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File.objects.select_related("blob"), pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if not file_obj.file or delta.current_digest(file_obj) != data["base"]:
+            return Response(
+                {"detail": "The file changed, fetch its blocks again."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            size = delta.validate_manifest(
+                data["manifest"], request.FILES, file_obj.file.size, data["block_size"]
+            )
+        except delta.DeltaError as exc:
+            raise ValidationError({"manifest": str(exc)})
+        # Refused before a byte of it is written
+        check_quota(file_obj.owner_id, size - (file_obj.size or 0))
+        staged = delta.apply(
+            file_obj, data["manifest"], request.FILES, data["block_size"]
+        )
+        with staged, transaction.atomic():
+            if data.get("digest", staged.sha256) != staged.sha256:
+                raise ValidationError({"digest": "The rebuilt content doesn't match."})
+            check_quota(file_obj.owner_id, staged.size - (file_obj.size or 0))
+            blob = blobs.store(staged)
+            # Blobs are immutable, only the row has to be checked again
+            file_obj = File.objects.select_for_update().get(pk=file_obj.pk)
+            if file_obj.checksum and file_obj.checksum != data["base"]:
+                return Response(
+                    {"detail": "The file changed, fetch its blocks again."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            blobs.attach(file_obj, blob, staged.detected_content_type)
+            file_obj.save()
+        return Response(FileSerializer(file_obj).data)
+
+
+class FileDownloadAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCheckPermission,
+    )
+
+    def get(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File.objects.select_related("blob"), pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        return streaming.serve_file(request, file_obj)
+
+
+class FileLinkAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCanIssueLink,
+    )
+    serializer_class = FileLinkSerializer
+
+    def post(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File.objects.select_related("blob"), pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, expires_at = links.issue(
+            file_obj, request.user, serializer.validated_data["expires_in"]
+        )
+        url = reverse("link-download", kwargs={"token": token})
+        return Response(
+            {
+                "url": request.build_absolute_uri(url),
+                "expires_at": expires_at,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    def delete(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File, pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        links.revoke_file(file_obj.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class LinkRevokeAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def delete(self, request, *args, **kwargs):
+        # Every link the user has issued, whatever the file
+        links.revoke_user(request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class LinkDownloadAPIView(APIView):
+    # The signed token is the credential, checking it needs no query
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get(self, request, token, *args, **kwargs):
+        try:
+            file_obj = links.verify(token)
+        except links.LinkError as exc:
+            raise PermissionDenied(str(exc))
+        as_attachment = request.query_params.get("inline") not in ("1", "true")
+        return streaming.serve_file(request, file_obj, as_attachment)
+
+
+class FilePreviewAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCheckPermission,
+    )
+
+    def get(self, request, file_id, *args, **kwargs):
+        file_obj = get_object_or_404(File.objects.select_related("blob"), pk=file_id)
+        # Check permissions
+        self.check_object_permissions(request, file_obj)
+        try:
+            size = int(request.query_params.get("size", previews.SIZES[0]))
+        except ValueError:
+            size = None
+        if size not in previews.SIZES:
+            raise ValidationError({"size": f"Must be one of {list(previews.SIZES)}."})
+        if file_obj.blob_id is None:
+            raise NotFound("No preview for this file.")
+        try:
+            path = previews.get_or_create(file_obj.blob, size, file_obj.content_type)
+        except previews.PreviewUnavailable as exc:
+            raise NotFound(str(exc))
+        return streaming.serve_preview(
+            request, uploads.file_storage(), path, file_obj.blob.digest, size
+        )
+
+
+class SharedFileListAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = FileAccessSerializer
+
+    def get(self, request, *args, **kwargs):
+        grants = FileAccess.objects.filter(user=request.user)
+        if request.query_params.get("include_owned") not in ("1", "true"):
+            grants = grants.exclude(source=FileAccess.OWNER)
+        grants = grants.order_by("-file_id")
+        if rows.ENABLED:
+            return Response(rows.render_access(rows.access_values(grants)))
+        serializer = self.serializer_class(grants.select_related("file"), many=True)
+        return Response(serializer.data)
+
+
+def search_query(request):
+    query = request.query_params.get("q", "")
+    if not search.words(query):
+        raise ValidationError({"q": "Enter the words to search for."})
+    return query
+
+
+def search_limit(request, default, maximum):
+    try:
+        limit = int(request.query_params["limit"])
+    except (KeyError, ValueError):
+        return default
+    return min(max(limit, 1), maximum)
+
+
+class SearchAPIView(APIView):
+    """
+    Files the user owns or was granted, and groups they own, whose name
+    matches every word of ``q``.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    group_fields = ("id", "name")
+
+    def get(self, request, *args, **kwargs):
+        query = search_query(request)
+        limit = search_limit(request, search.LIMIT, search.MAX_LIMIT)
+        grants = search.files(request.user, query)
+        groups = search.groups(request.user, query)
+        if rows.ENABLED:
+            files = rows.render_access(rows.access_values(grants)[:limit])
+            groups = rows.render_groups(
+                rows.group_values(groups)[:limit], fields=self.group_fields
+            )
+        else:
+            files = FileAccessSerializer(
+                grants.select_related("file")[:limit], many=True
+            ).data
+            groups = GroupSerializer(
+                groups[:limit], many=True, fields=self.group_fields
+            ).data
+        return Response({"files": files, "groups": groups})
+
+
+class SearchSuggestAPIView(APIView):
+    """
+    Names of the files and groups the user can see starting with ``q``.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        query = search_query(request)
+        limit = search_limit(request, search.SUGGESTIONS, search.MAX_LIMIT)
+        return Response({"suggestions": search.suggest(request.user, query, limit)})
+
+
+class FileArchiveAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsOwnerOrCheckPermission,
+    )
+
+    def get(self, request, *args, **kwargs):
+        try:
+            file_ids = {int(pk) for pk in request.query_params["ids"].split(",")}
+        except (KeyError, ValueError):
+            raise ValidationError({"ids": "A comma separated list of file ids."})
+        files = list(
+            File.objects.filter(pk__in=file_ids).select_related("blob").order_by("pk")
+        )
+        if len(files) != len(file_ids):
+            raise NotFound()
+        # Check permissions, resolving every file's access in one query
+        acl.prime(request, files)
+        for file_obj in files:
+            self.check_object_permissions(request, file_obj)
+        return streaming.serve_archive(files, "files.zip", archive_compression(request))
+
+
+class StorageUsageAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        used, quota = quotas.get_usage(request.user.pk)
+        return Response(
+            {
+                "used": used,
+                "quota": quota,
+                "available": None if quota is None else max(quota - used, 0),
+            }
+        )
+
+
+class ChangeFeedAPIView(APIView):
+    """
+    Changes visible to the user after ``cursor``. Without a cursor, returns
+    the current one so the client can list everything once and then follow
+    the feed. ``wait`` keeps the request open until something changes.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
+
+    def get(self, request, *args, **kwargs):
+        if "cursor" not in request.query_params:
+            cursor = changes.latest_cursor(request.user.pk)
+            return Response({"cursor": cursor, "changes": [], "reset": True})
+        limit = self.pagination_class().get_page_size(request)
+        try:
+            wait = float(request.query_params.get("wait", 0))
+            result = changes.page(
+                request.user.pk, request.query_params["cursor"], limit, max(wait, 0)
+            )
+        except ValueError:
+            raise ValidationError({"detail": "Invalid cursor or wait."})
+        return Response(result)
+
+
 class FileShareAPIView(APIView):
     permission_classes = (
         IsAuthenticated,
@@ -83,21 +625,72 @@ class FileShareAPIView(APIView):
             Sharing(shared_file=file_obj, shared_with=user, shared_by=request.user)
             for user in users
         ]
-        # Bulk create Sharing objects
-        Sharing.objects.bulk_create(sharing_objects)
+        # Sharing again with the same user is a no-op
+        Sharing.objects.bulk_create(sharing_objects, ignore_conflicts=True)
+        # bulk_create() doesn't send signals, update the access index explicitly
+        access.sync([(file_obj.pk, user.pk) for user in users])
         return Response(
             {"message": f"File shared successfully"}, status=status.HTTP_201_CREATED
         )
 
 
+class PermissionBulkAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = PermissionBulkSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            results = grants.apply(
+                request.user,
+                data["action"],
+                data["users"],
+                file_ids=data["files"],
+                group_ids=data["groups"],
+                level=data.get("permission"),
+            )
+        except grants.GrantError as exc:
+            raise ValidationError({"detail": str(exc)})
+        failed = any(
+            result["status"] in (grants.FORBIDDEN, grants.NOT_FOUND)
+            for result in results
+        )
+        return Response(
+            {"results": results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK,
+        )
+
+
 class GroupListCreateAPIView(APIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = GroupSerializer
+    pagination_class = KeysetPagination
 
     def get(self, request, *args, **kwargs):
+        fields = requested_fields(request)
+        files_mode = request.query_params.get("files")
         groups = Group.objects.filter(owner=request.user)
-        serializer = self.serializer_class(groups, many=True)
-        return Response(serializer.data)
+        if rows.ENABLED:
+            groups = rows.group_values(groups)
+            render = partial(rows.render_groups, fields=fields, files_mode=files_mode)
+        else:
+            groups = project(groups, fields)
+            if not fields or "files" in fields:
+                groups = prefetch_group_files(groups, files_mode)
+            context = {"request": request, "files": files_mode}
+            render = partial(self.serialize, fields=fields, context=context)
+        paginator = self.pagination_class()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(groups, request, view=self)
+            return paginator.get_paginated_response(render(page))
+        return Response(render(groups))
+
+    def serialize(self, groups, fields, context):
+        return self.serializer_class(
+            groups, many=True, fields=fields, context=context
+        ).data
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(
@@ -116,10 +709,12 @@ class GroupRetrieveUpdateDeleteAPIView(APIView):
     serializer_class = GroupSerializer
 
     def get(self, request, group_id, *args, **kwargs):
-        group = get_object_or_404(Group, pk=group_id)
+        files_mode = request.query_params.get("files")
+        groups = prefetch_group_files(Group.objects.all(), files_mode)
+        group = get_object_or_404(groups, pk=group_id)
         # Check permissions
         self.check_object_permissions(request, group)
-        serializer = self.serializer_class(group)
+        serializer = self.serializer_class(group, context={"files": files_mode})
         return Response(serializer.data)
 
     def put(self, request, group_id, *args, **kwargs):
@@ -139,6 +734,26 @@ class GroupRetrieveUpdateDeleteAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class GroupDownloadAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, group_id, *args, **kwargs):
+        # Groups are private to their owner, others can't tell they exist
+        group = get_object_or_404(Group, pk=group_id, owner=request.user)
+        files = list(group.files.select_related("blob").order_by("pk"))
+        # Only the files the user could download one by one are archived
+        acl.prime(request, files)
+        file_permission = IsOwnerOrCheckPermission()
+        files = [
+            file_obj
+            for file_obj in files
+            if file_permission.has_object_permission(request, self, file_obj)
+        ]
+        return streaming.serve_archive(
+            files, f"{group.name}.zip", archive_compression(request)
+        )
+
+
 class UserRegistrationAPIView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -160,3 +775,19 @@ class UserLoginAPIView(ObtainAuthToken):
         user = serializer.validated_data["user"]
         token, created = Token.objects.get_or_create(user=user)
         return Response({"token": token.key}, status=status.HTTP_200_OK)
+
+
+class UserLogoutAPIView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        # Deleting the token also drops it from the authentication cache
+        Token.objects.filter(user=request.user).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricsAPIView(APIView):
+    permission_classes = (CanReadMetrics,)
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,200 @@
+import struct
+import time
+import zlib
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+STORED = 0
+DEFLATED = 8
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+DATA_DESCRIPTOR = struct.Struct("<4sLLL")
+DATA_DESCRIPTOR64 = struct.Struct("<4sLQQ")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<4sHHHHLLH")
+END_OF_CENTRAL_DIRECTORY64 = struct.Struct("<4sQHHLLQQQQ")
+END_OF_CENTRAL_DIRECTORY64_LOCATOR = struct.Struct("<4sLQL")
+
+
+class ZipMember:
+    """
+    A file to add to a streamed archive. ``chunks`` is a callable returning
+    an iterable of bytes, ``size`` and ``crc32`` are optional and let stored
+    members be written without a trailing data descriptor.
+    """
+
+    def __init__(self, name, chunks, size=None, crc32=None, modified=None):
+        self.name = name
+        self.chunks = chunks
+        self.size = size
+        self.crc32 = crc32
+        self.modified = modified or time.time()
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    clock = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, clock
+
+
+def zip64_extra(*values):
+    return struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values)
+
+
+class ZipStream:
+    """
+    Generate a ZIP archive as a stream of bytes, with constant memory and
+    without seeking, so it can be sent while it is being built.
+    """
+
+    def __init__(self, compression=STORED):
+        self.compression = compression
+        self.offset = 0
+        self.entries = []
+
+    def stream(self, members):
+        for member in members:
+            yield from self.write_member(member)
+        yield from self.write_central_directory()
+
+    def write_member(self, member):
+        name = member.name.encode("utf-8")
+        date, clock = dos_datetime(member.modified)
+        # Stored members of known size and CRC are described up front
+        known = (
+            self.compression == STORED
+            and member.size is not None
+            and member.crc32 is not None
+        )
+        flags = FLAG_UTF8 if known else FLAG_UTF8 | FLAG_DATA_DESCRIPTOR
+        zip64 = member.size is None or member.size * 1.05 > ZIP64_LIMIT
+        if known:
+            crc, size = member.crc32, member.size
+            extra = zip64_extra(size, size) if zip64 else b""
+            header_size = ZIP64_LIMIT if zip64 else size
+        else:
+            crc, size = 0, 0
+            extra = zip64_extra(0, 0) if zip64 else b""
+            header_size = ZIP64_LIMIT if zip64 else 0
+        header_offset = self.offset
+        header = LOCAL_HEADER.pack(
+            b"PK\x03\x04",
+            45 if zip64 else 20,
+            flags,
+            self.compression,
+            clock,
+            date,
+            crc,
+            header_size,
+            header_size,
+            len(name),
+            len(extra),
+        )
+        yield self.emit(header + name + extra)
+
+        compressor = None
+        if self.compression == DEFLATED:
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15
+            )
+        running_crc = 0
+        file_size = 0
+        compress_size = 0
+        for chunk in member.chunks():
+            file_size += len(chunk)
+            if not known:
+                running_crc = zlib.crc32(chunk, running_crc)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                compress_size += len(chunk)
+                yield self.emit(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            yield self.emit(chunk)
+
+        if known:
+            if file_size != member.size:
+                raise ValueError(f"{member.name} changed while it was archived.")
+        else:
+            crc = running_crc
+            if zip64:
+                descriptor = DATA_DESCRIPTOR64.pack(
+                    b"PK\x07\x08", crc, compress_size, file_size
+                )
+            else:
+                descriptor = DATA_DESCRIPTOR.pack(
+                    b"PK\x07\x08", crc, compress_size, file_size
+                )
+            yield self.emit(descriptor)
+        self.entries.append(
+            (name, flags, clock, date, crc, compress_size, file_size, header_offset)
+        )
+
+    def write_central_directory(self):
+        start = self.offset
+        for entry in self.entries:
+            name, flags, clock, date, crc, compress_size, file_size, offset = entry
+            values = []
+            if file_size >= ZIP64_LIMIT:
+                values.append(file_size)
+                file_size = ZIP64_LIMIT
+            if compress_size >= ZIP64_LIMIT:
+                values.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if offset >= ZIP64_LIMIT:
+                values.append(offset)
+                offset = ZIP64_LIMIT
+            extra = zip64_extra(*values) if values else b""
+            version = 45 if values else 20
+            yield self.emit(
+                CENTRAL_HEADER.pack(
+                    b"PK\x01\x02",
+                    3 << 8 | version,  # made by Unix, so the mode bits apply
+                    version,
+                    flags,
+                    self.compression,
+                    clock,
+                    date,
+                    crc,
+                    compress_size,
+                    file_size,
+                    len(name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0o100644 << 16,
+                    offset,
+                )
+                + name
+                + extra
+            )
+        count = len(self.entries)
+        size = self.offset - start
+        trailer = b""
+        if count > ZIP_FILECOUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            trailer += END_OF_CENTRAL_DIRECTORY64.pack(
+                b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, size, start
+            )
+            trailer += END_OF_CENTRAL_DIRECTORY64_LOCATOR.pack(
+                b"PK\x06\x07", 0, self.offset, 1
+            )
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            size = min(size, ZIP64_LIMIT)
+            start = min(start, ZIP64_LIMIT)
+        trailer += END_OF_CENTRAL_DIRECTORY.pack(
+            b"PK\x05\x06", 0, 0, count, count, size, start, 0
+        )
+        yield self.emit(trailer)
+
+    def emit(self, data):
+        self.offset += len(data)
+        return data